@@ -0,0 +1,18 @@
+import hmac
+import os
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+# Admin endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN and token and hmac.compare_digest(token, ADMIN_TOKEN))
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dependency that only lets requests with the right X-Admin-Token through"""
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
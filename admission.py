@@ -0,0 +1,159 @@
+"""Admission control for model calls.
+
+At most UPSTREAM_CONCURRENCY calls run at once (upstream.py). Further calls
+wait in a bounded priority queue: turns of a continuing conversation go
+ahead of new questions, and background summaries go last. A call is shed
+with Overloaded instead of queued when the queue is full or when its
+expected wait exceeds ADMISSION_MAX_WAIT, and a queued call that has
+waited that long is shed as well. The app turns Overloaded into 503 with
+Retry-After on HTTP and close code 1013 on WebSockets.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import os
+from typing import List, Optional, Tuple
+
+from metrics import ADMISSION_SHED
+
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "128"))
+# Seconds a model call may wait for a slot before it is shed
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "5"))
+# Weight of the latest call in the moving average of slot hold times
+ADMISSION_EWMA_ALPHA = float(os.getenv("ADMISSION_EWMA_ALPHA", "0.2"))
+# Messages a WebSocket client may have waiting behind the one being answered
+WS_MAX_PENDING = int(os.getenv("WS_MAX_PENDING", "4"))
+
+# Lower runs first
+CONTINUING = 0
+NEW = 1
+BACKGROUND = 2
+
+priority_var: contextvars.ContextVar[int] = contextvars.ContextVar("admission_priority", default=NEW)
+
+
+class Overloaded(Exception):
+    """A model call was refused because the service is saturated"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Service overloaded ({reason}), retry after {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionController:
+    """Concurrency limit with a bounded priority queue and wait-based shedding"""
+
+    def __init__(self, concurrency: int, queue_size: int = ADMISSION_QUEUE_SIZE,
+                 max_wait: float = ADMISSION_MAX_WAIT):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.running = 0
+        self.service_time = 0.0  # moving average of how long a call holds its slot
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self.counters = {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_wait": 0,
+                         "shed_timeout": 0, "displaced": 0}
+
+    def estimated_wait(self, priority: int) -> float:
+        """Expected seconds until a call of this priority would get a slot"""
+        if self.running < self.concurrency and not self._waiters:
+            return 0.0
+        ahead = sum(1 for waiter in self._waiters if waiter[0] <= priority)
+        # One of the running calls finishes every service_time / concurrency seconds on average
+        return (ahead + 1) * self.service_time / self.concurrency
+
+    def check(self, priority: Optional[int] = None):
+        """Raise Overloaded if a call of this priority would be shed right now"""
+        priority = priority_var.get() if priority is None else priority
+        if self.running < self.concurrency and not self._waiters:
+            return
+        wait = self.estimated_wait(priority)
+        if wait > self.max_wait:
+            self._shed("wait", wait)
+        if len(self._waiters) >= self.queue_size and not self._can_displace(priority):
+            self._shed("queue_full", wait)
+
+    async def acquire(self, priority: Optional[int] = None):
+        priority = priority_var.get() if priority is None else priority
+        if self.running < self.concurrency and not self._waiters:
+            self.running += 1
+            self.counters["admitted"] += 1
+            return
+        self.check(priority)
+        if len(self._waiters) >= self.queue_size:
+            self._displace()
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._sequence), future)
+        heapq.heappush(self._waiters, entry)
+        self.counters["queued"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            if not self._abandon(entry):
+                self.running -= 1
+                self._wake()
+            self._shed("timeout", self.estimated_wait(priority))
+        except asyncio.CancelledError:
+            # The slot may have been handed over just as the caller went away
+            if not self._abandon(entry):
+                self.running -= 1
+                self._wake()
+            raise
+        self.counters["admitted"] += 1
+
+    def release(self, held: float):
+        """Free a slot; `held` is how long the call kept it"""
+        if self.service_time:
+            self.service_time += ADMISSION_EWMA_ALPHA * (held - self.service_time)
+        else:
+            self.service_time = held
+        self.running -= 1
+        self._wake()
+
+    def stats(self) -> dict:
+        return {"running": self.running, "waiting": len(self._waiters),
+                "service_seconds": round(self.service_time, 3), **self.counters}
+
+    def _wake(self):
+        # A slot is free: hand it to the best waiter still waiting
+        while self._waiters and self.running < self.concurrency:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.running += 1
+            future.set_result(None)
+
+    def _abandon(self, entry) -> bool:
+        """Take a waiter out of the queue; False if it had already been given a slot"""
+        future = entry[2]
+        if future.done() and not future.cancelled() and future.exception() is None:
+            return False
+        future.cancel()
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+        return True
+
+    def _can_displace(self, priority: int) -> bool:
+        return any(waiter[0] > priority and not waiter[2].done() for waiter in self._waiters)
+
+    def _displace(self):
+        """Shed the newest waiter of the lowest priority to make room for a more urgent call"""
+        candidates = [waiter for waiter in self._waiters if not waiter[2].done()]
+        if not candidates:
+            return
+        victim = max(candidates, key=lambda waiter: (waiter[0], waiter[1]))
+        self._waiters.remove(victim)
+        heapq.heapify(self._waiters)
+        self.counters["displaced"] += 1
+        ADMISSION_SHED.labels("displaced").inc()
+        victim[2].set_exception(Overloaded("displaced", self.estimated_wait(victim[0])))
+
+    def _shed(self, reason: str, wait: float):
+        self.counters[f"shed_{reason}"] += 1
+        ADMISSION_SHED.labels(reason).inc()
+        raise Overloaded(reason, wait or self.max_wait)
@@ -0,0 +1,144 @@
+"""Pools of agents built from one immutable configuration, one agent per run.
+
+agno's Agent is not safe to share between concurrent runs: arun() sets
+run, stream and session fields on the instance, and its memory keeps every
+run, so a shared agent grows without bound and each run re-serializes the
+whole session. An AgentPool hands every run its own agent instead. Agents
+are cheap to build (tens of microseconds, see bench/agents.py) because they
+share the model client and its connection pool (upstream.get_async_client).
+
+After a successful run an agent's run state and memory are cleared and it
+goes back to the pool, which keeps up to AGENT_POOL_SIZE idle agents; an
+agent whose run failed or was cancelled is dropped.
+
+A pool runs like an agent (arun, model), so routing, resilience and
+single-flight take either.
+"""
+import os
+from typing import TYPE_CHECKING, Any, AsyncIterator, List, NamedTuple, Optional, Tuple
+
+from upstream import UPSTREAM_CONCURRENCY, groq_model
+
+if TYPE_CHECKING:
+    from agno.agent import Agent
+
+# Idle agents kept per pool; runs beyond that build an agent and drop it afterwards
+AGENT_POOL_SIZE = int(os.getenv("AGENT_POOL_SIZE", str(UPSTREAM_CONCURRENCY)))
+
+
+class AgentSpec(NamedTuple):
+    """Everything needed to build an agent"""
+    name: str
+    model_id: str
+    role: Optional[str] = None
+    instructions: Tuple[str, ...] = ()
+    markdown: bool = False
+    # Toolkits are shared by every agent built from the spec
+    tools: Tuple[Any, ...] = ()
+    show_tool_calls: bool = False
+
+    def build(self) -> "Agent":
+        from agno.agent import Agent
+
+        return Agent(
+            name=self.name,
+            role=self.role,
+            model=groq_model(self.model_id),
+            instructions=list(self.instructions),
+            markdown=self.markdown,
+            tools=list(self.tools) or None,
+            show_tool_calls=self.show_tool_calls,
+            # Telemetry posts each run to agno's API before arun returns; AGNO_TELEMETRY=true turns it on
+            telemetry=False,
+        )
+
+
+class AgentPool:
+    """Idle agents of one spec, leased for one run at a time"""
+
+    def __init__(self, spec: AgentSpec, size: int = AGENT_POOL_SIZE):
+        self.spec = spec
+        self.size = size
+        self._idle: List["Agent"] = []
+        self.leased = 0
+        self.counters = {"created": 0, "reused": 0, "discarded": 0}
+        # Read by routing, resilience and single-flight like an agent's model; never run directly
+        self.model = groq_model(spec.model_id)
+        _pools.append(self)
+
+    @property
+    def name(self) -> str:
+        return self.spec.name
+
+    def warm(self, count: int = 1):
+        """Build idle agents up front, so agno is imported before the first request"""
+        while len(self._idle) < min(count, self.size):
+            self.counters["created"] += 1
+            self._idle.append(self.spec.build())
+
+    def acquire(self) -> "Agent":
+        self.leased += 1
+        if self._idle:
+            self.counters["reused"] += 1
+            return self._idle.pop()
+        self.counters["created"] += 1
+        return self.spec.build()
+
+    def release(self, agent: "Agent", reusable: bool = True):
+        """Return an agent after its run; `reusable` is False if the run did not finish cleanly"""
+        self.leased -= 1
+        if not reusable or len(self._idle) >= self.size:
+            self.counters["discarded"] += 1
+            return
+        agent.reset_run_state()
+        agent.reset_session()
+        if agent.memory is not None:
+            agent.memory.clear()
+        self._idle.append(agent)
+
+    async def arun(self, message: Any = None, *, stream: bool = False, **kwargs) -> Any:
+        """Agent.arun on a leased agent; a stream keeps its agent until it is exhausted or closed"""
+        agent = self.acquire()
+        if not stream:
+            reusable = False
+            try:
+                response = await agent.arun(message, stream=False, **kwargs)
+                reusable = True
+                return response
+            finally:
+                self.release(agent, reusable)
+        try:
+            events = await agent.arun(message, stream=True, **kwargs)
+        except BaseException:
+            self.release(agent, False)
+            raise
+        return self._stream(agent, events)
+
+    async def _stream(self, agent: "Agent", events: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        reusable = False
+        try:
+            async for event in events:
+                yield event
+            reusable = True
+        finally:
+            try:
+                # Closing the run's generator ends its model stream
+                if hasattr(events, "aclose"):
+                    await events.aclose()
+            finally:
+                self.release(agent, reusable)
+
+    def stats(self) -> dict:
+        return {"idle": len(self._idle), "leased": self.leased, **self.counters}
+
+
+_pools: List[AgentPool] = []
+
+
+def stats() -> dict:
+    """Totals over every pool, for /metrics"""
+    totals = {"pools": len(_pools), "idle": 0, "leased": 0, "created": 0, "reused": 0, "discarded": 0}
+    for pool in _pools:
+        for key, value in pool.stats().items():
+            totals[key] += value
+    return totals
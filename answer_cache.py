@@ -0,0 +1,259 @@
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, FrozenSet, List, Optional, Set
+
+from shared_state import SharedStore, get_shared_store, store_call
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.8"))
+# Looser match used only when the model cannot answer (resilience.py)
+ANSWER_CACHE_FALLBACK_SIMILARITY = float(os.getenv("ANSWER_CACHE_FALLBACK_SIMILARITY", "0.5"))
+
+# Questions with fewer content words than this are only matched exactly,
+# "hi" and "help" are too short to call anything a near-duplicate of them
+MIN_SIMILAR_TOKENS = 3
+MAX_ALIASES = 8
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+_STOPWORDS = frozenset({
+    "a", "an", "the", "my", "i", "me", "is", "are", "am", "was", "were", "be",
+    "do", "does", "did", "have", "has", "had", "will", "would", "should", "could",
+    "to", "of", "for", "on", "in", "it", "can", "you", "please", "hi", "hello",
+})
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", text.lower())).strip()
+
+
+def _stem(word: str) -> str:
+    for suffix in ("ing", "ed", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def question_terms(normalized: str) -> List[str]:
+    """Stemmed content words of a normalized question, in order and with repeats"""
+    return [_stem(w) for w in normalized.split() if w not in _STOPWORDS]
+
+
+def question_tokens(normalized: str) -> FrozenSet[str]:
+    return frozenset(question_terms(normalized))
+
+
+class _Entry:
+    __slots__ = ("key", "answer", "tokens", "expires_at", "aliases")
+
+    def __init__(self, key: str, answer: str, tokens: FrozenSet[str], expires_at: float):
+        self.key = key
+        self.answer = answer
+        self.tokens = tokens
+        self.expires_at = expires_at
+        self.aliases: List[str] = []
+
+
+class AnswerCache:
+    """LRU + TTL cache of answers to stateless questions.
+
+    Lookups try the exact question text, then its normalized form, then the
+    closest cached question by token overlap (Jaccard) above the similarity
+    threshold. With a shared store, the async methods also read and write a
+    second tier keyed by normalized question, so workers share answers.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 similarity: float = ANSWER_CACHE_SIMILARITY, shared: Optional[SharedStore] = None):
+        self.shared = shared if shared is not None else get_shared_store()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()  # normalized question -> entry
+        self._exact: Dict[str, str] = {}  # raw question -> normalized question
+        self._by_token: Dict[str, Set[str]] = {}  # token -> normalized questions
+        self.counters = {
+            "hits_exact": 0,
+            "hits_normalized": 0,
+            "hits_similar": 0,
+            "hits_shared": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, question: str) -> Optional[str]:
+        now = time.monotonic()
+
+        key = self._exact.get(question)
+        if key is not None:
+            entry = self._live_entry(key, now)
+            if entry is not None:
+                self.counters["hits_exact"] += 1
+                return entry.answer
+
+        key = normalize_question(question)
+        entry = self._live_entry(key, now)
+        if entry is not None:
+            self.counters["hits_normalized"] += 1
+            self._add_alias(entry, question)
+            return entry.answer
+
+        entry = self._most_similar(question_tokens(key), now)
+        if entry is not None:
+            self.counters["hits_similar"] += 1
+            return entry.answer
+
+        self.counters["misses"] += 1
+        return None
+
+    def peek(self, question: str) -> Optional[str]:
+        """The cached answer to the normalized question, without counting a hit or refreshing it"""
+        entry = self._entries.get(normalize_question(question))
+        if entry is None or entry.expires_at <= time.monotonic():
+            return None
+        return entry.answer
+
+    def set(self, question: str, answer: str):
+        answer = answer.strip()
+        key = normalize_question(question)
+        if not answer or not key or self.max_entries <= 0:
+            return
+
+        self._remove(key)
+        entry = _Entry(key, answer, question_tokens(key), time.monotonic() + self.ttl)
+        self._entries[key] = entry
+        self._add_alias(entry, question)
+        for token in entry.tokens:
+            self._by_token.setdefault(token, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.counters["evictions"] += 1
+
+    def closest(self, question: str, similarity: float = ANSWER_CACHE_FALLBACK_SIMILARITY) -> Optional[str]:
+        """Answer to the most similar cached question at a looser threshold than get()"""
+        entry = self._most_similar(question_tokens(normalize_question(question)), time.monotonic(), similarity)
+        return entry.answer if entry is not None else None
+
+    def purge(self, question: Optional[str] = None) -> int:
+        """Drop one question (by its normalized form) or everything; returns the count removed"""
+        if question is None:
+            count = len(self._entries)
+            self._entries.clear()
+            self._exact.clear()
+            self._by_token.clear()
+            return count
+        return 1 if self._remove(normalize_question(question)) else 0
+
+    async def aget(self, question: str) -> Optional[str]:
+        """get(), falling back to the shared tier on a local miss"""
+        answer = self.get(question)
+        if answer is not None or self.shared is None:
+            return answer
+        answer = await store_call(self.shared, self.shared.get, "answer:" + normalize_question(question))
+        if answer is not None:
+            self.counters["hits_shared"] += 1
+            self.set(question, answer)
+        return answer
+
+    async def aset(self, question: str, answer: str):
+        self.set(question, answer)
+        key = normalize_question(question)
+        answer = answer.strip()
+        if self.shared is not None and key and answer:
+            await store_call(self.shared, self.shared.set, "answer:" + key, answer, self.ttl)
+
+    async def apurge(self, question: Optional[str] = None) -> int:
+        purged = self.purge(question)
+        if self.shared is not None:
+            if question is None:
+                await store_call(self.shared, self.shared.delete_prefix, "answer:")
+            else:
+                await store_call(self.shared, self.shared.delete, "answer:" + normalize_question(question))
+        return purged
+
+    def stats(self) -> dict:
+        hits = self.counters["hits_exact"] + self.counters["hits_normalized"] + self.counters["hits_similar"]
+        # Shared-tier hits were counted as local misses first
+        lookups = hits + self.counters["misses"]
+        hits += self.counters["hits_shared"]
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            **self.counters,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+    async def stream_through(self, question: str, deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Pass a stream of deltas through, caching the full answer once it completes"""
+        parts = []
+        async for delta in deltas:
+            parts.append(delta)
+            yield delta
+        await self.aset(question, "".join(parts))
+
+    def _live_entry(self, key: str, now: float) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self._remove(key)
+            self.counters["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _most_similar(self, tokens: FrozenSet[str], now: float,
+                      similarity: Optional[float] = None) -> Optional[_Entry]:
+        if len(tokens) < MIN_SIMILAR_TOKENS:
+            return None
+
+        candidates: Set[str] = set()
+        for token in tokens:
+            candidates.update(self._by_token.get(token, ()))
+
+        best_key, best_score = None, self.similarity if similarity is None else similarity
+        for key in candidates:
+            other = self._entries[key].tokens
+            score = len(tokens & other) / len(tokens | other)
+            if score >= best_score:
+                best_key, best_score = key, score
+
+        if best_key is None:
+            return None
+        return self._live_entry(best_key, now)
+
+    def _add_alias(self, entry: _Entry, question: str):
+        if question in self._exact or len(entry.aliases) >= MAX_ALIASES:
+            return
+        entry.aliases.append(question)
+        self._exact[question] = entry.key
+
+    def _remove(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        for alias in entry.aliases:
+            self._exact.pop(alias, None)
+        for token in entry.tokens:
+            keys = self._by_token.get(token)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_token[token]
+        return True
+
+
+async def iter_cached(answer: str) -> AsyncIterator[str]:
+    """A cached answer as a single-delta stream"""
+    yield answer
@@ -1,24 +1,65 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+import time
+
+# Taken before the other imports so startup timings include them
+_STARTED = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
-from agno.agent import Agent
-from agno.models.groq import Groq
-from agno.utils.pprint import pprint_run_response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware import Middleware
-from fastapi import Request
-from fastapi.responses import JSONResponse
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-import traceback   # Add this at the top
-import json
-import time
-from typing import Dict, List
+from fastapi import Request, Depends
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import asyncio
+import functools
+import logging
+import math
+from typing import AsyncIterator, Awaitable, Callable, Optional
+from upstream import admission, extract_response_text, close_async_client
+import agent_pool
+from agent_pool import AgentPool, AgentSpec
+from admission import CONTINUING, NEW, WS_MAX_PENDING, Overloaded, priority_var
+from resilience import CircuitOpen, DeadlineExceeded, is_retryable, start_deadline
+from streaming import SSE_HEADERS, sse_stream, websocket_stream
+from answer_cache import AnswerCache, iter_cached
+from faq import FAQIndex
+from suggest import SUGGEST_MAX_RESULTS, SuggestIndex
+from routing import LARGE, SMALL, ROUTER_LARGE_MODEL, ROUTER_SMALL_MODEL, ModelRouter
+from admin import require_admin
+from singleflight import SingleFlight, flight_key
+from history import Summarizer, agent_summarizer
+from session_store import create_session_store
+from connections import Connection, ConnectionManager
+from ws_protocol import PROTOCOL_VERSION, Pipeline, ProtocolError, negotiate, parse_frame, reply_order
+from rate_limit import create_rate_limiter, rate_limit_dependency
+from shared_state import close_shared_store
+from capture import TrafficRecorder, session_ref
+from metrics import (
+    ADMISSION_SHED, CONTENT_TYPE, DEGRADED_ANSWERS, ERRORS, REQUEST_SECONDS, WEBSOCKET_MESSAGES,
+    MetricsMiddleware, register_stats, render as render_metrics,
+)
+from structured_log import (
+    RequestContextMiddleware, configure_logging, stop_logging,
+    new_request_id, request_id_var, session_id_var,
+)
+from warmup import Startup
+from shutdown import DrainOnSignal
+from profiling import MODES as PROFILE_MODES, ProfilingMiddleware, profiler, span
 
-# Rate limiter setup
-limiter = Limiter(key_func=get_remote_address)
+# Structured JSON logs, written from a background thread
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Rate limiter setup: separate per-IP budgets for messages and new connections
+rate_limiter = create_rate_limiter()
+limit_messages = rate_limit_dependency(rate_limiter, "messages")
+limit_suggestions = rate_limit_dependency(rate_limiter, "suggest")
 
 middleware = [
+    Middleware(RequestContextMiddleware),
+    Middleware(MetricsMiddleware),
+    # Opt-in: X-Profile with an admin token, PROFILE_SAMPLE_RATE or a window from POST /admin/profile
+    Middleware(ProfilingMiddleware),
     Middleware(
         CORSMiddleware,
         allow_origins=[
@@ -32,182 +73,624 @@ middleware = [
     )
 ]
 
-app = FastAPI(middleware=middleware)
-app.state.limiter = limiter
-
-# Rate limit error handler
-@app.exception_handler(RateLimitExceeded)
-async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
-    return JSONResponse(
-        status_code=429,
-        content={"detail": "Too many requests. Please try again later."},
-    )
-
-# Define AI agent
-customer_support_agent = Agent(
-    name="Crypto Support Agent",
-    role="Provide customer support for a decentralized fiat-to-crypto platform.",
-    model=Groq(id="llama-3.3-70b-versatile"),
-    instructions=[
-        "Answer user questions about fiat-to-crypto transactions.",
-        "Provide troubleshooting steps for transaction failures.",
-        "Explain crypto wallet setup and security best practices.",
-    ],
-    markdown=True,
-)
+router = APIRouter()
+startup = Startup(_STARTED)
+
+# Agent pools are built by the lifespan hook, so importing this module does not load agno
+customer_support_agent: Optional[AgentPool] = None
+model_router: Optional[ModelRouter] = None
+summarize_history: Optional[Summarizer] = None
+
+def support_agent(model_id: str) -> AgentPool:
+    return AgentPool(AgentSpec(
+        name="Crypto Support Agent",
+        role="Provide customer support for a decentralized fiat-to-crypto platform.",
+        model_id=model_id,
+        instructions=(
+            "Answer user questions about fiat-to-crypto transactions.",
+            "Provide troubleshooting steps for transaction failures.",
+            "Explain crypto wallet setup and security best practices.",
+        ),
+        markdown=True,
+    ))
+
+def build_agents():
+    global customer_support_agent, model_router, summarize_history
+    if customer_support_agent is not None:
+        return
+
+    # Each run gets its own agent from a pool (agent_pool.py); simple questions go to the small model (routing.py)
+    customer_support_agent = support_agent(ROUTER_LARGE_MODEL)
+    model_router = ModelRouter({SMALL: support_agent(ROUTER_SMALL_MODEL), LARGE: customer_support_agent})
+
+    # Small model that folds older WebSocket turns into a rolling summary
+    summary_agent = AgentPool(AgentSpec(
+        name="Conversation Summarizer",
+        model_id="llama-3.1-8b-instant",
+        instructions=("Summarize customer support conversations accurately and briefly.",),
+    ))
+    summarize_history = agent_summarizer(summary_agent)
+    for pool in (*model_router.agents.values(), summary_agent):
+        pool.warm()
+
+# Session and connection management (connections.py)
+manager = ConnectionManager(create_session_store())
+
+# Answers to stateless questions (/ask and the first turn of a /ws session)
+answer_cache = AnswerCache()
+# Curated docs in FAQ_DIR: close FAQ matches are answered directly, other questions get relevant passages
+faq_index = FAQIndex()
+# Type-ahead: frequent questions with answers in the FAQ or the cache
+suggestions = SuggestIndex(answer_cache.peek, faq_index.questions)
+# Identical questions that arrive while one is being answered share its upstream call
+single_flight = SingleFlight()
+# Opt-in capture of live traffic for bench/replay.py (CAPTURE=1)
+recorder = TrafficRecorder()
+
+# Component counters, read when /metrics is scraped
+register_stats("support_answer_cache", answer_cache.stats,
+               counters=("hits_exact", "hits_normalized", "hits_similar", "hits_shared", "misses",
+                         "evictions", "expirations"),
+               gauges=("size",))
+register_stats("support_single_flight", single_flight.stats,
+               counters=("calls", "coalesced", "errors", "abandoned"), gauges=("in_flight",))
+register_stats("support_faq", faq_index.stats,
+               counters=("answers", "contexts", "misses", "reloads"), gauges=("passages",))
+register_stats("support_suggest", suggestions.stats,
+               counters=("observed", "untracked", "identifying", "lookups", "served", "rebuilds"), gauges=("questions", "tracked"))
+register_stats("support_capture", recorder.stats,
+               counters=("recorded", "written", "dropped", "rotations", "write_errors"), gauges=("queued",))
+register_stats("support_admission", admission.stats,
+               counters=("admitted", "queued", "shed_queue_full", "shed_wait", "shed_timeout", "displaced"),
+               gauges=("running", "waiting", "service_seconds"))
+register_stats("support_agent_pool", agent_pool.stats,
+               counters=("created", "reused", "discarded"), gauges=("pools", "idle", "leased"))
+register_stats("support_profiling", profiler.stats,
+               counters=("profiled", "cprofiles", "cprofile_busy"), gauges=("stack_samples",))
+register_stats("support_connections", manager.stats,
+               counters=("accepted", "rejected_global", "rejected_ip", "reaped_idle", "heartbeat_failures",
+                         "detached", "oversized", "over_budget", "drained"),
+               gauges=("connections", "addresses", "attached", "memory_bytes", "draining"))
+register_stats("support_sessions", manager.sessions.stats,
+               counters=("loads", "creates", "writes", "evictions", "flush_errors"), gauges=("resident", "attached"))
+
+async def lookup_answer(question: str, client_ip: str) -> Optional[str]:
+    """A ready answer to a stateless question: canonical FAQ entry first, then the cache"""
+    suggestions.observe(question, client_ip)
+    faq_answer = faq_index.answer(question)
+    if faq_answer is not None:
+        return faq_answer
+    return await answer_cache.aget(question)
+
+def degraded_answer(question: str) -> Optional[str]:
+    """Closest cached answer or best documentation passage, for when the model cannot answer"""
+    answer = answer_cache.closest(question)
+    if answer is not None:
+        DEGRADED_ANSWERS.labels("cache").inc()
+        return answer
+    answer = faq_index.best_passage(question)
+    if answer is not None:
+        DEGRADED_ANSWERS.labels("docs").inc()
+    return answer
+
+async def answer_question(question: str, client_ip: str, route: str = "/ask") -> str:
+    """Answer a stateless question from the FAQ, the cache or a shared upstream call.
+
+    While the model is unavailable (open circuit, deadline, persistent
+    upstream errors) a close cached answer or doc passage is served instead.
+    """
+    with span("lookup"):
+        cached = await lookup_answer(question, client_ip)
+    if cached is not None:
+        return cached
+
+    decision = model_router.choose(route, question)
+
+    async def call_agent() -> str:
+        response = await model_router.run(decision, faq_index.prompt(question))
+        with span("extract"):
+            response_text = extract_response_text(response).strip()
+            await answer_cache.aset(question, response_text)
+        return response_text
 
-# Session management
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, WebSocket] = {}
-        self.user_sessions: Dict[int, List[dict]] = {}
-        self.rate_limits: Dict[str, Dict[str, float]] = {}  # {ip: {"last_request": timestamp, "count": int}}
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        session_id = id(websocket)
-        self.active_connections[session_id] = websocket
-        self.user_sessions[session_id] = [{
-            "role": "system",
-            "content": "You are a helpful customer support agent for a crypto platform."
-        }]
-        return session_id
-
-    def disconnect(self, session_id: int):
-        self.active_connections.pop(session_id, None)
-        self.user_sessions.pop(session_id, None)
-
-    def check_rate_limit(self, ip: str) -> bool:
-        """Allow 10 requests per minute per IP"""
-        now = time.time()
-        if ip not in self.rate_limits:
-            self.rate_limits[ip] = {"last_request": now, "count": 1}
-            return True
-
-        time_passed = now - self.rate_limits[ip]["last_request"]
-        if time_passed > 60:  # Reset after 1 minute
-            self.rate_limits[ip] = {"last_request": now, "count": 1}
-            return True
-
-        if self.rate_limits[ip]["count"] >= 10:
-            return False
-
-        self.rate_limits[ip]["count"] += 1
-        return True
-
-manager = ConnectionManager()
+    try:
+        with span("model"):
+            return await single_flight.do(flight_key(question, model_router.agent(decision)), call_agent)
+    except Exception as e:
+        if not isinstance(e, (CircuitOpen, DeadlineExceeded)) and not is_retryable(e):
+            raise
+        fallback = degraded_answer(question)
+        if fallback is None:
+            raise
+        logger.warning("model unavailable, serving a degraded answer: %s", e)
+        return fallback
 
 # HTTP endpoint for direct POST requests
 class Query(BaseModel):
     question: str
 
-@app.post("/ask")
-@limiter.limit("10/minute")
+@router.post("/ask", dependencies=[Depends(limit_messages)])
 async def ask_agent(request: Request, query: Query):
+    started = time.perf_counter()
+    start_deadline()
     try:
-        if not manager.check_rate_limit(request.client.host):
-            raise HTTPException(status_code=429, detail="Too many requests")
-
-        response = customer_support_agent.run(query.question)
-
-        # Extract the text content from the response
-        # According to Agno docs, RunResponse should have the actual response content
-        # Try multiple possible response attributes
-        response_text = getattr(response, 'content',
-                      getattr(response, 'text',
-                      getattr(response, 'response', str(response))))
-
-
-    # If the above doesn't work, try the pretty print function's output
-        if not response_text:
-            import io
-            from contextlib import redirect_stdout
-
-            f = io.StringIO()
-            with redirect_stdout(f):
-                pprint_run_response(response, markdown=True)
-            response_text = f.getvalue()
-
-        return {"response": response_text.strip()}
+        response_text = await answer_question(query.question, request.client.host)
+        recorder.record("ask", question=query.question, response=response_text, status="ok",
+                        latency_ms=round((time.perf_counter() - started) * 1000, 1))
+        return {"response": response_text}
 
     except HTTPException:
         raise
+    except (Overloaded, CircuitOpen, DeadlineExceeded) as e:
+        status = "shed" if isinstance(e, Overloaded) else "unavailable"
+        recorder.record("ask", question=query.question, status=status, error=type(e).__name__,
+                        latency_ms=round((time.perf_counter() - started) * 1000, 1))
+        raise
     except Exception as e:
-        print("🔥 Exception occurred:", str(e))
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.options("/ask")
+        logger.exception("ask failed: %s", e)
+        ERRORS.labels("/ask", type(e).__name__).inc()
+        recorder.record("ask", question=query.question, status="error", error=type(e).__name__,
+                        latency_ms=round((time.perf_counter() - started) * 1000, 1))
+        # Upstream still failing after retries is a bad gateway, not a bug here
+        raise HTTPException(status_code=502 if is_retryable(e) else 500, detail=str(e))
+
+@router.post("/ask/stream", dependencies=[Depends(limit_messages)])
+async def ask_agent_stream(request: Request, query: Query):
+    started = time.perf_counter()
+    start_deadline()
+    cached = await lookup_answer(query.question, request.client.host)
+    if cached is not None:
+        deltas = iter_cached(cached)
+    else:
+        # Shed before the 200 and the event stream start, while a 503 is still possible
+        admission.check(NEW)
+        decision = model_router.choose("/ask/stream", query.question)
+        deltas = answer_cache.stream_through(
+            query.question, model_router.stream(decision, faq_index.prompt(query.question)))
+    deltas = recorder.record_stream("ask_stream", deltas, started, question=query.question)
+    return StreamingResponse(sse_stream(deltas), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.get("/suggest", dependencies=[Depends(limit_suggestions)])
+async def suggest(q: str = "", limit: int = 5):
+    """Known questions matching what the user has typed so far, with their answers"""
+    matches = suggestions.suggest(q, max(1, min(limit, SUGGEST_MAX_RESULTS)))
+    # Browsers reuse the result when the user deletes back to an earlier prefix
+    return JSONResponse({"suggestions": matches}, headers={"Cache-Control": "private, max-age=30"})
+
+@router.options("/ask")
 async def preflight_handler():
     return {"message": "CORS preflight"}
 
-# WebSocket for real-time chat support
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    session_id = await manager.connect(websocket)
-    client_ip = websocket.client.host
-
+async def send_notice(connection: Connection, notice: str, **fields):
+    if connection.stream:
+        await connection.websocket.send_json({"type": "error", "detail": notice, **fields})
+    else:
+        await connection.websocket.send_text(notice)
+
+async def answer_turn(connection: Connection, question: str,
+                      stream_to: Optional[Callable[[AsyncIterator[str]], Awaitable[str]]] = None) -> str:
+    """Answer one WebSocket message in its conversation and record the exchange.
+
+    With `stream_to`, the answer's deltas are handed to it as they arrive and
+    it returns the full text.
+    """
+    request_id_var.set(new_request_id())
+    mode = profiler.select("/ws", connection.profile_mode)
+    if mode is None:
+        return await _answer_turn(connection, question, stream_to)
+    with profiler.profile("/ws", mode, request_id_var.get()):
+        return await _answer_turn(connection, question, stream_to)
+
+async def _answer_turn(connection: Connection, question: str,
+                       stream_to: Optional[Callable[[AsyncIterator[str]], Awaitable[str]]]) -> str:
+    started = time.perf_counter()
+    start_deadline()
+    logger.info("user message", extra={"content": question})
+    with span("history"):
+        history = await manager.history(connection)
+    first_turn = history.user_turns == 0
+    # Conversations already under way get upstream slots before new ones
+    priority_var.set(NEW if first_turn else CONTINUING)
+
+    # The first turn is stateless, later ones send the windowed history. The question joins the
+    # history only once answered, so a failed call leaves no unanswered turn behind and asks
+    # answered concurrently (protocol v2, order=any) each see whole exchanges only
+    if stream_to is not None:
+        if not first_turn:
+            deltas = model_router.stream(model_router.choose("/ws", question),
+                                         messages=faq_index.with_context(history.prompt_messages(question)))
+        elif (cached := await lookup_answer(question, connection.client_ip)) is not None:
+            deltas = iter_cached(cached)
+        else:
+            deltas = answer_cache.stream_through(
+                question, model_router.stream(model_router.choose("/ws", question), faq_index.prompt(question)))
+        with span("stream"):
+            response_text = await stream_to(deltas)
+    elif first_turn:
+        response_text = await answer_question(question, connection.client_ip, "/ws")
+    else:
+        with span("model"):
+            response = await model_router.run(model_router.choose("/ws", question),
+                                              messages=faq_index.with_context(history.prompt_messages(question)))
+        response_text = extract_response_text(response)
+
+    history.append("user", question)
+    history.append("assistant", response_text)
+    history.schedule_summary(summarize_history)
+    logger.info("assistant message", extra={"content": response_text, "chars": len(response_text)})
+    recorder.record("ws", session=session_ref(connection.session_id), turn=history.user_turns,
+                    stream=stream_to is not None, question=question, response=response_text, status="ok",
+                    latency_ms=round((time.perf_counter() - started) * 1000, 1))
+    REQUEST_SECONDS.labels("ws_message", "ok").observe(time.perf_counter() - started)
+    return response_text
+
+async def receive_messages(connection: Connection, pending: asyncio.Queue):
+    """Read client messages into `pending` so they are answered in order.
+
+    At most WS_MAX_PENDING messages wait behind the one being answered, and
+    within the connection's memory budget; further ones are refused with a
+    notice rather than buffered. A None in the queue means the client went
+    away.
+    """
+    websocket = connection.websocket
     try:
         while True:
-            if not manager.check_rate_limit(client_ip):
-                await websocket.send_text("⚠️ Too many requests. Please wait a minute.")
-                await websocket.close(code=1008)  # Policy Violation
-                break
-
             question = await websocket.receive_text()
-            print(f"👤 User {session_id}: {question}")
-
-            # Append question to history with proper format
-            manager.user_sessions[session_id].append({
-                "role": "user",
-                "content": str(question)  # Ensure content is string
-            })
-
-            # Process message
-            # Run agent with just the latest question (as string)
-            response = customer_support_agent.run(question)
-
-            # Get response text
-            response_text = getattr(response, 'content',
-                                getattr(response, 'text',
-                                getattr(response, 'response', str(response))))
-
-            # Ensure response is string before storing
-            response_text = str(response_text)
-
-            # Append response to history
-            manager.user_sessions[session_id].append({
-                "role": "assistant",
-                "content": response_text
-            })
-            print(f"🤖 AI to {session_id}: {response_text}")
+            WEBSOCKET_MESSAGES.labels().inc()
+            connection.last_seen = time.monotonic()
+            if pending.qsize() >= WS_MAX_PENDING:
+                ADMISSION_SHED.labels("ws_pending").inc()
+                await send_notice(connection, "⚠️ Still answering your earlier messages. Please wait for a reply.")
+                continue
+            refused = manager.admit_message(connection, question)
+            if refused == "too_long":
+                await websocket.close(code=1009, reason="Message too long")  # Message Too Big
+                break
+            if refused == "restarting":
+                await send_notice(connection, "⚠️ The server is restarting. Please send that again once reconnected.")
+                continue
+            if refused is not None:
+                await send_notice(connection, "⚠️ Too much is waiting on this conversation. Please wait for a reply.")
+                continue
+            pending.put_nowait(question)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.warning("websocket receive failed: %s", e)
+    finally:
+        # Nobody is left to read the answers to queued messages
+        while not pending.empty():
+            pending.get_nowait()
+        pending.put_nowait(None)
+
+async def serve_messages(connection: Connection):
+    """Plain-text and /ws?stream=1 clients: answer messages one at a time, in order"""
+    websocket = connection.websocket
+    stream = connection.stream
+    if stream:
+        await websocket.send_json({"type": "session", "session": connection.session_id})
+
+    pending: asyncio.Queue = asyncio.Queue()
+    receiver = asyncio.create_task(receive_messages(connection, pending))
+    try:
+        while True:
+            connection.busy = False
+            question = await pending.get()
+            if question is None:
+                logger.info("client disconnected")
+                break
+            connection.busy = True
+            connection.queued_bytes -= len(question)
+            started = time.perf_counter()
+            decision = await rate_limiter.hit("messages", connection.client_ip)
+            if not decision.allowed:
+                # Stream clients get an error frame, plain-text clients the text
+                await send_notice(connection, "⚠️ Too many requests. Please wait a minute.",
+                                  code="rate_limited", retry_after=math.ceil(decision.retry_after))
+                await websocket.close(code=1008, reason="Too many requests")  # Policy Violation
+                break
 
-            await websocket.send_text(response_text.strip())
+            try:
+                if stream:
+                    await answer_turn(connection, question, lambda deltas: websocket_stream(websocket, deltas))
+                else:
+                    response_text = await answer_turn(connection, question)
+                    await websocket.send_text(response_text.strip())
+            except DeadlineExceeded as e:
+                # Only this message timed out: say so and keep the conversation going
+                logger.warning("websocket message timed out: %s", e)
+                REQUEST_SECONDS.labels("ws_message", "unavailable").observe(time.perf_counter() - started)
+                recorder.record("ws", session=session_ref(connection.session_id), stream=stream, question=question,
+                                status="unavailable", latency_ms=round((time.perf_counter() - started) * 1000, 1))
+                await send_notice(connection, "⚠️ The answer took too long. Please try again.")
 
     except WebSocketDisconnect:
-        print(f"Client {session_id} disconnected")
+        logger.info("client disconnected")
+    except (Overloaded, CircuitOpen) as e:
+        # Shed: tell the client when to come back and free the connection
+        logger.warning("websocket shed: %s", e)
+        status = "shed" if isinstance(e, Overloaded) else "unavailable"
+        REQUEST_SECONDS.labels("ws_message", status).observe(time.perf_counter() - started)
+        recorder.record("ws", session=session_ref(connection.session_id), stream=stream, question=question,
+                        status=status, latency_ms=round((time.perf_counter() - started) * 1000, 1))
+        try:
+            await send_notice(connection, f"⚠️ The service is busy. Please try again in {e.retry_after} seconds.",
+                              retry_after=e.retry_after)
+            await websocket.close(code=1013, reason=f"Try again in {e.retry_after}s")  # Try Again Later
+        except:
+            pass
     except Exception as e:
-        print(f"❌ Error in WebSocket {session_id}:", str(e))
-        traceback.print_exc()
+        logger.exception("websocket error: %s", e)
+        ERRORS.labels("/ws", type(e).__name__).inc()
         try:
             await websocket.send_text("⚠️ An error occurred. Please try again later.")
             await websocket.close()
         except:
             pass
     finally:
-        manager.disconnect(session_id)
+        receiver.cancel()
+
+async def send_frame_error(websocket: WebSocket, message_id: Optional[str], code: str, detail: str, **fields):
+    frame = {"type": "error", "code": code, "detail": detail, **fields}
+    if message_id is not None:
+        frame["id"] = message_id
+    await websocket.send_json(frame)
+
+async def answer_frame(connection: Connection, message_id: str, question: str, stream: bool):
+    """Answer one protocol v2 ask and send its reply frames; errors only fail this ask"""
+    websocket = connection.websocket
+    started = time.perf_counter()
+    try:
+        if stream:
+            await answer_turn(connection, question, lambda deltas: websocket_stream(websocket, deltas, message_id))
+        else:
+            response_text = await answer_turn(connection, question)
+            await websocket.send_json({"type": "answer", "id": message_id, "content": response_text.strip()})
+        return
+    except asyncio.CancelledError:
+        REQUEST_SECONDS.labels("ws_message", "cancelled").observe(time.perf_counter() - started)
+        raise
+    except WebSocketDisconnect:
+        return
+    except (Overloaded, CircuitOpen, DeadlineExceeded) as e:
+        logger.warning("websocket ask failed: %s", e)
+        status = "shed" if isinstance(e, Overloaded) else "unavailable"
+        recorder.record("ws", session=session_ref(connection.session_id), stream=stream, question=question,
+                        status=status, latency_ms=round((time.perf_counter() - started) * 1000, 1))
+        if isinstance(e, DeadlineExceeded):
+            code, detail, fields = "timeout", "The answer took too long. Please try again.", {}
+        else:
+            code, detail = "overloaded", "The service is busy. Please try again later."
+            fields = {"retry_after": e.retry_after}
+    except Exception as e:
+        logger.exception("websocket ask failed: %s", e)
+        ERRORS.labels("/ws", type(e).__name__).inc()
+        status, code, detail, fields = "error", "error", "An error occurred. Please try again later.", {}
+    REQUEST_SECONDS.labels("ws_message", status).observe(time.perf_counter() - started)
+    try:
+        await send_frame_error(websocket, message_id, code, detail, **fields)
+    except Exception:
+        pass
+
+async def serve_protocol_v2(connection: Connection, order: str):
+    """Protocol v2 clients (ws_protocol.py): pipelined asks with ids, answered through a Pipeline"""
+    websocket = connection.websocket
+    pipeline = Pipeline(connection, functools.partial(answer_frame, connection), order)
+    await websocket.send_json({"type": "hello", "v": PROTOCOL_VERSION, "session": connection.session_id,
+                               "order": order, "max_in_flight": pipeline.max_in_flight})
+    try:
+        while True:
+            text = await websocket.receive_text()
+            WEBSOCKET_MESSAGES.labels().inc()
+            connection.last_seen = time.monotonic()
+            try:
+                frame = parse_frame(text)
+            except ProtocolError as e:
+                await send_frame_error(websocket, e.message_id, "bad_frame", str(e))
+                continue
+            if frame["type"] == "ping":
+                await websocket.send_json({"type": "pong"})
+                continue
+
+            message_id = frame["id"]
+            if frame["type"] == "cancel":
+                if await pipeline.cancel(message_id):
+                    await websocket.send_json({"type": "cancelled", "id": message_id})
+                else:
+                    await send_frame_error(websocket, message_id, "unknown_id", "Nothing to cancel with this id")
+                continue
+
+            question = frame["content"]
+            if message_id in pipeline:
+                await send_frame_error(websocket, message_id, "duplicate_id", "An ask with this id is in flight")
+                continue
+            if len(pipeline) >= pipeline.max_in_flight:
+                ADMISSION_SHED.labels("ws_pending").inc()
+                await send_frame_error(websocket, message_id, "busy", "Too many asks in flight. Please wait for a reply.")
+                continue
+            decision = await rate_limiter.hit("messages", connection.client_ip)
+            if not decision.allowed:
+                await send_frame_error(websocket, message_id, "rate_limited", "Too many requests. Please wait a minute.",
+                                       retry_after=math.ceil(decision.retry_after))
+                continue
+            refused = manager.admit_message(connection, question)
+            if refused == "too_long":
+                await websocket.close(code=1009, reason="Message too long")  # Message Too Big
+                break
+            if refused == "restarting":
+                await send_frame_error(websocket, message_id, "restarting",
+                                       "The server is restarting. Please send that again once reconnected.")
+                continue
+            if refused is not None:
+                await send_frame_error(websocket, message_id, "over_budget",
+                                       "Too much is waiting on this conversation. Please wait for a reply.")
+                continue
+            pipeline.submit(message_id, question, frame["stream"])
+    except WebSocketDisconnect:
+        logger.info("client disconnected")
+    finally:
+        # Stops answers nobody will read, and their upstream calls
+        await pipeline.close()
 
-@app.get("/")
+# WebSocket for real-time chat support
+@router.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    client_ip = websocket.client.host
+    # Clients opt in to start/delta/end JSON frames with /ws?stream=1, or to protocol v2 (ws_protocol.py)
+    subprotocol = negotiate(websocket)
+    if not (await rate_limiter.hit("connections", client_ip)).allowed:
+        await manager.refuse(websocket, 1008, "Too many connections. Please wait a minute.", subprotocol)  # Policy Violation
+        return
+    refusal = manager.refusal(client_ip)
+    if refusal is not None:
+        await manager.refuse(websocket, 1013, refusal, subprotocol)  # Try Again Later
+        return
+
+    stream = subprotocol is not None or websocket.query_params.get("stream") in ("1", "true")
+    connection = await manager.connect(websocket, client_ip, stream, subprotocol)
+    # The token lets anyone resume the session, so logs only get a reference to it
+    session_id_var.set(session_ref(connection.session_id))
+    connection.profile_mode = profiler.requested_mode(websocket.scope["headers"])
+    try:
+        if subprotocol is not None:
+            await serve_protocol_v2(connection, reply_order(websocket))
+        else:
+            await serve_messages(connection)
+    finally:
+        connection.busy = False
+        manager.disconnect(connection)
+
+@router.get("/admin/cache", dependencies=[Depends(require_admin)])
+async def answer_cache_stats():
+    return answer_cache.stats()
+
+@router.delete("/admin/cache", dependencies=[Depends(require_admin)])
+async def purge_answer_cache(question: Optional[str] = None):
+    return {"purged": await answer_cache.apurge(question)}
+
+@router.get("/admin/single-flight", dependencies=[Depends(require_admin)])
+async def single_flight_stats():
+    return single_flight.stats()
+
+@router.get("/admin/sessions", dependencies=[Depends(require_admin)])
+async def session_stats():
+    return manager.sessions.stats()
+
+@router.get("/admin/connections", dependencies=[Depends(require_admin)])
+async def connection_stats():
+    return manager.stats()
+
+async def drain_for_restart():
+    """Fail /ready, refuse new sockets, and hand every conversation off once it has been answered"""
+    await manager.drain()
+    await manager.sessions.flush()
+
+# SIGTERM drains before uvicorn closes the sockets (shutdown.py)
+drain_on_signal = DrainOnSignal(drain_for_restart)
+
+@router.post("/admin/drain", dependencies=[Depends(require_admin)])
+async def drain_connections():
+    """Pre-stop hook, for platforms that send SIGTERM too late or not at all"""
+    await drain_for_restart()
+    return manager.stats()
+
+@router.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def start_profiling(seconds: float = 60.0, rate: float = 0.1, mode: Optional[str] = None):
+    """Profile a share `rate` of /ask and /ws requests for the next `seconds`"""
+    if mode is not None and mode not in PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(PROFILE_MODES)}")
+    if not 0 < seconds <= 3600 or not 0 < rate <= 1:
+        raise HTTPException(status_code=400, detail="seconds must be in (0, 3600] and rate in (0, 1]")
+    profiler.open_window(seconds, rate, mode)
+    return profiler.stats()
+
+@router.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def profiling_stats():
+    return profiler.stats()
+
+@router.get("/admin/profile/download", dependencies=[Depends(require_admin)])
+async def download_profile(format: str = "pstats"):
+    """Aggregated profile: pstats (for snakeviz or pstats), text, or collapsed stacks (flamegraph.pl)"""
+    if format not in ("pstats", "text", "collapsed"):
+        raise HTTPException(status_code=400, detail="format must be pstats, text or collapsed")
+    body, media_type = profiler.download(format)
+    headers = {"Content-Disposition": "attachment; filename=support.prof"} if format == "pstats" else None
+    return Response(body, media_type=media_type, headers=headers)
+
+@router.delete("/admin/profile", dependencies=[Depends(require_admin)])
+async def reset_profiling():
+    """Close the profiling window and drop what was collected"""
+    profiler.close_window()
+    profiler.reset()
+    return profiler.stats()
+
+@router.get("/metrics")
+async def metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
+@router.get("/")
 async def root():
     return {"message": "Welcome to the Crypto Support Agent API!"}
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    print("Shutting down... cleaning up connections")
-    for session_id in list(manager.active_connections.keys()):
-        try:
-            await manager.active_connections[session_id].close()
-        except:
-            pass
-    manager.active_connections.clear()
-    manager.user_sessions.clear()
+@router.get("/ready")
+async def ready():
+    """Readiness probe: 503 until startup warm-up has finished"""
+    if not startup.ready:
+        return JSONResponse({"status": "starting"}, status_code=503)
+    if manager.draining:
+        return JSONResponse({"status": "draining"}, status_code=503)
+    return {"status": "ready", "startup": startup.timings}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup.timings["import"] = round(time.perf_counter() - _STARTED, 3)
+    with startup.phase("build_agents"):
+        build_agents()
+    with startup.phase("faq_index"):
+        await asyncio.to_thread(faq_index.load)
+    faq_index.start()
+    suggestions.rebuild()
+    suggestions.start()
+    manager.sessions.start()
+    manager.start()
+    rate_limiter.start()
+    recorder.start()
+    # Serve liveness right away; /ready reports ready once connections and cache are warm
+    warm_up = asyncio.create_task(startup.warm_up(answer_cache))
+    drain_on_signal.install()
+
+    yield
+
+    logger.info("shutting down, closing connections")
+    drain_on_signal.uninstall()
+    warm_up.cancel()
+    await manager.drain()
+    await manager.close()
+    for history in manager.user_sessions.values():
+        history.cancel_summary()
+    await manager.sessions.close()
+    await rate_limiter.close()
+    await faq_index.close()
+    await suggestions.close()
+    await asyncio.to_thread(recorder.close)
+    close_shared_store()
+    await close_async_client()
+    stop_logging()
+
+async def overloaded_handler(request: Request, exc: Exception):
+    # Overloaded and CircuitOpen both say when to come back
+    return JSONResponse({"detail": "The service is busy. Please try again later."}, status_code=503,
+                        headers={"Retry-After": str(exc.retry_after)})
+
+async def deadline_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse({"detail": "The answer took too long. Please try again."}, status_code=504)
+
+def create_app() -> FastAPI:
+    app = FastAPI(middleware=middleware, lifespan=lifespan)
+    app.add_exception_handler(Overloaded, overloaded_handler)
+    app.add_exception_handler(CircuitOpen, overloaded_handler)
+    app.add_exception_handler(DeadlineExceeded, deadline_handler)
+    app.include_router(router)
+    return app
+
+app = create_app()
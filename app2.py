@@ -4,7 +4,14 @@ from agno.agent import Agent
 from agno.models.groq import Groq
 from agno.utils.pprint import pprint_run_response
 from fastapi.middleware.cors import CORSMiddleware
-import traceback
+import logging
+from upstream import groq_model
+from history import ConversationHistory, agent_summarizer
+from structured_log import configure_logging, new_request_id, request_id_var, session_id_var
+
+# Structured JSON logs, written from a background thread
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -34,6 +41,14 @@ customer_support_agent = Agent(
     markdown=True,
 )
 
+# Small model that folds older turns into a rolling summary
+summary_agent = Agent(
+    name="Conversation Summarizer",
+    model=groq_model("llama-3.1-8b-instant"),
+    instructions=["Summarize customer support conversations accurately and briefly."],
+)
+summarize_history = agent_summarizer(summary_agent)
+
 # Session memory store for each WebSocket user
 user_sessions = {}
 
@@ -68,8 +83,7 @@ async def ask_agent(query: Query):
         return {"response": response_text.strip()}
 
     except Exception as e:
-        print("🔥 Exception occurred:", str(e))
-        traceback.print_exc()
+        logger.exception("ask failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.options("/ask")
@@ -81,37 +95,34 @@ async def preflight_handler():
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     session_id = id(websocket)  # Unique session ID
-    user_sessions[session_id] = []  # Store chat history
+    session_id_var.set(str(session_id))
+    user_sessions[session_id] = ConversationHistory()  # Store chat history
 
     while True:
         try:
             question = await websocket.receive_text()
-            print(f"👤 User: {question}")
-
-            # Append question to history with proper format
-            user_sessions[session_id].append({"role": "user", "content": str(question)})
+            request_id_var.set(new_request_id())
+            logger.info("user message", extra={"content": question})
 
-            # Pass chat history to AI - ensure each message has proper format
-            formatted_messages = [
-                {"role": msg["role"], "content": str(msg["content"])}
-                for msg in user_sessions[session_id]
-            ]
+            history = user_sessions[session_id]
+            history.append("user", question)
 
-            response = customer_support_agent.run(formatted_messages)
+            # Pass the windowed history (summary + recent turns) to AI
+            response = customer_support_agent.run(history.prompt_messages())
 
             response_text = getattr(response, 'content',
                                 getattr(response, 'text',
                                 getattr(response, 'response', str(response))))
 
              # Append response to history
-            user_sessions[session_id].append({"role": "assistant", "content": str(response_text)})
-            print(f"🤖 AI: {response_text}")
+            history.append("assistant", str(response_text))
+            history.schedule_summary(summarize_history)
+            logger.info("assistant message", extra={"content": str(response_text)})
 
             await websocket.send_text(response_text.strip())
 
         except Exception as e:
-            print("❌ Error in WebSocket:", str(e))
-            traceback.print_exc()
+            logger.exception("websocket error: %s", e)
             await websocket.send_text("⚠️ An error occurred. Please try again later.")
             break
 
@@ -4,8 +4,14 @@ from agno.agent import Agent
 from agno.models.groq import Groq
 from agno.utils.pprint import pprint_run_response
 from fastapi.middleware.cors import CORSMiddleware
-import traceback
-import json
+import logging
+from upstream import groq_model
+from history import ConversationHistory, agent_summarizer
+from structured_log import configure_logging, new_request_id, request_id_var, session_id_var
+
+# Structured JSON logs, written from a background thread
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -35,6 +41,14 @@ customer_support_agent = Agent(
     markdown=True,
 )
 
+# Small model that folds older turns into a rolling summary
+summary_agent = Agent(
+    name="Conversation Summarizer",
+    model=groq_model("llama-3.1-8b-instant"),
+    instructions=["Summarize customer support conversations accurately and briefly."],
+)
+summarize_history = agent_summarizer(summary_agent)
+
 # Session memory store for each WebSocket user
 user_sessions = {}
 
@@ -63,8 +77,7 @@ async def ask_agent(query: Query):
         return {"response": response_text.strip()}
 
     except Exception as e:
-        print("🔥 Exception occurred:", str(e))
-        traceback.print_exc()
+        logger.exception("ask failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.options("/ask")
@@ -76,40 +89,25 @@ async def preflight_handler():
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     session_id = id(websocket)
-    user_sessions[session_id] = []
-
-    if not user_sessions[session_id]:
-        user_sessions[session_id].append({
-            "role": "system",
-            "content": "You are a helpful customer support agent for a crypto platform."
-        })
+    session_id_var.set(str(session_id))
+    user_sessions[session_id] = ConversationHistory(
+        system_prompt="You are a helpful customer support agent for a crypto platform."
+    )
 
     while True:
         try:
             question = await websocket.receive_text()
-            print(f"👤 User: {question}")
-
-            user_sessions[session_id].append({
-                "role": "user",
-                "content": str(question)
-            })
-
-            # Validate and sanitize all messages
-            messages = []
-            for msg in user_sessions[session_id]:
-                role = str(msg.get("role", "user"))
-                content = msg.get("content", "")
-                if not isinstance(content, str):
-                    content = str(content)
-                messages.append({
-                    "role": role,
-                    "content": content
-                })
-
-            # Debug: Print formatted messages
-            print("📨 Sending to Groq:\n", json.dumps(messages, indent=2))
-
-            # Run agent with sanitized messages
+            request_id_var.set(new_request_id())
+            logger.info("user message", extra={"content": question})
+
+            history = user_sessions[session_id]
+            history.append("user", question)
+
+            # History stores plain strings, so the messages need no sanitizing
+            messages = history.prompt_messages()
+            logger.debug("sending to Groq", extra={"messages": len(messages)})
+
+            # Run agent with the windowed messages
             response = customer_support_agent.run(messages)
 
             response_text = getattr(response, 'content',
@@ -117,17 +115,14 @@ async def websocket_endpoint(websocket: WebSocket):
                                 getattr(response, 'response', str(response))))
             response_text = str(response_text)
 
-            user_sessions[session_id].append({
-                "role": "assistant",
-                "content": response_text
-            })
+            history.append("assistant", response_text)
+            history.schedule_summary(summarize_history)
 
-            print(f"🤖 AI: {response_text}")
+            logger.info("assistant message", extra={"content": str(response_text)})
             await websocket.send_text(response_text.strip())
 
         except Exception as e:
-            print("❌ Error in WebSocket:", str(e))
-            traceback.print_exc()
+            logger.exception("websocket error: %s", e)
             await websocket.send_text("⚠️ An error occurred. Please try again later.")
             break
 
@@ -0,0 +1,10 @@
+"""Load tests for the support API that run offline against a mock Groq server.
+
+- mock_groq: stand-in for the chat-completions API
+- loadgen: drives /ask, /ask/stream and concurrent /ws sessions
+- report: percentiles, throughput, memory and baseline comparison
+- replay: plays traffic captured by capture.py back at original or faster speed
+- startup: time to import, accept traffic and report ready
+
+Run with `python -m bench --help`.
+"""
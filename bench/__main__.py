@@ -0,0 +1,114 @@
+"""Benchmark the support API against the mock Groq server.
+
+    python -m bench                               # start mock + app, run every workload
+    python -m bench --ws-sessions 500 --ws-turns 3 --save baseline.json
+    python -m bench --compare baseline.json       # exit 1 on a >10% regression
+    python -m bench --target http://host:8000 --no-mock --app-pid 1234
+
+By default the mock server and the app (under uvicorn) are started as
+subprocesses on free local ports, with rate limits lifted, and stopped
+at the end. Memory per connection is read from /proc/<pid>/status, so it
+is only reported on Linux and when the app's PID is known.
+"""
+import argparse
+import asyncio
+import sys
+import time
+from typing import Optional
+
+from bench.loadgen import make_questions, run_ask, run_ws
+from bench.mock_groq import add_profile_arguments
+from bench.processes import free_port, rss_bytes, start_app, start_mock, stop_processes
+from bench.report import check_regressions, format_report, save_report, summarize
+
+async def run_workloads(args, base_url: str, app_pid: Optional[int]) -> dict:
+    # Separate questions per workload so the WebSocket run does not hit answers cached by /ask
+    questions = make_questions(args.ask_requests + max(args.ws_sessions * args.ws_turns, 1),
+                               seed=args.seed, duplicate_ratio=args.duplicate_ratio)
+    samples = []
+    memory = {}
+    walls = {}
+
+    if args.ask_requests:
+        started = time.perf_counter()
+        samples += await run_ask(base_url, questions[:args.ask_requests], args.ask_concurrency, stream=args.stream)
+        walls["ask_stream" if args.stream else "ask"] = time.perf_counter() - started
+
+    if args.ws_sessions:
+        ws_url = "ws" + base_url[len("http"):]
+        baseline = rss_bytes(app_pid)
+
+        async def on_open():
+            rss = rss_bytes(app_pid)
+            if baseline is not None and rss is not None:
+                memory["rss_before_mb"] = round(baseline / 2**20, 1)
+                memory["kb_per_idle_connection"] = round((rss - baseline) / args.ws_sessions / 1024, 1)
+
+        async def on_done():
+            rss = rss_bytes(app_pid)
+            if baseline is not None and rss is not None:
+                memory[f"kb_per_connection_after_{args.ws_turns}_turns"] = \
+                    round((rss - baseline) / args.ws_sessions / 1024, 1)
+                memory["rss_peak_mb"] = round(rss / 2**20, 1)
+
+        started = time.perf_counter()
+        samples += await run_ws(ws_url, args.ws_sessions, args.ws_turns, questions[args.ask_requests:], stream=args.stream,
+                                on_open=on_open, on_done=on_done)
+        walls["ws_stream" if args.stream else "ws"] = time.perf_counter() - started
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("save", "compare")},
+        "wall_seconds": {kind: round(wall, 2) for kind, wall in walls.items()},
+        "workloads": summarize(samples, walls),
+        "memory": memory,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="app", help="module holding the FastAPI app (app or app4)")
+    parser.add_argument("--target", help="benchmark an already running app at this URL")
+    parser.add_argument("--app-pid", type=int, help="PID of the --target app, for memory figures")
+    parser.add_argument("--no-mock", action="store_true", help="do not start the mock Groq server")
+    parser.add_argument("--ask-requests", type=int, default=200)
+    parser.add_argument("--ask-concurrency", type=int, default=20)
+    parser.add_argument("--ws-sessions", type=int, default=100)
+    parser.add_argument("--ws-turns", type=int, default=3)
+    parser.add_argument("--stream", action="store_true", help="use /ask/stream and /ws?stream=1 (reports TTFT)")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0,
+                        help="share of questions that repeat an earlier one (exercises the answer cache)")
+    parser.add_argument("--save", help="write the report as JSON")
+    parser.add_argument("--compare", help="baseline JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    processes = []
+    try:
+        groq_url = None
+        if not args.no_mock:
+            mock_port = free_port()
+            processes.append(start_mock(args, mock_port))
+            groq_url = f"http://127.0.0.1:{mock_port}"
+        if args.target:
+            base_url, app_pid = args.target.rstrip("/"), args.app_pid
+        else:
+            app_port = free_port()
+            app = start_app(args.app, app_port, groq_url)
+            processes.append(app)
+            base_url, app_pid = f"http://127.0.0.1:{app_port}", app.pid
+
+        report = asyncio.run(run_workloads(args, base_url, app_pid))
+    finally:
+        stop_processes(processes)
+
+    print(format_report(report))
+    if args.save:
+        save_report(report, args.save)
+    if args.compare:
+        return check_regressions(report, args.compare, args.tolerance)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
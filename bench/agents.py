@@ -0,0 +1,110 @@
+"""Measure what each model call costs the app in agents.
+
+    python -m bench.agents
+    python -m bench.agents --runs 2000 --concurrency 64 --save agents.json
+
+Reports how long building an agent and leasing one from an AgentPool take,
+then makes the same runs through one shared agent and through a pool
+(agent_pool.py), --concurrency at a time. Runs go in-process to the mock
+Groq app over httpx's ASGI transport, with no mock latency by default, so
+the timings are the app's own overhead per call.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+from bench.mock_groq import add_profile_arguments, create_mock_app, profile_from_args
+from bench.report import percentile
+
+os.environ.setdefault("GROQ_API_KEY", "mock")
+
+import upstream  # noqa: E402  (after GROQ_API_KEY is set)
+from agent_pool import AgentPool, AgentSpec  # noqa: E402
+
+SPEC = AgentSpec(
+    name="Bench Agent",
+    model_id="llama-3.3-70b-versatile",
+    instructions=("Answer user questions about fiat-to-crypto transactions.",),
+    markdown=True,
+)
+
+
+def per_call_us(function, count: int) -> float:
+    started = time.perf_counter()
+    for _ in range(count):
+        function()
+    return (time.perf_counter() - started) / count * 1e6
+
+
+async def measure_runs(agent, runs: int, concurrency: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await agent.arun(f"benchmark question {i}", stream=False)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(runs)))
+    wall = time.perf_counter() - started
+    return {
+        "runs_per_second": round(runs / wall, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def run(args) -> dict:
+    from groq import AsyncGroq
+
+    transport = httpx.ASGITransport(app=create_mock_app(profile_from_args(args)))
+    upstream._async_client = AsyncGroq(api_key="mock", http_client=httpx.AsyncClient(transport=transport))
+    SPEC.build()  # imports agno outside the timings
+
+    pool = AgentPool(SPEC, size=args.concurrency)
+    results = {
+        "build_us": round(statistics.median(per_call_us(SPEC.build, 200) for _ in range(5)), 1),
+        "lease_us": round(statistics.median(per_call_us(lambda: pool.release(pool.acquire()), 2000)
+                                            for _ in range(5)), 2),
+    }
+    # The shared agent keeps every run in its memory, so later batches slow down; both get the same runs
+    results["shared"] = await measure_runs(SPEC.build(), args.runs, args.concurrency)
+    results["pool"] = await measure_runs(pool, args.runs, args.concurrency)
+    results["pool_stats"] = pool.stats()
+    await upstream.close_async_client()
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--save", help="write the results as JSON")
+    add_profile_arguments(parser)
+    parser.set_defaults(latency_ms=0.0, tokens_per_second=1e9, output_tokens=20)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(f"build an agent        {results['build_us']:>10} us")
+    print(f"lease + release       {results['lease_us']:>10} us")
+    print(f"{'':<22}{'runs/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name in ("shared", "pool"):
+        entry = results[name]
+        print(f"{name:<22}{entry['runs_per_second']:>10}{entry['p50_ms']:>10}{entry['p99_ms']:>10}")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"runs": args.runs, "concurrency": args.concurrency, **results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""Rolling restart of two local instances: drain one, resume its conversations on the other.
+
+    python -m bench.handoff
+    python -m bench.handoff --sessions 50 --latency-ms 2000
+
+Starts the mock Groq server and two app instances, A and B, sharing a SQLite
+session store. --sessions /ws?stream=1 clients each have one exchange with
+A; half of them then ask again, and A gets SIGTERM while those answers are
+being generated. Checks that A fails /ready and refuses new sockets while
+draining, that the answers in flight arrive whole, that every client gets a
+reconnect hint and a 1012 close, and that every conversation continues on B
+with its history. Exits 1 if a check fails.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Dict
+
+import httpx
+import websockets
+
+from bench.mock_groq import add_profile_arguments
+from bench.processes import free_port, start_app, start_mock, stop_processes
+
+
+async def ask(ws, question: str) -> str:
+    """Send a question and read its start/delta/end frames"""
+    await ws.send(question)
+    parts = []
+    while True:
+        frame = json.loads(await ws.recv())
+        if frame["type"] == "delta":
+            parts.append(frame["content"])
+        elif frame["type"] in ("end", "error"):
+            return "".join(parts) if frame["type"] == "end" else ""
+
+
+async def client(index: int, a_url: str, b_url: str, in_flight: bool, opened: asyncio.Queue,
+                 go: asyncio.Event) -> Dict:
+    record = {"in_flight": in_flight, "turns": 1}
+    async with websockets.connect(f"{a_url}/ws?stream=1", open_timeout=30) as ws:
+        token = json.loads(await ws.recv())["session"]
+        await ask(ws, f"question {index} on A")
+        opened.put_nowait(index)
+        await go.wait()
+        if in_flight:
+            await ws.send(f"follow-up {index} during the restart")
+            record["turns"] += 1
+        parts = []
+        try:
+            while True:
+                frame = json.loads(await ws.recv())
+                if frame["type"] == "delta":
+                    parts.append(frame["content"])
+                elif frame["type"] == "end":
+                    record["answered"] = bool(parts)
+                elif frame["type"] == "reconnect":
+                    record["hint"] = frame
+        except websockets.ConnectionClosed as e:
+            record["close_code"] = e.rcvd.code if e.rcvd else None
+            record["close_reason"] = e.rcvd.reason if e.rcvd else ""
+
+    hint = record.get("hint") or {}
+    await asyncio.sleep(hint.get("retry_after", 0))
+    async with websockets.connect(f"{b_url}/ws?stream=1&session={hint.get('session', token)}",
+                                  open_timeout=30) as ws:
+        record["resumed"] = json.loads(await ws.recv())["session"] == token
+        record["answered_on_b"] = bool(await ask(ws, f"question {index} on B"))
+        record["turns"] += 1
+    record["session"] = token
+    return record
+
+
+async def probe_draining(a_http: str, a_url: str) -> Dict:
+    """What a load balancer and a new client see from A while it drains"""
+    result = {}
+    async with httpx.AsyncClient() as http:
+        try:
+            result["ready_status"] = (await http.get(f"{a_http}/ready")).status_code
+        except httpx.HTTPError as e:
+            result["ready_status"] = type(e).__name__
+    try:
+        async with websockets.connect(f"{a_url}/ws", open_timeout=5) as ws:
+            await ws.recv()
+    except websockets.ConnectionClosed as e:
+        result["new_socket"] = e.rcvd.code if e.rcvd else None
+    except websockets.InvalidStatus as e:
+        result["new_socket"] = e.response.status_code
+    except Exception as e:
+        result["new_socket"] = type(e).__name__
+    return result
+
+
+def stored_turns(path: str) -> Dict[str, int]:
+    with sqlite3.connect(path) as conn:
+        return {token: json.loads(data).get("user_turns", 0)
+                for token, data in conn.execute("SELECT token, data FROM sessions")}
+
+
+async def run(args, a, a_port: int, b_port: int, db_path: str) -> Dict:
+    a_url, b_url = f"ws://127.0.0.1:{a_port}", f"ws://127.0.0.1:{b_port}"
+    opened: asyncio.Queue = asyncio.Queue()
+    go = asyncio.Event()
+    tasks = [asyncio.create_task(client(i, a_url, b_url, i % 2 == 0, opened, go)) for i in range(args.sessions)]
+    for _ in range(args.sessions):
+        await opened.get()
+    go.set()
+    await asyncio.sleep(0.3)  # the follow-ups are being answered
+
+    started = time.perf_counter()
+    a.send_signal(signal.SIGTERM)
+    await asyncio.sleep(0.2)
+    probe = await probe_draining(f"http://127.0.0.1:{a_port}", a_url)
+    records = await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.to_thread(a.wait, 60)
+    drain_seconds = time.perf_counter() - started
+
+    await asyncio.sleep(2)  # B writes its sessions every SESSION_FLUSH_INTERVAL
+    turns = stored_turns(db_path)
+    ok = [r for r in records if isinstance(r, dict)]
+    in_flight = [r for r in ok if r["in_flight"]]
+    checks = {
+        "ready_503_while_draining": probe.get("ready_status") == 503,
+        "new_sockets_refused": probe.get("new_socket") == 1013,
+        "clients_completed": len(ok) == args.sessions,
+        "in_flight_answered": all(r.get("answered") for r in in_flight),
+        "reconnect_hints": all("hint" in r for r in ok),
+        "closed_1012_with_token": all(r.get("close_code") == 1012 and r["session"] in r.get("close_reason", "")
+                                      for r in ok),
+        "resumed_on_b": all(r.get("resumed") and r.get("answered_on_b") for r in ok),
+        "history_kept": all(turns.get(r["session"]) == r["turns"] for r in ok),
+    }
+    errors = [repr(r) for r in records if not isinstance(r, dict)]
+    return {"sessions": args.sessions, "in_flight": len(in_flight), "drain_seconds": round(drain_seconds, 2),
+            "a_exit_code": a.returncode, "probe": probe, "checks": checks, "errors": errors[:5]}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--save", help="write the results as JSON")
+    add_profile_arguments(parser)
+    parser.set_defaults(latency_ms=1500.0)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="handoff-")
+    db_path = os.path.join(directory, "sessions.db")
+    os.environ.update({"SESSION_STORE": "sqlite", "SESSION_DB_PATH": db_path,
+                       "WS_DRAIN_SPREAD": "1", "WS_RECONNECT_JITTER": "1"})
+    mock_port, a_port, b_port = free_port(), free_port(), free_port()
+    processes = [start_mock(args, mock_port)]
+    try:
+        groq_url = f"http://127.0.0.1:{mock_port}"
+        a = start_app("app", a_port, groq_url)
+        processes += [a, start_app("app", b_port, groq_url)]
+        results = asyncio.run(run(args, a, a_port, b_port, db_path))
+    finally:
+        stop_processes(processes)
+
+    print(json.dumps({key: value for key, value in results.items() if key != "checks"}))
+    for name, passed in results["checks"].items():
+        print(f"{'ok  ' if passed else 'FAIL'} {name}")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(results["checks"].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""Load generator for the /ask, /ask/stream and /ws endpoints"""
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+import websockets
+
+_TOPICS = (
+    "my bank transfer", "a card payment", "my deposit", "a withdrawal", "my wallet backup",
+    "the network fee", "a pending transaction", "account verification", "my seed phrase", "a refund",
+)
+_TEMPLATES = (
+    "Why is {topic} taking so long? (ref {n})",
+    "How do I fix a failed {topic}? (ref {n})",
+    "What are the limits for {topic}? (ref {n})",
+    "Can you explain the steps for {topic}? (ref {n})",
+)
+
+
+@dataclass
+class Sample:
+    kind: str                     # ask | ask_stream | ws | ws_stream
+    latency: float                # seconds until the full answer arrived
+    ttft: Optional[float] = None  # seconds until the first streamed delta
+    ok: bool = True
+    error: str = ""
+
+
+def make_questions(count: int, seed: int = 0, duplicate_ratio: float = 0.0) -> List[str]:
+    """Deterministic question mix; `duplicate_ratio` of them repeat an earlier question"""
+    rng = random.Random(seed)
+    questions: List[str] = []
+    for n in range(count):
+        if questions and rng.random() < duplicate_ratio:
+            questions.append(rng.choice(questions))
+        else:
+            questions.append(rng.choice(_TEMPLATES).format(topic=rng.choice(_TOPICS), n=n))
+    return questions
+
+
+async def ask_once(client: httpx.AsyncClient, question: str) -> Sample:
+    started = time.perf_counter()
+    try:
+        response = await client.post("/ask", json={"question": question})
+        latency = time.perf_counter() - started
+        if response.status_code != 200:
+            return Sample("ask", latency, ok=False, error=f"HTTP {response.status_code}")
+        return Sample("ask", latency)
+    except Exception as e:
+        return Sample("ask", time.perf_counter() - started, ok=False, error=type(e).__name__)
+
+
+async def ask_stream_once(client: httpx.AsyncClient, question: str) -> Sample:
+    started = time.perf_counter()
+    ttft = None
+    try:
+        async with client.stream("POST", "/ask/stream", json={"question": question}) as response:
+            if response.status_code != 200:
+                return Sample("ask_stream", time.perf_counter() - started, ok=False,
+                              error=f"HTTP {response.status_code}")
+            async for line in response.aiter_lines():
+                if line == "event: delta" and ttft is None:
+                    ttft = time.perf_counter() - started
+                elif line == "event: error":
+                    return Sample("ask_stream", time.perf_counter() - started, ttft, ok=False, error="stream error")
+        return Sample("ask_stream", time.perf_counter() - started, ttft)
+    except Exception as e:
+        return Sample("ask_stream", time.perf_counter() - started, ttft, ok=False, error=type(e).__name__)
+
+
+async def run_ask(base_url: str, questions: List[str], concurrency: int, stream: bool = False) -> List[Sample]:
+    """Send every question to /ask (or /ask/stream) with at most `concurrency` in flight"""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    queue = list(reversed(questions))
+    samples: List[Sample] = []
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        async def worker():
+            while queue:
+                question = queue.pop()
+                samples.append(await (ask_stream_once if stream else ask_once)(client, question))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples
+
+
+async def ws_turn(ws, question: str, stream: bool) -> Sample:
+    kind = "ws_stream" if stream else "ws"
+    started = time.perf_counter()
+    ttft = None
+    await ws.send(question)
+    if not stream:
+        answer = await ws.recv()
+        latency = time.perf_counter() - started
+        if answer.startswith("⚠️"):
+            return Sample(kind, latency, ok=False, error=answer)
+        return Sample(kind, latency)
+    while True:
+        frame = await ws.recv()
+        try:
+            message = json.loads(frame)
+        except ValueError:
+            return Sample(kind, time.perf_counter() - started, ttft, ok=False, error=frame)
+        if message.get("type") == "delta" and ttft is None:
+            ttft = time.perf_counter() - started
+        elif message.get("type") == "end":
+            return Sample(kind, time.perf_counter() - started, ttft)
+
+
+async def run_ws(ws_url: str, sessions: int, turns: int, questions: List[str], stream: bool = False,
+                 on_open: Optional[Callable[[], Awaitable[None]]] = None,
+                 on_done: Optional[Callable[[], Awaitable[None]]] = None) -> List[Sample]:
+    """Hold `sessions` WebSocket conversations of `turns` messages each.
+
+    Every session connects before any sends, and all stay open until every
+    conversation is over. `on_open` and `on_done` run at those two points,
+    e.g. to sample the server's memory.
+    """
+    url = ws_url + ("/ws?stream=1" if stream else "/ws")
+    kind = "ws_stream" if stream else "ws"
+    samples: List[Sample] = []
+    opened, finished = 0, 0
+    all_open, start, all_done, release = asyncio.Event(), asyncio.Event(), asyncio.Event(), asyncio.Event()
+
+    async def session(index: int):
+        nonlocal opened, finished
+        ws = None
+        try:
+            ws = await websockets.connect(url, max_size=None, open_timeout=30)
+            if stream:
+                await ws.recv()  # {"type": "session"}
+        except Exception as e:
+            samples.append(Sample(kind, 0.0, ok=False, error=f"connect: {type(e).__name__}"))
+        opened += 1
+        if opened == sessions:
+            all_open.set()
+        await start.wait()
+        try:
+            for turn in range(turns if ws is not None else 0):
+                question = questions[(index * turns + turn) % len(questions)]
+                try:
+                    samples.append(await ws_turn(ws, question, stream))
+                except Exception as e:
+                    samples.append(Sample(kind, 0.0, ok=False, error=type(e).__name__))
+                    break
+        finally:
+            finished += 1
+            if finished == sessions:
+                all_done.set()
+            await release.wait()
+            if ws is not None:
+                await ws.close()
+
+    tasks = [asyncio.create_task(session(i)) for i in range(sessions)]
+    await all_open.wait()
+    if on_open is not None:
+        await on_open()
+    start.set()
+    await all_done.wait()
+    if on_done is not None:
+        await on_done()
+    release.set()
+    await asyncio.gather(*tasks)
+    return samples
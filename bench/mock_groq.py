@@ -0,0 +1,167 @@
+"""Offline stand-in for the Groq chat-completions API.
+
+    python -m bench.mock_groq --port 9100 --latency-ms 300 --tokens-per-second 250
+
+Point the app at it with GROQ_BASE_URL=http://127.0.0.1:9100 and any
+GROQ_API_KEY. Both plain and streamed completions are served. Latency,
+token rate and answer text are drawn from a generator seeded with the
+prompt, so the same workload gets the same timings on every run.
+
+To exercise retries, the circuit breaker and hedging (resilience.py),
+--error-rate fails that share of calls with a 503 and --slow-rate makes
+that share of calls --slow-factor times slower. These are drawn per call,
+from a generator seeded with --seed, so a retry can succeed.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import zlib
+from dataclasses import dataclass
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_WORDS = (
+    "wallet transfer network fee confirm address balance exchange deposit withdraw "
+    "bank card verify account seed phrase backup gas pending block support step "
+    "check limit payment provider refund secure token chain"
+).split()
+
+
+@dataclass
+class MockProfile:
+    latency_ms: float = 300.0       # median time to first token
+    latency_sigma: float = 0.5      # spread of the lognormal latency distribution
+    tokens_per_second: float = 250.0
+    rate_jitter: float = 0.2        # token rate varies by +/- this fraction
+    output_tokens: int = 120
+    seed: int = 0
+    error_rate: float = 0.0         # share of calls answered with a 503
+    slow_rate: float = 0.0          # share of calls that are slow_factor times slower
+    slow_factor: float = 10.0
+
+    def draw(self, prompt: str):
+        """(latency, tokens per second, rng) for one request"""
+        rng = random.Random(zlib.crc32(prompt.encode()) ^ self.seed)
+        latency = self.latency_ms / 1000 * rng.lognormvariate(0, self.latency_sigma)
+        rate = self.tokens_per_second * rng.uniform(1 - self.rate_jitter, 1 + self.rate_jitter)
+        return latency, rate, rng
+
+
+def _chunk(model: str, delta: dict, finish_reason=None, usage=None) -> bytes:
+    chunk = {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage is not None:
+        chunk["x_groq"] = {"usage": usage}
+    return f"data: {json.dumps(chunk)}\n\n".encode()
+
+
+def create_mock_app(profile: MockProfile) -> FastAPI:
+    app = FastAPI()
+    # Faults are drawn per call rather than per prompt, so retries can succeed
+    faults = random.Random(profile.seed)
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock")
+        prompt = json.dumps(body.get("messages", []), sort_keys=True)
+        latency, rate, rng = profile.draw(prompt)
+        if faults.random() < profile.error_rate:
+            await asyncio.sleep(latency / 10)
+            return JSONResponse({"error": {"message": "mock upstream failure", "type": "internal_server_error"}},
+                                status_code=503)
+        if faults.random() < profile.slow_rate:
+            latency *= profile.slow_factor
+            rate /= profile.slow_factor
+        tokens = [rng.choice(_WORDS) + " " for _ in range(profile.output_tokens)]
+        usage = {
+            "prompt_tokens": len(prompt) // 4 + 1,
+            "completion_tokens": len(tokens),
+            "total_tokens": len(prompt) // 4 + 1 + len(tokens),
+        }
+
+        if body.get("stream"):
+            async def events():
+                await asyncio.sleep(latency)
+                started = time.perf_counter()
+                yield _chunk(model, {"role": "assistant", "content": ""})
+                for i, token in enumerate(tokens):
+                    # Keep to the schedule rather than sleeping a fixed time per token
+                    delay = started + i / rate - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    yield _chunk(model, {"content": token})
+                yield _chunk(model, {}, finish_reason="stop", usage=usage)
+                yield b"data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(latency + len(tokens) / rate)
+        return JSONResponse({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    @app.get("/openai/v1/models")
+    async def models():
+        # The app lists models at startup to open its connection pool
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "created": 0, "owned_by": "mock"}]}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    return app
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    defaults = MockProfile()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--rate-jitter", type=float, default=defaults.rate_jitter)
+    parser.add_argument("--output-tokens", type=int, default=defaults.output_tokens)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--slow-rate", type=float, default=defaults.slow_rate)
+    parser.add_argument("--slow-factor", type=float, default=defaults.slow_factor)
+
+
+def profile_from_args(args: argparse.Namespace) -> MockProfile:
+    return MockProfile(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        rate_jitter=args.rate_jitter,
+        output_tokens=args.output_tokens,
+        seed=args.seed,
+        error_rate=args.error_rate,
+        slow_rate=args.slow_rate,
+        slow_factor=args.slow_factor,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Groq chat-completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_mock_app(profile_from_args(args)), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,92 @@
+"""Starting and measuring the mock server and the app as subprocesses"""
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_bytes(pid: Optional[int]) -> Optional[int]:
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def wait_until_up(url: str, timeout: float = 30.0, interval: float = 0.2, require_ok: bool = False) -> httpx.Response:
+    """Poll `url` until it answers (with a 2xx status if `require_ok`)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = httpx.get(url, timeout=1.0)
+            if not require_ok or response.is_success:
+                return response
+        except httpx.HTTPError:
+            pass
+        time.sleep(interval)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def start_mock(args, port: int) -> subprocess.Popen:
+    """Run the mock Groq server with the profile from `args` (see mock_groq.add_profile_arguments)"""
+    command = [
+        sys.executable, "-m", "bench.mock_groq", "--port", str(port),
+        "--latency-ms", str(args.latency_ms), "--latency-sigma", str(args.latency_sigma),
+        "--tokens-per-second", str(args.tokens_per_second), "--rate-jitter", str(args.rate_jitter),
+        "--output-tokens", str(args.output_tokens), "--seed", str(args.seed),
+        "--error-rate", str(args.error_rate), "--slow-rate", str(args.slow_rate),
+        "--slow-factor", str(args.slow_factor),
+    ]
+    process = subprocess.Popen(command, cwd=REPO_ROOT)
+    wait_until_up(f"http://127.0.0.1:{port}/health")
+    return process
+
+
+def app_env(groq_url: Optional[str]) -> dict:
+    """Environment for an app under test: rate limits lifted, optionally pointed at the mock"""
+    env = dict(os.environ)
+    env.update({
+        "MESSAGE_RATE_LIMIT": "1000000/second",
+        "CONNECTION_RATE_LIMIT": "1000000/second",
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+    })
+    if groq_url:
+        env["GROQ_BASE_URL"] = groq_url
+        env.setdefault("GROQ_API_KEY", "mock")
+    return env
+
+
+def start_app(app_module: str, port: int, groq_url: Optional[str], wait: bool = True) -> subprocess.Popen:
+    """Run `app_module`:app under uvicorn"""
+    command = [sys.executable, "-m", "uvicorn", f"{app_module}:app", "--port", str(port),
+               "--log-level", "warning"]
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=app_env(groq_url), stdout=subprocess.DEVNULL)
+    if wait:
+        wait_until_up(f"http://127.0.0.1:{port}/")
+    return process
+
+
+def stop_processes(processes: List[subprocess.Popen]):
+    for process in reversed(processes):
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
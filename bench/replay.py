@@ -0,0 +1,168 @@
+"""Replay captured traffic (capture.py) against the app.
+
+    python -m bench.replay captures/requests.jsonl                 # original pacing, mock model
+    python -m bench.replay captures/requests.jsonl.* --speed 10    # ten times faster
+    python -m bench.replay captures/requests.jsonl --speed 0       # as fast as possible
+    python -m bench.replay captures/requests.jsonl --model real    # live Groq, needs GROQ_API_KEY
+
+Requests are sent at the offsets they originally arrived at, divided by
+--speed. Each captured /ws session gets one connection that sends its
+turns in order. A turn is never sent before the previous answer is back.
+With the stub model, the mock's timings depend only on the prompt, so
+replaying the same file gives the same upstream behaviour every time.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+import websockets
+
+from bench.loadgen import Sample, ask_once, ask_stream_once, ws_turn
+from bench.mock_groq import add_profile_arguments
+from bench.processes import free_port, start_app, start_mock, stop_processes
+from bench.report import check_regressions, format_report, save_report, summarize
+
+
+def load_capture(paths: List[str]) -> List[dict]:
+    """Records from one or more capture files, ordered by when the request arrived"""
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if record.get("kind") in ("ask", "ask_stream", "ws") and record.get("question"):
+                    # Records are written when the answer completes; shift back to the arrival time
+                    record["sent_at"] = record["ts"] - record.get("latency_ms", 0) / 1000
+                    records.append(record)
+    records.sort(key=lambda record: record["sent_at"])
+    return records
+
+
+def captured_samples(records: List[dict]) -> List[Sample]:
+    """The latencies seen in production, to compare with the replay"""
+    samples = []
+    for record in records:
+        kind = "ws_stream" if record["kind"] == "ws" and record.get("stream") else record["kind"]
+        samples.append(Sample(kind, record.get("latency_ms", 0) / 1000, ok=record.get("status") == "ok",
+                              error=record.get("error", "")))
+    return samples
+
+
+async def replay(records: List[dict], base_url: str, speed: float) -> List[Sample]:
+    if not records:
+        return []
+    origin = records[0]["sent_at"]
+    started = time.perf_counter()
+    samples: List[Sample] = []
+
+    async def wait_for(record: dict):
+        if speed > 0:
+            delay = (record["sent_at"] - origin) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    sessions: Dict[str, List[dict]] = defaultdict(list)
+    asks = []
+    for record in records:
+        if record["kind"] == "ws":
+            sessions[record.get("session", "")].append(record)
+        else:
+            asks.append(record)
+
+    async def send_ask(client: httpx.AsyncClient, record: dict):
+        await wait_for(record)
+        send = ask_stream_once if record["kind"] == "ask_stream" else ask_once
+        samples.append(await send(client, record["question"]))
+
+    async def run_session(turns: List[dict]):
+        stream = bool(turns[0].get("stream"))
+        kind = "ws_stream" if stream else "ws"
+        await wait_for(turns[0])
+        ws_url = "ws" + base_url[len("http"):] + ("/ws?stream=1" if stream else "/ws")
+        try:
+            async with websockets.connect(ws_url, max_size=None, open_timeout=30) as ws:
+                if stream:
+                    await ws.recv()  # {"type": "session"}
+                for record in turns:
+                    await wait_for(record)
+                    samples.append(await ws_turn(ws, record["question"], stream))
+        except Exception as e:
+            samples.append(Sample(kind, 0.0, ok=False, error=type(e).__name__))
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        await asyncio.gather(
+            *(send_ask(client, record) for record in asks),
+            *(run_session(turns) for turns in sessions.values()),
+        )
+    return samples
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+", help="capture files (JSONL)")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = original pacing, 0 = no pacing")
+    parser.add_argument("--model", choices=("stub", "real"), default="stub",
+                        help="answer with the mock Groq server or the live API")
+    parser.add_argument("--app", default="app", help="module holding the FastAPI app (app or app4)")
+    parser.add_argument("--target", help="replay against an already running app at this URL")
+    parser.add_argument("--save", help="write the replay report as JSON")
+    parser.add_argument("--compare", help="baseline JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    records = load_capture(args.captures)
+    if not records:
+        print("No replayable records found")
+        return 1
+
+    processes = []
+    try:
+        base_url = args.target.rstrip("/") if args.target else None
+        if base_url is None:
+            groq_url = None
+            if args.model == "stub":
+                mock_port = free_port()
+                processes.append(start_mock(args, mock_port))
+                groq_url = f"http://127.0.0.1:{mock_port}"
+            app_port = free_port()
+            processes.append(start_app(args.app, app_port, groq_url))
+            base_url = f"http://127.0.0.1:{app_port}"
+
+        started = time.perf_counter()
+        samples = asyncio.run(replay(records, base_url, args.speed))
+        wall = time.perf_counter() - started
+    finally:
+        stop_processes(processes)
+
+    captured_span = max(records[-1]["sent_at"] - records[0]["sent_at"], 1e-3)
+    original = captured_samples(records)
+    captured = {"workloads": summarize(original, {sample.kind: captured_span for sample in original})}
+    report = {
+        "config": {"captures": args.captures, "speed": args.speed, "model": args.model, "records": len(records)},
+        "wall_seconds": round(wall, 2),
+        "workloads": summarize(samples, {sample.kind: wall for sample in samples}),
+    }
+
+    print(f"Captured ({len(records)} requests over {captured_span:.1f}s)")
+    print(format_report(captured))
+    print(f"\nReplayed at speed {args.speed or 'max'} with the {args.model} model ({wall:.1f}s)")
+    print(format_report(report))
+    if args.save:
+        save_report(report, args.save)
+    if args.compare:
+        return check_regressions(report, args.compare, args.tolerance)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
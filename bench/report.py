@@ -0,0 +1,118 @@
+"""Summaries of a load-test run and comparison against a saved baseline"""
+import json
+import math
+from typing import Dict, List, Optional, Sequence
+
+from bench.loadgen import Sample
+
+# Summary fields where a larger value is a regression; throughput is checked the other way
+_LOWER_IS_BETTER = ("p50", "p95", "p99", "ttft_p50", "ttft_p95", "ttft_p99", "error_rate")
+
+
+def percentile(values: Sequence[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile, so results are actual observed values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples: List[Sample], wall_seconds: Dict[str, float]) -> Dict[str, dict]:
+    """Per-workload latency percentiles (ms), throughput and error rate.
+
+    `wall_seconds` is how long each workload ran, keyed by sample kind.
+    """
+    summary = {}
+    for kind in sorted({sample.kind for sample in samples}):
+        group = [sample for sample in samples if sample.kind == kind]
+        ok = [sample for sample in group if sample.ok]
+        latencies = [sample.latency * 1000 for sample in ok]
+        ttfts = [sample.ttft * 1000 for sample in ok if sample.ttft is not None]
+        wall = wall_seconds.get(kind, 0.0)
+        entry = {
+            "requests": len(group),
+            "errors": len(group) - len(ok),
+            "error_rate": round((len(group) - len(ok)) / len(group), 4),
+            "throughput": round(len(ok) / wall, 2) if wall else 0.0,
+        }
+        for pct in (50, 95, 99):
+            entry[f"p{pct}"] = _round(percentile(latencies, pct))
+        if ttfts:
+            for pct in (50, 95, 99):
+                entry[f"ttft_p{pct}"] = _round(percentile(ttfts, pct))
+        errors = sorted({sample.error for sample in group if not sample.ok})
+        if errors:
+            entry["error_kinds"] = errors[:5]
+        summary[kind] = entry
+    return summary
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 1)
+
+
+def format_report(report: dict) -> str:
+    lines = []
+    header = f"{'workload':<12}{'reqs':>7}{'errors':>8}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}" \
+             f"{'ttft50':>9}{'ttft95':>9}{'ttft99':>9}"
+    lines.append(header)
+    lines.append("-" * len(header))
+    for kind, entry in report["workloads"].items():
+        cells = [entry.get(key) for key in ("p50", "p95", "p99", "ttft_p50", "ttft_p95", "ttft_p99")]
+        lines.append(
+            f"{kind:<12}{entry['requests']:>7}{entry['errors']:>8}{entry['throughput']:>9}"
+            + "".join(f"{'-' if cell is None else cell:>9}" for cell in cells)
+        )
+        for error in entry.get("error_kinds", ()):
+            lines.append(f"    error: {error}")
+    lines.append("latencies in ms")
+    memory = report.get("memory")
+    if memory:
+        for key, value in memory.items():
+            lines.append(f"{key}: {value}")
+    return "\n".join(lines)
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Regressions of more than `tolerance` (a fraction) against the baseline report"""
+    regressions = []
+    for kind, base in baseline.get("workloads", {}).items():
+        entry = current.get("workloads", {}).get(kind)
+        if entry is None:
+            continue
+        for key in _LOWER_IS_BETTER:
+            old, new = base.get(key), entry.get(key)
+            if old is None or new is None:
+                continue
+            if key == "error_rate":
+                # Error rates are compared in absolute terms: one more failing request in a hundred
+                if new > old + 0.01:
+                    regressions.append(f"{kind} {key}: {old} -> {new}")
+            elif new > old * (1 + tolerance):
+                regressions.append(f"{kind} {key}: {old} -> {new} ms")
+        if entry["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{kind} throughput: {base['throughput']} -> {entry['throughput']} req/s")
+    return regressions
+
+
+def load_report(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_report(report: dict, path: str):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def check_regressions(report: dict, baseline_path: str, tolerance: float) -> int:
+    """Print regressions against a saved baseline; returns a process exit code"""
+    regressions = compare(report, load_report(baseline_path), tolerance)
+    if regressions:
+        print("\nRegressions against", baseline_path)
+        for regression in regressions:
+            print("  " + regression)
+        return 1
+    print(f"\nNo regressions against {baseline_path}")
+    return 0
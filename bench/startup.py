@@ -0,0 +1,88 @@
+"""Measure how long the app takes to start.
+
+    python -m bench.startup --runs 5
+    python -m bench.startup --app app4 --save startup.json
+
+Each run starts a fresh uvicorn process against the mock Groq server and
+records three times: until the app module is imported (measured in a
+separate interpreter), until / answers (the process accepts traffic), and
+until /ready returns 200 (warm-up finished). The phase timings the app
+reports on /ready are included as well.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from bench.mock_groq import add_profile_arguments
+from bench.processes import REPO_ROOT, app_env, free_port, start_app, start_mock, stop_processes, wait_until_up
+
+_IMPORT_PROBE = "import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+
+
+def measure_import(app_module: str, groq_url: str) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", _IMPORT_PROBE.format(module=app_module)],
+        cwd=REPO_ROOT, env=app_env(groq_url), capture_output=True, text=True, check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_start(app_module: str, groq_url: str) -> Dict[str, float]:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = start_app(app_module, port, groq_url, wait=False)
+    try:
+        wait_until_up(base_url + "/", interval=0.01)
+        live = time.perf_counter() - started
+        response = wait_until_up(base_url + "/ready", interval=0.01, require_ok=True)
+        ready = time.perf_counter() - started
+    finally:
+        stop_processes([process])
+    timings = {"live": live, "ready": ready}
+    for phase, seconds in response.json().get("startup", {}).items():
+        if phase not in ("ready", "warm_cache_entries"):
+            timings[f"app_{phase}"] = seconds
+    return timings
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="app", help="module holding the FastAPI app (app or app4)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--save", help="write the results as JSON")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    mock_port = free_port()
+    mock = start_mock(args, mock_port)
+    groq_url = f"http://127.0.0.1:{mock_port}"
+    runs: Dict[str, List[float]] = {}
+    try:
+        for _ in range(args.runs):
+            runs.setdefault("import", []).append(measure_import(args.app, groq_url))
+            for name, seconds in measure_start(args.app, groq_url).items():
+                runs.setdefault(name, []).append(seconds)
+    finally:
+        stop_processes([mock])
+
+    summary = {
+        name: {"median": round(statistics.median(values), 3), "min": round(min(values), 3),
+               "max": round(max(values), 3)}
+        for name, values in runs.items()
+    }
+    print(f"{'seconds':<26}{'median':>9}{'min':>9}{'max':>9}")
+    for name, entry in summary.items():
+        print(f"{name:<26}{entry['median']:>9}{entry['min']:>9}{entry['max']:>9}")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"app": args.app, "runs": args.runs, "startup": summary}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""Measure the /suggest index: rebuild time and lookup latency per keystroke.
+
+    python -m bench.suggest
+    python -m bench.suggest --questions 5000 --save suggest.json
+
+Builds a SuggestIndex over --questions synthetic questions drawn from a
+support vocabulary, with skewed counts like real traffic, then times a
+lookup for every prefix a user would type of --samples questions.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Dict, List
+
+from bench.report import percentile
+from suggest import SuggestIndex
+
+VOCABULARY = (
+    "how do i can why is my what are the fees to send receive buy sell withdraw deposit bitcoin ethereum "
+    "usdc wallet bank card transfer limit verify account identity seed phrase reset password "
+    "transaction pending failed refund network gas fee exchange rate payout kyc document"
+).split()
+
+
+def synthetic_questions(count: int, rng: random.Random) -> Dict[str, int]:
+    questions: Dict[str, int] = {}
+    while len(questions) < count:
+        text = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(4, 12))) + "?"
+        questions[text] = int(rng.paretovariate(1.2) * 3)
+    return questions
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    questions = synthetic_questions(args.questions, rng)
+    index = SuggestIndex(lambda key: "answer", lambda: [], size=args.questions, min_count=1)
+    for text, count in questions.items():
+        for asker in range(count):
+            index.observe(text, f"10.0.0.{asker}")
+
+    started = time.perf_counter()
+    index.rebuild()
+    rebuild_ms = (time.perf_counter() - started) * 1000
+
+    by_length: Dict[int, List[float]] = {}
+    for text in rng.sample(list(questions), min(args.samples, len(questions))):
+        for length in range(2, len(text) + 1):
+            prefix = text[:length]
+            started = time.perf_counter()
+            index.suggest(prefix)
+            by_length.setdefault(min(length, 20), []).append(time.perf_counter() - started)
+    everything = [value for values in by_length.values() for value in values]
+    return {
+        "questions": len(index),
+        "rebuild_ms": round(rebuild_ms, 1),
+        "lookups": len(everything),
+        "p50_us": round(percentile(everything, 50) * 1e6, 2),
+        "p99_us": round(percentile(everything, 99) * 1e6, 2),
+        "p50_us_by_length": {length: round(percentile(values, 50) * 1e6, 2)
+                             for length, values in sorted(by_length.items())},
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=2000)
+    parser.add_argument("--samples", type=int, default=300, help="questions typed out prefix by prefix")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(f"indexed questions     {results['questions']:>10}")
+    print(f"rebuild               {results['rebuild_ms']:>10} ms")
+    print(f"lookup p50            {results['p50_us']:>10} us")
+    print(f"lookup p99            {results['p99_us']:>10} us")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Opt-in traffic capture for replaying production load (see bench/replay.py).
+
+    CAPTURE=1 uvicorn app:app
+
+Every /ask, /ask/stream and /ws exchange is appended as one JSON line to
+CAPTURE_PATH, which rotates at CAPTURE_MAX_MB. The request path only puts
+a dict on a bounded queue. A writer thread redacts, serializes and writes
+the records in batches. If the queue is full, records are dropped and
+counted rather than slowing requests down.
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import AsyncIterator, Optional
+
+from structured_log import redact
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_ENABLED = os.getenv("CAPTURE", "").lower() in ("1", "true", "yes")
+CAPTURE_PATH = os.getenv("CAPTURE_PATH", "captures/requests.jsonl")
+CAPTURE_MAX_MB = float(os.getenv("CAPTURE_MAX_MB", "64"))
+CAPTURE_BACKUPS = int(os.getenv("CAPTURE_BACKUPS", "5"))
+CAPTURE_QUEUE_SIZE = int(os.getenv("CAPTURE_QUEUE_SIZE", "10000"))
+# Wallet addresses, keys and emails are masked before anything reaches disk
+CAPTURE_REDACT = os.getenv("CAPTURE_REDACT", "1").lower() in ("1", "true", "yes")
+
+CAPTURE_BATCH = 256
+CAPTURE_FLUSH_INTERVAL = 1.0
+
+_TEXT_FIELDS = ("question", "response")
+
+
+def session_ref(session_id: str) -> str:
+    """Stable stand-in for a session token; the token itself lets anyone resume the session"""
+    return hashlib.sha256(session_id.encode()).hexdigest()[:16]
+
+
+class TrafficRecorder:
+    """Appends request/response/latency records to rotated JSONL files from a writer thread"""
+
+    def __init__(self, path: str = CAPTURE_PATH, enabled: bool = CAPTURE_ENABLED,
+                 max_bytes: int = int(CAPTURE_MAX_MB * 1024 * 1024), backups: int = CAPTURE_BACKUPS,
+                 queue_size: int = CAPTURE_QUEUE_SIZE, redact_text: bool = CAPTURE_REDACT):
+        self.path = path
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.redact_text = redact_text
+        self.counters = {"recorded": 0, "written": 0, "dropped": 0, "rotations": 0, "write_errors": 0}
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+
+    def record(self, kind: str, **fields):
+        """Queue one record; never blocks"""
+        if not self.enabled:
+            return
+        fields["kind"] = kind
+        fields["ts"] = round(time.time(), 3)
+        try:
+            self._queue.put_nowait(fields)
+            self.counters["recorded"] += 1
+        except queue.Full:
+            self.counters["dropped"] += 1
+
+    def record_stream(self, kind: str, deltas: AsyncIterator[str], started: float, **fields) -> AsyncIterator[str]:
+        """Pass a stream of deltas through, recording the whole answer once it ends"""
+        if not self.enabled:
+            return deltas
+        return self._recorded_stream(kind, deltas, started, fields)
+
+    async def _recorded_stream(self, kind: str, deltas: AsyncIterator[str], started: float,
+                               fields: dict) -> AsyncIterator[str]:
+        parts = []
+        status = "error"
+        try:
+            async for delta in deltas:
+                parts.append(delta)
+                yield delta
+            status = "ok"
+        finally:
+            self.record(kind, response="".join(parts), status=status,
+                        latency_ms=round((time.perf_counter() - started) * 1000, 1), **fields)
+
+    def start(self):
+        if self.enabled and self._thread is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Write out everything queued and stop the writer thread"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "queued": self._queue.qsize(), **self.counters}
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self._queue.get(timeout=CAPTURE_FLUSH_INTERVAL)
+            except queue.Empty:
+                continue
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= CAPTURE_BATCH:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            stopping = item is None
+            if batch:
+                self._write(batch)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, batch):
+        lines = []
+        for record in batch:
+            if self.redact_text:
+                for field in _TEXT_FIELDS:
+                    if isinstance(record.get(field), str):
+                        record[field] = redact(record[field])
+            lines.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        try:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+            self.counters["written"] += len(lines)
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            self.counters["write_errors"] += 1
+            logger.warning("traffic capture write failed: %s", e)
+
+    def _rotate(self):
+        """requests.jsonl -> requests.jsonl.1 -> ... -> requests.jsonl.<backups>"""
+        self._file.close()
+        self._file = None
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.counters["rotations"] += 1
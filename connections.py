@@ -0,0 +1,293 @@
+"""WebSocket connection management for many mostly-idle chats per worker.
+
+- Caps: at most WS_MAX_CONNECTIONS per worker and WS_MAX_CONNECTIONS_PER_IP
+  per client address; connections over a cap are refused with 1013. A
+  refused socket is accepted and then closed, so the client sees the code
+  and reason rather than a bare HTTP 403.
+- Heartbeats: dead peers are found by uvicorn's protocol-level pings
+  (--ws-ping-interval / --ws-ping-timeout). On top of that, clients of the
+  JSON frame protocols (/ws?stream=1 and v2, ws_protocol.py) get a
+  {"type": "ping"} frame every WS_HEARTBEAT_INTERVAL, so proxies see
+  traffic and a broken socket is noticed on the next write.
+- Idle reaping: a connection with no client message for WS_IDLE_TIMEOUT is
+  closed with 1001. After WS_DETACH_SECONDS idle its conversation is
+  released to the session store, which may move it out of RAM; it is
+  attached again when the next message arrives.
+- Memory: each connection is charged a fixed overhead plus its resident
+  history and queued messages. Messages over WS_MAX_MESSAGE_CHARS close the
+  connection with 1009; messages that would take it over
+  WS_MEMORY_BUDGET_KB are refused.
+- Drain: drain() stops new connections and lets each open one finish the
+  answers it owes, within WS_DRAIN_TIMEOUT, then hands it off: its session
+  is written to the session store, JSON-frame clients get
+  {"type": "reconnect", "session": "...", "retry_after": 1.7}, and the
+  socket is closed with 1012 and the session token in the close reason.
+  Closes are spread over WS_DRAIN_SPREAD seconds and clients are told to
+  wait a random part of WS_RECONNECT_JITTER, so they do not all reconnect
+  at once. Clients that reconnect with /ws?session=<token> to another
+  instance continue the conversation, provided the instances share a
+  session store (SESSION_STORE=sqlite on one host, or the shared store).
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Dict, Optional
+
+from fastapi import WebSocket
+
+from history import ConversationHistory
+from metrics import WEBSOCKET_CONNECTIONS
+from session_store import InMemoryBackend, SessionStore, resolve_session_token
+
+logger = logging.getLogger(__name__)
+
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "20000"))
+WS_MAX_CONNECTIONS_PER_IP = int(os.getenv("WS_MAX_CONNECTIONS_PER_IP", "50"))
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "30"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "900"))
+WS_DETACH_SECONDS = float(os.getenv("WS_DETACH_SECONDS", "120"))
+WS_MAX_MESSAGE_CHARS = int(os.getenv("WS_MAX_MESSAGE_CHARS", "4000"))
+WS_MEMORY_BUDGET_KB = float(os.getenv("WS_MEMORY_BUDGET_KB", "256"))
+WS_DRAIN_TIMEOUT = float(os.getenv("WS_DRAIN_TIMEOUT", "20"))
+# Idle connections are closed at random times within this many seconds of the drain starting
+WS_DRAIN_SPREAD = float(os.getenv("WS_DRAIN_SPREAD", "5"))
+# Clients are told to wait up to this many seconds before reconnecting
+WS_RECONNECT_JITTER = float(os.getenv("WS_RECONNECT_JITTER", "3"))
+# Rough cost of the socket, its buffers and the two tasks serving a connection
+CONNECTION_OVERHEAD_BYTES = 16 * 1024
+# Writes to a client that stopped reading are given up after this long
+SEND_TIMEOUT = 5.0
+
+SYSTEM_PROMPT = "You are a helpful customer support agent for a crypto platform."
+
+
+class Connection:
+    __slots__ = ("websocket", "session_id", "client_ip", "stream", "opened_at", "last_seen", "busy",
+                 "queued_bytes", "history", "closing", "profile_mode")
+
+    def __init__(self, websocket: WebSocket, session_id: str, client_ip: str, stream: bool,
+                 history: ConversationHistory):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.client_ip = client_ip
+        self.stream = stream
+        self.opened_at = self.last_seen = time.monotonic()
+        self.busy = False          # answering a message
+        self.queued_bytes = 0      # received messages waiting to be answered
+        self.history: Optional[ConversationHistory] = history  # None while detached
+        self.closing = False
+        self.profile_mode: Optional[str] = None  # set when an admin asked to profile the connection
+
+    def memory_bytes(self) -> int:
+        history = self.history.memory_bytes() if self.history is not None else 0
+        return CONNECTION_OVERHEAD_BYTES + self.queued_bytes + history
+
+
+class ConnectionManager:
+    def __init__(self, sessions: SessionStore):
+        self.sessions = sessions
+        self.active_connections: Dict[str, Connection] = {}
+        self.draining = False
+        self.memory_budget = int(WS_MEMORY_BUDGET_KB * 1024)
+        self._per_ip: Dict[str, int] = {}
+        self._connecting = 0
+        self._reaper: Optional[asyncio.Task] = None
+        self.counters = {"accepted": 0, "rejected_global": 0, "rejected_ip": 0, "reaped_idle": 0,
+                         "heartbeat_failures": 0, "detached": 0, "oversized": 0, "over_budget": 0, "drained": 0}
+
+    @property
+    def user_sessions(self) -> Dict[str, ConversationHistory]:
+        return self.sessions.resident
+
+    def refusal(self, client_ip: str) -> Optional[str]:
+        """Why a new connection from this address cannot be accepted, or None"""
+        if self.draining:
+            return "Server restarting"
+        if len(self.active_connections) + self._connecting >= WS_MAX_CONNECTIONS:
+            self.counters["rejected_global"] += 1
+            return "Too many connections"
+        if self._per_ip.get(client_ip, 0) >= WS_MAX_CONNECTIONS_PER_IP:
+            self.counters["rejected_ip"] += 1
+            return "Too many connections from your address"
+        return None
+
+    async def refuse(self, websocket: WebSocket, code: int, reason: str, subprotocol: Optional[str] = None):
+        """Turn a new socket away with a close code and reason it can read"""
+        try:
+            await websocket.accept(subprotocol=subprotocol or None)
+            await asyncio.wait_for(websocket.close(code=code, reason=reason), SEND_TIMEOUT)
+        except Exception:
+            pass
+
+    async def connect(self, websocket: WebSocket, client_ip: str, stream: bool,
+                      subprotocol: Optional[str] = None) -> Connection:
+        # Clients resume a conversation by reconnecting with /ws?session=<token>
+        session_id = resolve_session_token(websocket.query_params.get("session"))
+        self._per_ip[client_ip] = self._per_ip.get(client_ip, 0) + 1
+        self._connecting += 1
+        try:
+            history = await self.sessions.attach(session_id, system_prompt=SYSTEM_PROMPT)
+            try:
+                await websocket.accept(subprotocol=subprotocol or None,
+                                       headers=[(b"x-session-id", session_id.encode())])
+            except BaseException:
+                self.sessions.release(session_id)
+                raise
+        except BaseException:
+            self._release_ip(client_ip)
+            raise
+        finally:
+            self._connecting -= 1
+        WEBSOCKET_CONNECTIONS.labels().inc()
+        self.counters["accepted"] += 1
+
+        connection = Connection(websocket, session_id, client_ip, stream, history)
+        # A session follows its newest connection
+        previous = self.active_connections.get(session_id)
+        self.active_connections[session_id] = connection
+        if previous is not None:
+            await self._close(previous, 4000, "Session resumed on another connection")
+        return connection
+
+    def disconnect(self, connection: Connection):
+        WEBSOCKET_CONNECTIONS.labels().dec()
+        if self.active_connections.get(connection.session_id) is connection:
+            del self.active_connections[connection.session_id]
+        self._release_ip(connection.client_ip)
+        if connection.history is not None:
+            connection.history = None
+            self.sessions.release(connection.session_id)
+
+    async def history(self, connection: Connection) -> ConversationHistory:
+        """The connection's conversation, attached again if it was released while idle"""
+        if connection.history is None:
+            connection.history = await self.sessions.attach(connection.session_id, system_prompt=SYSTEM_PROMPT)
+        return connection.history
+
+    def admit_message(self, connection: Connection, message: str) -> Optional[str]:
+        """Charge a received message to the connection; returns why it is refused, or None"""
+        if connection.closing:
+            return "restarting"
+        if len(message) > WS_MAX_MESSAGE_CHARS:
+            self.counters["oversized"] += 1
+            return "too_long"
+        if connection.memory_bytes() + len(message) > self.memory_budget:
+            self.counters["over_budget"] += 1
+            return "over_budget"
+        connection.queued_bytes += len(message)
+        return None
+
+    def start(self):
+        # Accept connections again if an earlier lifespan drained this manager
+        self.draining = False
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+
+    async def drain(self, timeout: float = WS_DRAIN_TIMEOUT, spread: float = WS_DRAIN_SPREAD):
+        """Hand every connection off once it has answered what it owes, within `timeout`"""
+        self.draining = True
+        connections = list(self.active_connections.values())
+        if connections:
+            logger.info("draining websocket connections", extra={"connections": len(connections)})
+            if isinstance(self.sessions.backend, InMemoryBackend):
+                logger.warning("sessions are kept in process memory; reconnecting clients will start over")
+        await asyncio.gather(*(self._drain_one(connection, timeout, spread) for connection in connections))
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.active_connections),
+            "addresses": len(self._per_ip),
+            "attached": sum(1 for c in self.active_connections.values() if c.history is not None),
+            "memory_bytes": sum(c.memory_bytes() for c in self.active_connections.values()),
+            "draining": int(self.draining),
+            **self.counters,
+        }
+
+    async def _drain_one(self, connection: Connection, timeout: float, spread: float):
+        deadline = time.monotonic() + timeout
+        await asyncio.sleep(random.uniform(0, min(spread, timeout)))
+        while (connection.busy or connection.queued_bytes) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        await self.hand_off(connection)
+
+    async def hand_off(self, connection: Connection):
+        """Save the connection's session and close it with a hint to resume it elsewhere"""
+        if connection.closing:
+            return
+        # Messages that arrive from here on are refused, so none is answered after the save
+        connection.closing = True
+        self.counters["drained"] += 1
+        token = connection.session_id
+        try:
+            await self.sessions.save(token)
+        except Exception as e:
+            logger.warning("could not save session for hand-off: %s", e)
+        if connection.stream:
+            hint = {"type": "reconnect", "session": token,
+                    "retry_after": round(random.uniform(0.5, max(0.5, WS_RECONNECT_JITTER)), 1)}
+            try:
+                await asyncio.wait_for(connection.websocket.send_json(hint), SEND_TIMEOUT)
+            except Exception:
+                pass
+        # Service Restart; plain-text clients find the token in the reason
+        await self._close_socket(connection, 1012, f"Server restarting; reconnect with ?session={token}")
+
+    async def _close(self, connection: Connection, code: int, reason: str):
+        if connection.closing:
+            return
+        connection.closing = True
+        await self._close_socket(connection, code, reason)
+
+    async def _close_socket(self, connection: Connection, code: int, reason: str):
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=code, reason=reason), SEND_TIMEOUT)
+        except Exception:
+            pass
+
+    def _release_ip(self, client_ip: str):
+        count = self._per_ip.get(client_ip, 0) - 1
+        if count > 0:
+            self._per_ip[client_ip] = count
+        else:
+            self._per_ip.pop(client_ip, None)
+
+    async def _heartbeat(self, connection: Connection):
+        try:
+            await asyncio.wait_for(connection.websocket.send_json({"type": "ping"}), SEND_TIMEOUT)
+        except Exception:
+            self.counters["heartbeat_failures"] += 1
+            await self._close(connection, 1011, "Heartbeat failed")
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            try:
+                await self._reap()
+            except Exception as e:
+                logger.warning("connection reaping failed: %s", e)
+
+    async def _reap(self):
+        now = time.monotonic()
+        work = []
+        for connection in list(self.active_connections.values()):
+            if connection.busy or connection.queued_bytes or connection.closing:
+                continue
+            idle = now - connection.last_seen
+            if idle >= WS_IDLE_TIMEOUT:
+                self.counters["reaped_idle"] += 1
+                work.append(self._close(connection, 1001, "Idle timeout"))  # Going Away
+                continue
+            if idle >= WS_DETACH_SECONDS and connection.history is not None:
+                connection.history = None
+                self.sessions.release(connection.session_id)
+                self.counters["detached"] += 1
+            if connection.stream:
+                work.append(self._heartbeat(connection))
+        await asyncio.gather(*work)
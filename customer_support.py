@@ -1,22 +1,188 @@
-from agno.agent import Agent
-from agno.models.groq import Groq
-from agno.tools import WebSearchTools
+"""Customer support agent on the command line.
+
+    python customer_support.py                                    # interactive chat
+    python customer_support.py --batch questions.jsonl --output answers.jsonl --concurrency 8
+
+Batch mode reads questions from JSONL (objects with "question" and an
+optional "id", or plain strings) or CSV (a "question" column, optional
+"id"), answers them concurrently and appends one JSON line per question to
+--output as each finishes, with its latency and token counts. Questions
+already answered in --output are skipped, so an interrupted run picks up
+where it stopped; failed ones are tried again. Lines that are not questions
+are recorded as errors.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, Set
+
+import resilience
+from agent_pool import AgentPool, AgentSpec
+from tool_calls import ToolRunner, search_tools
+from upstream import close_async_client, extract_response_text, response_tokens
+
+# Cached, concurrent and time-budgeted tool calls (tool_calls.py)
+tool_runner = ToolRunner()
 
 # Define the Customer Support AI Agent
-customer_support_agent = Agent(
+SUPPORT_AGENT = AgentSpec(
     name="Crypto Support AI",
     role="Provide customer support for a decentralized fiat-to-crypto platform.",
-    model=Groq(id="llama-3.3-70b-versatile"),  # Uses a Groq AI model
-    tools=[WebSearchTools()],  # Optional: Enable live web search
-    instructions=[
+    model_id="llama-3.3-70b-versatile",  # Uses a Groq AI model
+    tools=(tool_runner.wrap(search_tools()),),  # Optional: Enable live web search
+    instructions=(
         "Help users with fiat-to-crypto transactions.",
         "Provide troubleshooting steps for common errors.",
         "Explain how to set up and secure crypto wallets.",
         "Always be polite and concise in responses.",
-    ],
+    ),
     markdown=True,  # Enables formatted responses
     show_tool_calls=True,  # Show when the AI uses external tools
 )
 
-# Start an interactive chat session
-customer_support_agent.cli_app()
+
+def read_questions(path: str) -> Iterator[Dict[str, str]]:
+    """{"id", "question"} items from a JSONL or CSV file; the id defaults to the question.
+
+    A JSONL line that is not a question object or string comes out as
+    {"id": "line N", "error": ...}, so the batch records it and goes on.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            rows = ((None, {"id": row.get("id"), "question": row.get("question")}) for row in csv.DictReader(f))
+        else:
+            rows = ((number, line) for number, line in enumerate(f, 1) if line.strip())
+        for number, row in rows:
+            if number is not None:
+                try:
+                    row = json.loads(row)
+                except ValueError as e:
+                    yield {"id": f"line {number}", "error": f"Not JSON: {e}"}
+                    continue
+                if isinstance(row, str):
+                    row = {"question": row}
+                elif not isinstance(row, dict):
+                    yield {"id": f"line {number}", "error": f"Expected an object or a string, not {type(row).__name__}"}
+                    continue
+            question = row.get("question")
+            if question is not None and not isinstance(question, str):
+                yield {"id": f"line {number}", "error": "The question must be a string"}
+                continue
+            question = (question or "").strip()
+            if question:
+                yield {"id": str(row.get("id") or question), "question": question}
+
+
+def answered_ids(path: str) -> Set[str]:
+    """Ids with an ok result in an earlier run's output"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+def ends_mid_line(path: str) -> bool:
+    """Whether an interrupted run left half a line at the end of the file"""
+    if not os.path.getsize(path):
+        return False
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+async def answer_one(pool: AgentPool, item: Dict[str, str]) -> dict:
+    started = time.perf_counter()
+    resilience.start_deadline()
+    record = {"id": item["id"], "question": item["question"]}
+    try:
+        response = await resilience.run(pool, item["question"])
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+    else:
+        input_tokens, output_tokens = response_tokens(response)
+        record.update(status="ok", answer=extract_response_text(response).strip(),
+                      input_tokens=input_tokens, output_tokens=output_tokens)
+    record["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return record
+
+
+async def run_batch(input_path: str, output_path: str, concurrency: int) -> dict:
+    done = answered_ids(output_path)
+    pending: asyncio.Queue = asyncio.Queue()
+    invalid = []
+    skipped = 0
+    for item in read_questions(input_path):
+        if "error" in item:
+            invalid.append({"id": item["id"], "status": "error", "error": item["error"]})
+            continue
+        if item["id"] in done:
+            skipped += 1
+            continue
+        done.add(item["id"])  # answer repeated questions once
+        pending.put_nowait(item)
+
+    pool = AgentPool(SUPPORT_AGENT, size=concurrency)
+    totals = {"answered": 0, "failed": len(invalid), "skipped": skipped, "input_tokens": 0, "output_tokens": 0}
+    started = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        if ends_mid_line(output_path):
+            out.write("\n")
+        for record in invalid:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        async def worker():
+            while not pending.empty():
+                record = await answer_one(pool, pending.get_nowait())
+                # One complete line per answer, flushed, so an interruption loses at most the ones in flight
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                totals["answered" if record["status"] == "ok" else "failed"] += 1
+                totals["input_tokens"] += record.get("input_tokens", 0)
+                totals["output_tokens"] += record.get("output_tokens", 0)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, pending.qsize())))))
+
+    await close_async_client()
+    totals["seconds"] = round(time.perf_counter() - started, 2)
+    totals["per_second"] = round(totals["answered"] / totals["seconds"], 2) if totals["seconds"] else 0.0
+    return totals
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", metavar="QUESTIONS", help="JSONL or CSV file of questions to answer")
+    parser.add_argument("--output", help="JSONL file the answers are appended to (default: <QUESTIONS>.answers.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="questions answered at once; keep within UPSTREAM_CONCURRENCY")
+    args = parser.parse_args()
+
+    if args.batch is None:
+        # Start an interactive chat session; the async loop lets one step's tool calls run together
+        asyncio.run(SUPPORT_AGENT.build().acli_app())
+        return 0
+
+    output = args.output or os.path.splitext(args.batch)[0] + ".answers.jsonl"
+    try:
+        totals = asyncio.run(run_batch(args.batch, output, args.concurrency))
+    except KeyboardInterrupt:
+        print(f"Interrupted; run the same command again to resume from {output}", file=sys.stderr)
+        return 130
+    print(json.dumps(totals), file=sys.stderr)
+    return 1 if totals["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
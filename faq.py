@@ -0,0 +1,299 @@
+"""Local FAQ and documentation index (BM25), consulted before the model.
+
+Documents are Markdown or text files in FAQ_DIR; with FAQ_DIR unset there
+are none. examples/faq shows the format, its contents are placeholders and
+not policy. Each "## " section is one
+passage. A section whose heading ends in "?" is a canonical FAQ entry: a
+question that matches its heading closely enough gets the section body as
+the answer, without a model call. A question with a negation ("not",
+"didn't", ...) the heading lacks, or the other way round, never matches it.
+For other questions the best passages
+are added to the prompt.
+
+The index is rebuilt incrementally: every FAQ_RELOAD_INTERVAL seconds the
+directory is re-scanned, and only added, changed or removed files are
+re-indexed.
+"""
+import asyncio
+import logging
+import math
+import os
+import sys
+from collections import Counter
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from answer_cache import normalize_question, question_terms
+
+logger = logging.getLogger(__name__)
+
+# Directory of curated documents; empty disables the FAQ
+FAQ_DIR = os.getenv("FAQ_DIR", "")
+# How closely (IDF-weighted, 0-1) a question must match an FAQ heading to answer directly
+FAQ_ANSWER_THRESHOLD = float(os.getenv("FAQ_ANSWER_THRESHOLD", "0.75"))
+FAQ_CONTEXT_PASSAGES = int(os.getenv("FAQ_CONTEXT_PASSAGES", "3"))
+# Passages scoring below this (BM25) are not worth the prompt space
+FAQ_CONTEXT_MIN_SCORE = float(os.getenv("FAQ_CONTEXT_MIN_SCORE", "2.0"))
+FAQ_CONTEXT_MAX_CHARS = int(os.getenv("FAQ_CONTEXT_MAX_CHARS", "1500"))
+FAQ_RELOAD_INTERVAL = float(os.getenv("FAQ_RELOAD_INTERVAL", "30"))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Questions with fewer content words are never answered from the FAQ directly
+MIN_ANSWER_TERMS = 2
+_EXTENSIONS = (".md", ".txt")
+# On top of the answer cache's stopwords: words that carry no topic in a support question.
+# "s" and "t" are what is left of contractions once punctuation is dropped
+_FILLER = frozenset({
+    "what", "why", "how", "when", "where", "which", "who", "and", "or", "if", "with", "from",
+    "at", "by", "as", "this", "that", "there", "your", "our", "we", "they", "it", "s", "t",
+})
+# Negations are kept as terms, and a question only matches a heading with the same ones
+_NEGATIONS = frozenset({
+    "not", "no", "never", "cannot", "didn", "doesn", "don", "isn", "wasn", "aren", "weren",
+    "won", "haven", "hasn", "couldn", "wouldn", "shouldn",
+})
+
+
+def _terms(text: str) -> List[str]:
+    return [sys.intern(term) for term in question_terms(normalize_question(text)) if term not in _FILLER]
+
+
+class Passage:
+    __slots__ = ("source", "title", "text", "length", "question")
+
+    def __init__(self, source: str, title: str, text: str, length: int, question: Optional[FrozenSet[str]]):
+        self.source = source
+        self.title = title
+        self.text = text
+        self.length = length
+        # Terms of the heading, for canonical FAQ entries only
+        self.question = question
+
+
+def parse_document(source: str, text: str) -> List[Tuple[Passage, Counter]]:
+    """Split a document into passages on "## " headings, with each passage's term counts"""
+    title = os.path.splitext(os.path.basename(source))[0].replace("-", " ").replace("_", " ")
+    sections: List[Tuple[str, List[str]]] = [(title, [])]
+    for line in text.splitlines():
+        if line.startswith("# ") and not sections[-1][1] and len(sections) == 1:
+            sections[0] = (line[2:].strip(), [])
+        elif line.startswith("## "):
+            sections.append((line[3:].strip(), []))
+        else:
+            sections[-1][1].append(line)
+
+    passages = []
+    for heading, lines in sections:
+        body = "\n".join(lines).strip()
+        if not body:
+            continue
+        counts = Counter(_terms(heading) + _terms(body))
+        question = frozenset(_terms(heading)) if heading.endswith("?") else None
+        passages.append((Passage(source, heading, body, sum(counts.values()), question), counts))
+    return passages
+
+
+class FAQIndex:
+    """In-memory BM25 index over the passages in a directory"""
+
+    def __init__(self, directory: str = FAQ_DIR, answer_threshold: float = FAQ_ANSWER_THRESHOLD):
+        self.directory = directory
+        self.answer_threshold = answer_threshold
+        self._passages: Dict[int, Passage] = {}
+        self._terms: Dict[int, Tuple[str, ...]] = {}      # passage -> distinct terms, for removal
+        self._postings: Dict[str, Dict[int, int]] = {}    # term -> {passage: term frequency}
+        self._files: Dict[str, Tuple[float, int, List[int]]] = {}  # path -> (mtime, size, passages)
+        self._total_length = 0
+        self._next_id = 0
+        self._reload_task: Optional[asyncio.Task] = None
+        self.counters = {"answers": 0, "contexts": 0, "misses": 0, "reloads": 0}
+
+    def __len__(self) -> int:
+        return len(self._passages)
+
+    def load(self):
+        """Index the directory synchronously (startup)"""
+        self._apply(*self._scan())
+
+    async def refresh(self):
+        """Re-index files that were added, changed or removed since the last scan"""
+        changed, removed = await asyncio.to_thread(self._scan)
+        if changed or removed:
+            self._apply(changed, removed)
+            self.counters["reloads"] += 1
+            logger.info("faq index updated", extra={"files": len(changed) + len(removed), "passages": len(self)})
+
+    def start(self):
+        if self._reload_task is None and FAQ_RELOAD_INTERVAL > 0:
+            self._reload_task = asyncio.create_task(self._reload_loop())
+
+    async def close(self):
+        if self._reload_task is not None:
+            self._reload_task.cancel()
+            self._reload_task = None
+
+    def search(self, question: str, limit: int = FAQ_CONTEXT_PASSAGES) -> List[Tuple[float, Passage]]:
+        """Best passages for the question by BM25 score, highest first"""
+        terms = set(_terms(question))
+        if not terms or not self._passages:
+            return []
+        count = len(self._passages)
+        average_length = self._total_length / count
+        scores: Dict[int, float] = {}
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for passage_id, frequency in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._passages[passage_id].length / average_length)
+                scores[passage_id] = scores.get(passage_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(score, self._passages[passage_id]) for passage_id, score in best]
+
+    def answer(self, question: str) -> Optional[str]:
+        """Canonical answer when the question closely matches an FAQ heading"""
+        terms = frozenset(_terms(question))
+        if len(terms) < MIN_ANSWER_TERMS:
+            return None
+        best, best_confidence = None, 0.0
+        for _, passage in self.search(question):
+            if passage.question is None or terms & _NEGATIONS != passage.question & _NEGATIONS:
+                continue
+            confidence = self._overlap(terms, passage.question)
+            if confidence > best_confidence:
+                best, best_confidence = passage, confidence
+        if best is not None and best_confidence >= self.answer_threshold:
+            self.counters["answers"] += 1
+            return best.text
+        return None
+
+    def context(self, question: str) -> Optional[str]:
+        """Relevant passages for the prompt, or None when nothing scores well enough"""
+        parts = []
+        size = 0
+        for score, passage in self.search(question):
+            if score < FAQ_CONTEXT_MIN_SCORE:
+                break
+            part = f"{passage.title}\n{passage.text}"
+            if size + len(part) > FAQ_CONTEXT_MAX_CHARS:
+                part = part[:max(FAQ_CONTEXT_MAX_CHARS - size, 0)]
+            if part:
+                parts.append(part)
+                size += len(part)
+            if size >= FAQ_CONTEXT_MAX_CHARS:
+                break
+        if not parts:
+            self.counters["misses"] += 1
+            return None
+        self.counters["contexts"] += 1
+        return "\n\n".join(parts)
+
+    def best_passage(self, question: str) -> Optional[str]:
+        """Text of the best matching passage, if it scores well enough to stand in for an answer"""
+        for score, passage in self.search(question, limit=1):
+            if score >= FAQ_CONTEXT_MIN_SCORE:
+                return passage.text
+        return None
+
+    def prompt(self, question: str) -> str:
+        """The question, with relevant documentation appended when there is any"""
+        context = self.context(question)
+        if context is None:
+            return question
+        return f"{question}\n\nRelevant platform documentation (use it if it applies):\n{context}"
+
+    def with_context(self, messages: List[dict]) -> List[dict]:
+        """Chat messages with relevant documentation inserted before the latest user message"""
+        if not messages or messages[-1].get("role") != "user":
+            return messages
+        context = self.context(messages[-1]["content"])
+        if context is None:
+            return messages
+        note = {"role": "system", "content": f"Relevant platform documentation (use it if it applies):\n{context}"}
+        return [*messages[:-1], note, messages[-1]]
+
+    def questions(self) -> List[Tuple[str, str]]:
+        """(heading, answer) of every canonical FAQ entry"""
+        return [(passage.title, passage.text) for passage in self._passages.values() if passage.question is not None]
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self._files),
+            "passages": len(self._passages),
+            "terms": len(self._postings),
+            **self.counters,
+        }
+
+    def _overlap(self, terms: FrozenSet[str], heading: FrozenSet[str]) -> float:
+        """Geometric mean of the shares of the question's and the heading's IDF weight they have in common.
+
+        Unlike Jaccard, one extra heading word ("a *new* wallet") costs little
+        when the question is otherwise covered in full.
+        """
+        count = len(self._passages)
+
+        def weight(term: str) -> float:
+            return math.log(1 + (count + 0.5) / (len(self._postings.get(term, ())) + 0.5))
+
+        common = sum(weight(term) for term in terms & heading)
+        if not common:
+            return 0.0
+        return math.sqrt(common / sum(weight(term) for term in terms) * common / sum(weight(term) for term in heading))
+
+    def _scan(self):
+        """Parse files that changed since they were indexed (runs in a worker thread)"""
+        changed: Dict[str, Tuple[float, int, list]] = {}
+        seen = set()
+        if os.path.isdir(self.directory):
+            for root, _, names in os.walk(self.directory):
+                for name in sorted(names):
+                    if not name.endswith(_EXTENSIONS):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                        seen.add(path)
+                        indexed = self._files.get(path)
+                        if indexed is not None and indexed[:2] == (stat.st_mtime, stat.st_size):
+                            continue
+                        with open(path, encoding="utf-8") as f:
+                            changed[path] = (stat.st_mtime, stat.st_size, parse_document(path, f.read()))
+                    except (OSError, UnicodeDecodeError) as e:
+                        logger.warning("could not index %s: %s", path, e)
+        removed = [path for path in self._files if path not in seen]
+        return changed, removed
+
+    def _apply(self, changed: Dict[str, Tuple[float, int, list]], removed: List[str]):
+        for path in [*removed, *changed]:
+            for passage_id in self._files.pop(path, (0, 0, []))[2]:
+                self._remove(passage_id)
+        for path, (mtime, size, passages) in changed.items():
+            self._files[path] = (mtime, size, [self._add(passage, counts) for passage, counts in passages])
+
+    def _add(self, passage: Passage, counts: Counter) -> int:
+        passage_id = self._next_id
+        self._next_id += 1
+        self._passages[passage_id] = passage
+        self._terms[passage_id] = tuple(counts)
+        self._total_length += passage.length
+        for term, frequency in counts.items():
+            self._postings.setdefault(term, {})[passage_id] = frequency
+        return passage_id
+
+    def _remove(self, passage_id: int):
+        passage = self._passages.pop(passage_id)
+        self._total_length -= passage.length
+        for term in self._terms.pop(passage_id):
+            postings = self._postings[term]
+            del postings[passage_id]
+            if not postings:
+                del self._postings[term]
+
+    async def _reload_loop(self):
+        while True:
+            await asyncio.sleep(FAQ_RELOAD_INTERVAL)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning("faq reload failed: %s", e)
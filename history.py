@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from admission import BACKGROUND, priority_var
+from upstream import run_agent, extract_response_text
+
+logger = logging.getLogger(__name__)
+
+# Per-session prompt budget for the recent turns, in estimated tokens
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+# Most recent messages kept verbatim
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "12"))
+# Older messages are folded into the summary in batches of this size
+SUMMARY_BATCH_MESSAGES = int(os.getenv("SUMMARY_BATCH_MESSAGES", "4"))
+SUMMARY_MAX_CHARS = 1200
+
+# (role, content, estimated tokens)
+Turn = Tuple[str, str, int]
+Summarizer = Callable[[str, List[Turn]], Awaitable[str]]
+
+_ROLES = {role: role for role in ("system", "user", "assistant")}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate, roughly four characters per token for English"""
+    return len(text) // 4 + 1
+
+
+class ConversationHistory:
+    """Bounded history for one chat session.
+
+    The prompt is the system prompt, a rolling summary of older turns and a
+    window of recent turns that fits HISTORY_TOKEN_BUDGET, so prompt size and
+    per-turn cost stay flat however long the conversation runs. Turns that
+    fall out of the window wait in `pending` until a background task folds
+    them into the summary; the prompt carries the newest of them that still
+    fit the budget, and at most 2 * SUMMARY_BATCH_MESSAGES are kept.
+    """
+
+    __slots__ = ("system_prompt", "summary", "recent", "pending", "user_turns", "version",
+                 "token_budget", "max_messages", "_recent_tokens", "_summary_task")
+
+    def __init__(self, system_prompt: Optional[str] = None, token_budget: int = HISTORY_TOKEN_BUDGET,
+                 max_messages: int = HISTORY_MAX_MESSAGES):
+        self.system_prompt = system_prompt
+        self.summary = ""
+        self.recent: List[Turn] = []
+        self.pending: List[Turn] = []
+        self.user_turns = 0
+        # Bumped on every change so a session store can tell what needs saving
+        self.version = 0
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+        self._recent_tokens = 0
+        self._summary_task: Optional[asyncio.Task] = None
+
+    def append(self, role: str, content: str):
+        content = str(content)
+        tokens = estimate_tokens(content)
+        self.recent.append((_ROLES.get(role, role), content, tokens))
+        self._recent_tokens += tokens
+        self.version += 1
+        if role == "user":
+            self.user_turns += 1
+
+        # Always keep the newest message, even if it alone is over budget
+        while len(self.recent) > 1 and (
+            len(self.recent) > self.max_messages or self._recent_tokens > self.token_budget
+        ):
+            turn = self.recent.pop(0)
+            self._recent_tokens -= turn[2]
+            self.pending.append(turn)
+
+        # If summaries keep failing or lag behind, drop the oldest context rather than grow
+        overflow = len(self.pending) - 2 * SUMMARY_BATCH_MESSAGES
+        if overflow > 0:
+            del self.pending[:overflow]
+
+    @property
+    def summarizing(self) -> bool:
+        return self._summary_task is not None
+
+    def memory_bytes(self) -> int:
+        """Rough size of the stored text"""
+        turns = sum(len(content) for _, content, _ in self.recent) + sum(len(content) for _, content, _ in self.pending)
+        return turns + len(self.summary) + len(self.system_prompt or "")
+
+    def to_dict(self) -> dict:
+        return {
+            "system_prompt": self.system_prompt,
+            "summary": self.summary,
+            "recent": [[role, content] for role, content, _ in self.recent],
+            "pending": [[role, content] for role, content, _ in self.pending],
+            "user_turns": self.user_turns,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ConversationHistory":
+        history = cls(system_prompt=data.get("system_prompt"))
+        history.summary = data.get("summary", "")
+        history.pending = [(_ROLES.get(role, role), content, estimate_tokens(content))
+                           for role, content in data.get("pending", [])]
+        history.recent = [(_ROLES.get(role, role), content, estimate_tokens(content))
+                          for role, content in data.get("recent", [])]
+        history._recent_tokens = sum(tokens for _, _, tokens in history.recent)
+        history.user_turns = data.get("user_turns", 0)
+        return history
+
+    def prompt_messages(self, question: Optional[str] = None) -> List[dict]:
+        """System prompt, summary and the turns that fit the budget, then `question` if given.
+
+        The question is not added to the history: append it along with its
+        answer once it has been answered.
+        """
+        recent = self.recent
+        tokens = self._recent_tokens
+        if question is not None:
+            # The question counts against the budget and may push the oldest recent turns out
+            tokens += estimate_tokens(question)
+            start = 0
+            while start < len(recent) and (len(recent) - start >= self.max_messages or tokens > self.token_budget):
+                tokens -= recent[start][2]
+                start += 1
+            recent = recent[start:]
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        if len(recent) == len(self.recent):
+            extra = 0 if question is None else 1
+            pending = self._pending_in_budget(tokens, len(recent) + extra)
+            messages.extend({"role": role, "content": content} for role, content, _ in pending)
+        messages.extend({"role": role, "content": content} for role, content, _ in recent)
+        if question is not None:
+            messages.append({"role": "user", "content": question})
+        return messages
+
+    def _pending_in_budget(self, tokens: int, messages: int) -> List[Turn]:
+        """The newest pending turns that fit what the recent window leaves of the budget"""
+        start = len(self.pending)
+        while start > 0 and messages < self.max_messages and tokens + self.pending[start - 1][2] <= self.token_budget:
+            start -= 1
+            tokens += self.pending[start][2]
+            messages += 1
+        return self.pending[start:]
+
+    def schedule_summary(self, summarizer: Summarizer):
+        """Fold a full batch of pending turns into the summary in the background"""
+        if self._summary_task is None and len(self.pending) >= SUMMARY_BATCH_MESSAGES:
+            self._summary_task = asyncio.create_task(self._summarize(summarizer))
+
+    def cancel_summary(self):
+        if self._summary_task is not None:
+            self._summary_task.cancel()
+
+    async def _summarize(self, summarizer: Summarizer):
+        batch = self.pending[:SUMMARY_BATCH_MESSAGES]
+        try:
+            summary = await summarizer(self.summary, batch)
+        except Exception as e:
+            logger.warning("conversation summary failed: %s", e)
+        else:
+            self.summary = summary[:SUMMARY_MAX_CHARS]
+            # append() may have dropped some of the batch meanwhile
+            summarized = {id(turn) for turn in batch}
+            self.pending = [turn for turn in self.pending if id(turn) not in summarized]
+            self.version += 1
+        finally:
+            self._summary_task = None
+
+
+def agent_summarizer(agent) -> Summarizer:
+    """Summarizer that asks `agent` to extend the running summary with a batch of turns"""
+    async def summarize(summary: str, turns: List[Turn]) -> str:
+        transcript = "\n".join(f"{role}: {content}" for role, content, _ in turns)
+        prompt = (
+            f"Current summary:\n{summary or '(none)'}\n\n"
+            f"New messages:\n{transcript}\n\n"
+            "Rewrite the summary so it also covers the new messages. Keep facts the "
+            "support agent will need later (the user's problem, platform, amounts, steps "
+            "already tried) and stay under 150 words."
+        )
+        # Summaries run in their own task; they wait behind live questions and are shed first
+        priority_var.set(BACKGROUND)
+        response = await run_agent(agent, prompt)
+        return extract_response_text(response).strip()
+
+    return summarize
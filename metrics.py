@@ -0,0 +1,245 @@
+"""Prometheus metrics in the text exposition format, with no extra dependency.
+
+Metrics are updated from the event loop only, so children are plain
+counters without locks. Observing a histogram is a bisect and two adds,
+cheap enough to leave on in production. Components that already keep
+their own counters (cache, single-flight, sessions) are read
+at scrape time through register_stats().
+"""
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Seconds; covers cache hits through slow, long model answers
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_RATE_BUCKETS = (5, 10, 25, 50, 100, 200, 400, 800, 1600)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _label_text(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        _registry.append(self)
+
+    def labels(self, *values: str):
+        """The child for these label values, created on first use"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> Iterable[str]:
+        for values, child in self._children.items():
+            yield f"{self.name}{_label_text(self.labelnames, values)} {_format_value(child.value)}"
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _samples(self) -> Iterable[str]:
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), child.counts):
+                cumulative += count
+                labels = _label_text((*self.labelnames, "le"), (*values, _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _label_text(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class _StatsCollector:
+    """Exposes selected fields of a component's stats() dict at scrape time"""
+
+    def __init__(self, prefix: str, stats: Callable[[], dict], counters: Sequence[str], gauges: Sequence[str]):
+        self.prefix = prefix
+        self.stats = stats
+        self.counters = counters
+        self.gauges = gauges
+
+    def render(self) -> List[str]:
+        stats = self.stats()
+        lines = []
+        for kind, fields, suffix in (("counter", self.counters, "_total"), ("gauge", self.gauges, "")):
+            for field in fields:
+                if field not in stats:
+                    continue
+                name = f"{self.prefix}_{field}{suffix}"
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {_format_value(stats[field])}")
+        return lines
+
+
+_registry: List = []
+
+
+def register_stats(prefix: str, stats: Callable[[], dict], counters: Sequence[str] = (), gauges: Sequence[str] = ()):
+    _registry.append(_StatsCollector(prefix, stats, counters, gauges))
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Measurements shared by the app and upstream modules
+REQUEST_SECONDS = Histogram(
+    "support_request_seconds", "Time to answer an HTTP request or a WebSocket message", ("route", "status"))
+QUEUE_WAIT_SECONDS = Histogram(
+    "support_upstream_queue_wait_seconds", "Time spent waiting for a free upstream slot")
+UPSTREAM_SECONDS = Histogram(
+    "support_upstream_seconds", "Model call duration, from slot acquired to last token", ("model", "mode"))
+TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "support_time_to_first_token_seconds", "Time from slot acquired to the first streamed token", ("model",))
+TOKENS_PER_SECOND = Histogram(
+    "support_output_tokens_per_second", "Output tokens per second of upstream time", ("model",),
+    buckets=TOKEN_RATE_BUCKETS)
+TOKENS = Counter(
+    "support_tokens_total", "Model tokens as reported by Groq; streamed answers count estimated output only",
+    ("model", "direction"))
+MODEL_COST_USD = Counter(
+    "support_model_cost_usd_total", "Estimated model spend from token counts and MODEL_PRICES", ("model",))
+ROUTED = Counter("support_routed_total", "Model calls by route, tier and routing reason", ("route", "tier", "reason"))
+ROUTED_SECONDS = Histogram("support_routed_seconds", "Model answer time by route and tier", ("route", "tier"))
+ROUTER_FALLBACKS = Counter(
+    "support_router_fallbacks_total", "Small-model calls that failed and were retried on the large model", ("route",))
+MODEL_TIER = Gauge("support_model_tier_info", "Model serving each routing tier", ("tier", "model"))
+WEBSOCKET_CONNECTIONS = Gauge("support_websocket_connections", "Open WebSocket connections")
+WEBSOCKET_MESSAGES = Counter("support_websocket_messages_total", "WebSocket messages received")
+UPSTREAM_RETRIES = Counter("support_upstream_retries_total", "Model calls retried after a transient error", ("model",))
+UPSTREAM_DEADLINES = Counter(
+    "support_upstream_deadline_exceeded_total", "Model calls abandoned at the request deadline", ("model",))
+HEDGES = Counter("support_upstream_hedges_total", "Hedged second attempts fired, and how many answered first",
+                 ("model", "outcome"))
+CIRCUIT_STATE = Gauge("support_circuit_state", "Circuit breaker per model: 0 closed, 1 half-open, 2 open", ("model",))
+CIRCUIT_REJECTIONS = Counter("support_circuit_rejections_total", "Calls failed fast by an open circuit", ("model",))
+DEGRADED_ANSWERS = Counter(
+    "support_degraded_answers_total", "Answers served from cache or docs because the model was unavailable",
+    ("source",))
+TOOL_SECONDS = Histogram(
+    "support_tool_seconds", "Agent tool call time by tool and outcome (ok, cached, timeout, skipped, error)",
+    ("tool", "outcome"))
+ADMISSION_SHED = Counter("support_admission_shed_total", "Model calls refused by admission control", ("reason",))
+RATE_LIMIT_REJECTIONS = Counter("support_rate_limit_rejections_total", "Requests refused by a rate limit", ("limit",))
+ERRORS = Counter("support_errors_total", "Failed requests by where they failed and exception class", ("where", "type"))
+
+
+class MetricsMiddleware:
+    """ASGI middleware that records the latency of every HTTP request by route template.
+
+    Streaming responses are timed until their last body chunk is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.labels(route, str(status)).observe(time.perf_counter() - started)
@@ -0,0 +1,311 @@
+"""On-demand profiling of /ask and /ws requests.
+
+Off by default, and then each span() costs one context variable lookup.
+A request is profiled when:
+
+- it carries X-Profile (1, cprofile, stack or spans) along with a valid
+  X-Admin-Token (for /ws, on the handshake: every message of the connection
+  is profiled);
+- it is drawn at PROFILE_SAMPLE_RATE;
+- it falls in a window opened with POST /admin/profile?seconds=60&rate=0.2.
+
+A profiled request records stage spans (lookup, queue, agent_run, extract,
+history, send, ...; spans nest, so model includes queue and agent_run),
+returned in a Server-Timing header on HTTP and aggregated per route. In
+cprofile mode it is also run under cProfile; in stack mode a thread samples
+the event loop's stack every PROFILE_STACK_INTERVAL. Both see everything
+the worker's event loop runs meanwhile, not only that request: that is
+what shows a loop hog. One cProfile capture runs at a time; requests
+selected while it runs get spans only. GET /admin/profile/download
+returns the aggregate as pstats, text or collapsed stacks (flamegraph.pl).
+"""
+import contextlib
+import contextvars
+import io
+import logging
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from admin import is_admin
+from structured_log import request_id_var
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# cprofile, stack or spans (spans only)
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile")
+PROFILE_STACK_INTERVAL = float(os.getenv("PROFILE_STACK_INTERVAL", "0.005"))
+# Paths whose requests may be profiled
+PROFILE_PATHS = frozenset(os.getenv("PROFILE_PATHS", "/ask,/ask/stream,/ws").split(","))
+# Profiled requests kept with their spans for GET /admin/profile
+RECENT_PROFILES = 50
+# Frames kept per sampled stack, innermost last
+MAX_STACK_DEPTH = 64
+
+MODES = ("cprofile", "stack", "spans")
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+class RequestProfile:
+    __slots__ = ("route", "request_id", "mode", "started", "spans")
+
+    def __init__(self, route: str, request_id: Optional[str], mode: str):
+        self.route = route
+        self.request_id = request_id
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+
+    def server_timing(self) -> str:
+        """Spans so far as a Server-Timing header value, in milliseconds"""
+        total = (time.perf_counter() - self.started) * 1000
+        return ", ".join([f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.spans]
+                         + [f"total;dur={total:.1f}"])
+
+
+profile_var: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar("profile", default=None)
+
+
+class _Span:
+    __slots__ = ("profile", "stage", "started")
+
+    def __init__(self, profile: RequestProfile, stage: str):
+        self.profile = profile
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profile.spans.append((self.stage, time.perf_counter() - self.started))
+
+
+def span(stage: str):
+    """Time a stage of the current request, if it is being profiled"""
+    profile = profile_var.get()
+    return _NO_SPAN if profile is None else _Span(profile, stage)
+
+
+def record_span(stage: str, seconds: float):
+    """Add a stage timed by the caller, for stages that do not fit in a with block"""
+    profile = profile_var.get()
+    if profile is not None:
+        profile.spans.append((stage, seconds))
+
+
+class StackSampler:
+    """Samples one thread's Python stack from a background thread while someone needs it"""
+
+    def __init__(self, interval: float = PROFILE_STACK_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._users = 0
+        self._target: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def acquire(self, thread_id: int):
+        with self._lock:
+            self._users += 1
+            self._target = thread_id
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._users <= 0:
+                    self._thread = None
+                    return
+                target = self._target
+            frame = sys._current_frames().get(target)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+            time.sleep(self.interval)
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    def __init__(self, rate: float = PROFILE_SAMPLE_RATE, mode: str = PROFILE_MODE):
+        self.rate = rate
+        self.mode = mode
+        self.window_rate = 0.0
+        self.window_until = 0.0
+        self.sampler = StackSampler()
+        self.recent: Deque[dict] = deque(maxlen=RECENT_PROFILES)
+        self._stages: Dict[Tuple[str, str], List[float]] = {}  # (route, stage) -> [count, total, max]
+        self._pstats: Optional[pstats.Stats] = None
+        self._cprofile_running = False
+        self.counters = {"profiled": 0, "cprofiles": 0, "cprofile_busy": 0}
+
+    @property
+    def sampling(self) -> bool:
+        """Whether requests without X-Profile may be selected right now"""
+        return self.rate > 0 or self.window_until > time.monotonic()
+
+    def open_window(self, seconds: float, rate: float, mode: Optional[str] = None):
+        self.window_until = time.monotonic() + seconds
+        self.window_rate = rate
+        if mode is not None:
+            self.mode = mode
+        logger.info("profiling window opened", extra={"seconds": seconds, "rate": rate, "mode": self.mode})
+
+    def close_window(self):
+        self.window_until = 0.0
+
+    def reset(self):
+        self.recent.clear()
+        self._stages.clear()
+        self._pstats = None
+        self.sampler.stacks.clear()
+
+    def requested_mode(self, headers: Iterable[Tuple[bytes, bytes]]) -> Optional[str]:
+        """The mode asked for by X-Profile, if the request also has a valid admin token"""
+        wanted = token = None
+        for name, value in headers:
+            if name == b"x-profile":
+                wanted = value.decode("latin-1").strip().lower()
+            elif name == b"x-admin-token":
+                token = value.decode("latin-1")
+        if not wanted or wanted in ("0", "false") or not is_admin(token):
+            return None
+        return wanted if wanted in MODES else self.mode
+
+    def select(self, path: str, forced_mode: Optional[str] = None) -> Optional[str]:
+        """The mode to profile a request in, or None to leave it alone"""
+        if forced_mode is not None:
+            return forced_mode
+        if path not in PROFILE_PATHS:
+            return None
+        rate = self.window_rate if self.window_until > time.monotonic() else self.rate
+        if rate > 0 and random.random() < rate:
+            return self.mode
+        return None
+
+    @contextlib.contextmanager
+    def profile(self, route: str, mode: str, request_id: Optional[str] = None):
+        """Profile what runs inside the block as one request"""
+        profile = RequestProfile(route, request_id, mode)
+        token = profile_var.set(profile)
+        self.counters["profiled"] += 1
+        capture = None
+        if mode == "cprofile":
+            if self._cprofile_running:
+                self.counters["cprofile_busy"] += 1
+            else:
+                import cProfile
+
+                self._cprofile_running = True
+                capture = cProfile.Profile()
+                capture.enable()
+        elif mode == "stack":
+            self.sampler.acquire(threading.get_ident())
+        try:
+            yield profile
+        finally:
+            if capture is not None:
+                capture.disable()
+                self._cprofile_running = False
+                self.counters["cprofiles"] += 1
+                self._add_pstats(capture)
+            elif mode == "stack":
+                self.sampler.release()
+            profile_var.reset(token)
+            self._record(profile)
+
+    def stats(self) -> dict:
+        stages = {}
+        for (route, stage), (count, total, longest) in sorted(self._stages.items()):
+            stages.setdefault(route, {})[stage] = {
+                "count": int(count), "mean_ms": round(total / count * 1000, 2), "max_ms": round(longest * 1000, 2)}
+        window = max(0.0, self.window_until - time.monotonic())
+        return {
+            "mode": self.mode, "rate": self.rate, "window_seconds_left": round(window, 1),
+            "window_rate": self.window_rate if window else 0.0,
+            "stack_samples": sum(self.sampler.stacks.values()), **self.counters,
+            "stages": stages, "recent": list(self.recent),
+        }
+
+    def download(self, fmt: str) -> Tuple[bytes, str]:
+        """(body, media type) of the aggregated profile in pstats, text or collapsed format"""
+        if fmt == "collapsed":
+            lines = (f"{stack} {count}" for stack, count in self.sampler.stacks.most_common())
+            return "\n".join(lines).encode(), "text/plain"
+        if self._pstats is None:
+            return b"", "text/plain" if fmt == "text" else "application/octet-stream"
+        if fmt == "text":
+            out = io.StringIO()
+            self._pstats.stream = out
+            self._pstats.sort_stats("cumulative").print_stats(60)
+            return out.getvalue().encode(), "text/plain"
+        # What pstats.Stats.dump_stats writes, for snakeviz, pstats or gprof2dot
+        return marshal.dumps(self._pstats.stats), "application/octet-stream"
+
+    def _add_pstats(self, capture):
+        if self._pstats is None:
+            self._pstats = pstats.Stats(capture)
+        else:
+            self._pstats.add(capture)
+
+    def _record(self, profile: RequestProfile):
+        total = time.perf_counter() - profile.started
+        for stage, seconds in [*profile.spans, ("total", total)]:
+            entry = self._stages.setdefault((profile.route, stage), [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+        self.recent.append({
+            "route": profile.route, "request_id": profile.request_id, "mode": profile.mode,
+            "total_ms": round(total * 1000, 2),
+            "spans": [[stage, round(seconds * 1000, 2)] for stage, seconds in profile.spans],
+        })
+
+
+profiler = Profiler()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles the HTTP requests the profiler selects and adds Server-Timing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        forced = profiler.requested_mode(scope["headers"])
+        mode = profiler.select(scope["path"], forced) if forced is not None or profiler.sampling else None
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        with profiler.profile(scope["path"], mode, request_id_var.get()) as profile:
+            async def send_with_timing(message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = [*message.get("headers", []),
+                                          (b"server-timing", profile.server_timing().encode("latin-1"))]
+                await send(message)
+
+            await self.app(scope, receive, send_with_timing)
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+from fastapi import HTTPException, Request
+
+from metrics import RATE_LIMIT_REJECTIONS
+from shared_state import SharedStore, gcra, get_shared_store
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory | sqlite
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", "ratelimits.db")
+MESSAGE_RATE_LIMIT = os.getenv("MESSAGE_RATE_LIMIT", "10/minute")
+CONNECTION_RATE_LIMIT = os.getenv("CONNECTION_RATE_LIMIT", "20/minute")
+# /suggest is called on every keystroke
+SUGGEST_RATE_LIMIT = os.getenv("SUGGEST_RATE_LIMIT", "600/minute")
+RATE_LIMIT_SWEEP_INTERVAL = float(os.getenv("RATE_LIMIT_SWEEP_INTERVAL", "60"))
+
+_PERIODS = {"second": 1.0, "minute": 60.0, "hour": 3600.0, "day": 86400.0}
+
+
+class RateLimit(NamedTuple):
+    interval: float  # seconds between requests at the sustained rate
+    burst: int       # requests allowed back to back
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    retry_after: float
+
+
+def parse_rate(spec: str) -> RateLimit:
+    """Parse "10/minute" into a limit that sustains 10 per minute with a burst of 10"""
+    count, _, period = spec.partition("/")
+    count = int(count)
+    return RateLimit(interval=_PERIODS[period.strip().rstrip("s")] / count, burst=count)
+
+
+class RateLimitBackend:
+    """Holds one timestamp per active key. `blocking` backends are called off the event loop."""
+
+    blocking = False
+
+    def hit(self, key: str, limit: RateLimit, now: float) -> Decision:
+        raise NotImplementedError
+
+    def sweep(self, now: float) -> int:
+        """Forget keys whose bucket has refilled; returns how many were removed"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """Per-process state; limits are per worker"""
+
+    def __init__(self):
+        self._tats: Dict[str, float] = {}
+
+    def hit(self, key: str, limit: RateLimit, now: float) -> Decision:
+        allowed, tat, retry_after = gcra(self._tats.get(key), now, limit.interval, limit.burst)
+        self._tats[key] = tat
+        return Decision(allowed, retry_after)
+
+    def sweep(self, now: float) -> int:
+        expired = [key for key, tat in self._tats.items() if tat <= now]
+        for key in expired:
+            del self._tats[key]
+        return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._tats)
+
+
+class SQLiteRateLimitBackend(RateLimitBackend):
+    """State in a SQLite file, shared by every worker process on the host"""
+
+    blocking = True
+
+    def __init__(self, path: str = RATE_LIMIT_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=1.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+
+    def hit(self, key: str, limit: RateLimit, now: float) -> Decision:
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so workers can't interleave read and write
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+                allowed, tat, retry_after = gcra(row[0] if row else None, now, limit.interval, limit.burst)
+                if allowed:
+                    self._conn.execute("INSERT OR REPLACE INTO rate_limits (key, tat) VALUES (?, ?)", (key, tat))
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return Decision(allowed, retry_after)
+
+    def sweep(self, now: float) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM rate_limits WHERE tat <= ?", (now,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SharedRateLimitBackend(RateLimitBackend):
+    """State in the shared store (see shared_state.py), correct across workers and machines"""
+
+    def __init__(self, store: SharedStore):
+        self.store = store
+        self.blocking = store.blocking
+
+    def hit(self, key: str, limit: RateLimit, now: float) -> Decision:
+        allowed, retry_after = self.store.gcra(f"ratelimit:{key}", limit.interval, limit.burst)
+        return Decision(allowed, retry_after)
+
+    def sweep(self, now: float) -> int:
+        # Keys carry a TTL in the shared store and expire on their own
+        return 0
+
+
+class RateLimiter:
+    """Named GCRA limits (e.g. "messages", "connections") applied per client key"""
+
+    def __init__(self, backend: RateLimitBackend, limits: Dict[str, RateLimit],
+                 sweep_interval: float = RATE_LIMIT_SWEEP_INTERVAL):
+        self.backend = backend
+        self.limits = limits
+        self.sweep_interval = sweep_interval
+        self.rejections: Dict[str, int] = {name: 0 for name in limits}
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    async def hit(self, name: str, key: str) -> Decision:
+        limit = self.limits[name]
+        bucket = f"{name}:{key}"
+        # Wall-clock time so every process sharing a backend agrees
+        now = time.time()
+        if self.backend.blocking:
+            decision = await asyncio.to_thread(self.backend.hit, bucket, limit, now)
+        else:
+            decision = self.backend.hit(bucket, limit, now)
+        if not decision.allowed:
+            self.rejections[name] += 1
+            RATE_LIMIT_REJECTIONS.labels(name).inc()
+        return decision
+
+    def start(self):
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def close(self):
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            self._sweep_task = None
+        self.backend.close()
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                if self.backend.blocking:
+                    await asyncio.to_thread(self.backend.sweep, time.time())
+                else:
+                    self.backend.sweep(time.time())
+            except Exception as e:
+                logger.warning("rate limit sweep failed: %s", e)
+
+
+def create_rate_limiter() -> RateLimiter:
+    limits = {
+        "messages": parse_rate(MESSAGE_RATE_LIMIT),
+        "connections": parse_rate(CONNECTION_RATE_LIMIT),
+        "suggest": parse_rate(SUGGEST_RATE_LIMIT),
+    }
+    store = get_shared_store()
+    if store is not None:
+        return RateLimiter(SharedRateLimitBackend(store), limits)
+    if RATE_LIMIT_BACKEND == "sqlite":
+        return RateLimiter(SQLiteRateLimitBackend(RATE_LIMIT_DB_PATH), limits)
+    return RateLimiter(MemoryRateLimitBackend(), limits)
+
+
+def rate_limit_dependency(limiter: RateLimiter, name: str):
+    """FastAPI dependency that answers 429 with Retry-After once the client's limit is used up"""
+    async def check(request: Request):
+        decision = await limiter.hit(name, request.client.host)
+        if not decision.allowed:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests. Please try again later.",
+                headers={"Retry-After": str(math.ceil(decision.retry_after))},
+            )
+    return check
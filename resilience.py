@@ -0,0 +1,303 @@
+"""Resilience around model calls: deadlines, retries, circuit breaking and hedging.
+
+run() wraps upstream.run_agent:
+- the call must finish by the request's deadline (deadline_var, set per
+  request by the app; REQUEST_DEADLINE from the first call otherwise),
+  queue wait included;
+- transient failures (timeouts, connection errors, 429 and 5xx) are retried
+  with full-jitter exponential backoff while the deadline allows;
+- with HEDGE=1, a second attempt is started once the first has run longer
+  than the model's recent p95 latency, and the first answer wins.
+
+stream() wraps upstream.stream_agent: the first delta must arrive by the
+deadline and no later delta may take longer than STREAM_IDLE_TIMEOUT.
+Streams are not retried or hedged, since the client may already have part
+of the answer.
+
+Both go through a circuit breaker per model. Once BREAKER_FAILURE_RATIO of
+the last BREAKER_WINDOW calls failed, calls fail fast with CircuitOpen for
+BREAKER_COOLDOWN seconds; then a single probe call decides whether the
+circuit closes again.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Optional
+
+import httpx
+
+from admission import Overloaded
+from metrics import (
+    CIRCUIT_REJECTIONS, CIRCUIT_STATE, HEDGES, UPSTREAM_DEADLINES, UPSTREAM_RETRIES,
+)
+from upstream import admission, run_agent, stream_agent
+
+logger = logging.getLogger(__name__)
+
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "30"))
+STREAM_IDLE_TIMEOUT = float(os.getenv("STREAM_IDLE_TIMEOUT", "15"))
+# Attempts per non-streamed call, the first one included
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "2"))
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_FAILURE_RATIO = float(os.getenv("BREAKER_FAILURE_RATIO", "0.5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "15"))
+HEDGE = os.getenv("HEDGE", "0").lower() in ("1", "true", "yes")
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+# Latencies kept per model for the hedging threshold, and how many are needed first
+HEDGE_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+_RETRYABLE_STATUS = frozenset({408, 409, 425, 429})
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Absolute time.monotonic() by which the current request must be answered
+deadline_var: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+def start_deadline(seconds: float = REQUEST_DEADLINE):
+    deadline_var.set(time.monotonic() + seconds)
+
+
+class DeadlineExceeded(Exception):
+    """The model did not answer before the request's deadline"""
+
+
+class CircuitOpen(Exception):
+    """Calls to a model are failing fast because it has been failing"""
+
+    def __init__(self, model: str, retry_after: float):
+        super().__init__(f"Circuit open for {model}, retry after {retry_after:.0f}s")
+        self.model = model
+        self.retry_after = max(1, round(retry_after))
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether an upstream error is transient: timeouts, connection errors, 429 and 5xx"""
+    while error is not None:
+        if isinstance(error, (asyncio.TimeoutError, httpx.TransportError)):
+            return True
+        # agno's ModelProviderError and groq's APIStatusError both carry the HTTP status
+        status = getattr(error, "status_code", None)
+        if isinstance(status, int):
+            return status in _RETRYABLE_STATUS or status >= 500
+        error = error.__cause__
+    return False
+
+
+class CircuitBreaker:
+    """Failure-ratio circuit breaker over the last `window` calls"""
+
+    def __init__(self, name: str, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_ratio: float = BREAKER_FAILURE_RATIO, cooldown: float = BREAKER_COOLDOWN):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self._results: Deque[bool] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        CIRCUIT_STATE.labels(name).set(_STATE_VALUES[CLOSED])
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may go ahead"""
+        if self.state == OPEN:
+            waited = time.monotonic() - self._opened_at
+            if waited < self.cooldown:
+                CIRCUIT_REJECTIONS.labels(self.name).inc()
+                raise CircuitOpen(self.name, self.cooldown - waited)
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probing:
+                CIRCUIT_REJECTIONS.labels(self.name).inc()
+                raise CircuitOpen(self.name, 1)
+            self._probing = True
+
+    def record(self, ok: Optional[bool]):
+        """Outcome of a call; None when it ended without saying anything about upstream health"""
+        if self.state == HALF_OPEN:
+            self._probing = False
+            if ok is None:
+                return
+            if ok:
+                self._results.clear()
+                self._set_state(CLOSED)
+            else:
+                self._open()
+            return
+        if ok is None:
+            return
+        self._results.append(ok)
+        failures = self._results.count(False)
+        if (self.state == CLOSED and len(self._results) >= self.min_calls
+                and failures >= self.failure_ratio * len(self._results)):
+            self._open()
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._set_state(OPEN)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning("circuit %s for %s", state, self.name)
+        self.state = state
+        CIRCUIT_STATE.labels(self.name).set(_STATE_VALUES[state])
+
+
+class LatencyWindow:
+    """Recent successful call latencies, for the hedging threshold"""
+
+    def __init__(self, size: int = HEDGE_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self._samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_latencies: Dict[str, LatencyWindow] = {}
+
+
+def breaker(model: str) -> CircuitBreaker:
+    if model not in _breakers:
+        _breakers[model] = CircuitBreaker(model)
+    return _breakers[model]
+
+
+def _model_id(agent) -> str:
+    return getattr(agent.model, "id", None) or "unknown"
+
+
+def _deadline() -> float:
+    deadline = deadline_var.get()
+    return deadline if deadline is not None else time.monotonic() + REQUEST_DEADLINE
+
+
+async def _hedged(agent, model: str, timeout: float, message, kwargs):
+    """run_agent, plus a second attempt if the first outlives the model's p95"""
+    delay = _latencies[model].quantile(HEDGE_QUANTILE) if HEDGE and model in _latencies else None
+    # Hedging doubles load, so only while there are idle upstream slots
+    if delay is None or delay >= timeout or admission.running >= admission.concurrency:
+        return await asyncio.wait_for(run_agent(agent, message, **kwargs), timeout)
+
+    first = asyncio.ensure_future(run_agent(agent, message, **kwargs))
+    attempts = {first}
+    try:
+        done, _ = await asyncio.wait(attempts, timeout=delay)
+        if not done:
+            HEDGES.labels(model, "fired").inc()
+            attempts.add(asyncio.ensure_future(run_agent(agent, message, **kwargs)))
+        deadline = time.monotonic() + timeout - delay
+        error = None
+        while attempts:
+            done, _ = await asyncio.wait(attempts, timeout=deadline - time.monotonic(),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise asyncio.TimeoutError()
+            for task in done:
+                attempts.discard(task)
+                if task.exception() is None:
+                    if task is not first:
+                        HEDGES.labels(model, "won").inc()
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in attempts:
+            task.cancel()
+
+
+async def run(agent, message=None, **kwargs):
+    """run_agent with the deadline, retries, circuit breaker and hedging described above"""
+    model = _model_id(agent)
+    circuit = breaker(model)
+    deadline = _deadline()
+    attempt = 0
+    while True:
+        attempt += 1
+        started = time.monotonic()
+        if deadline - started <= 0:
+            raise DeadlineExceeded(f"No time left to call {model}")
+        circuit.before_call()
+        try:
+            response = await _hedged(agent, model, deadline - started, message, kwargs)
+        except Overloaded:
+            circuit.record(None)
+            raise
+        except asyncio.TimeoutError:
+            circuit.record(False)
+            UPSTREAM_DEADLINES.labels(model).inc()
+            raise DeadlineExceeded(f"{model} did not answer within the request deadline") from None
+        except Exception as e:
+            retryable = is_retryable(e)
+            # Client errors (bad request, auth) say nothing against upstream health
+            circuit.record(False if retryable else True)
+            if not retryable or attempt >= RETRY_ATTEMPTS:
+                raise
+            backoff = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+            if time.monotonic() + backoff >= deadline:
+                raise
+            logger.warning("upstream call failed (attempt %d of %d), retrying in %.2fs: %s",
+                           attempt, RETRY_ATTEMPTS, backoff, e)
+            UPSTREAM_RETRIES.labels(model).inc()
+            await asyncio.sleep(backoff)
+            continue
+        except BaseException:
+            circuit.record(None)
+            raise
+        circuit.record(True)
+        _latencies.setdefault(model, LatencyWindow()).observe(time.monotonic() - started)
+        return response
+
+
+async def stream(agent, message=None, **kwargs) -> AsyncIterator[str]:
+    """stream_agent with the deadline on the first delta, an idle timeout after it and the circuit breaker"""
+    model = _model_id(agent)
+    circuit = breaker(model)
+    deadline = _deadline()
+    if deadline <= time.monotonic():
+        raise DeadlineExceeded(f"No time left to call {model}")
+    circuit.before_call()
+    deltas = stream_agent(agent, message, **kwargs)
+    ok: Optional[bool] = None
+    first = True
+    try:
+        while True:
+            timeout = deadline - time.monotonic() if first else STREAM_IDLE_TIMEOUT
+            try:
+                async with asyncio.timeout(max(timeout, 0)):
+                    delta = await anext(deltas)
+            except StopAsyncIteration:
+                break
+            except TimeoutError:
+                ok = False
+                UPSTREAM_DEADLINES.labels(model).inc()
+                raise DeadlineExceeded(f"{model} stopped streaming before the deadline") from None
+            first = False
+            yield delta
+        ok = True
+    except (Overloaded, DeadlineExceeded):
+        raise
+    except Exception as e:
+        ok = not is_retryable(e)
+        raise
+    finally:
+        circuit.record(ok)
+        await deltas.aclose()
@@ -0,0 +1,153 @@
+"""Tiered model routing: short, simple questions go to a small fast model,
+troubleshooting goes to the large one.
+
+Classification is a local heuristic and costs microseconds. Questions it
+is not confident about go to the large model, and so does any question
+whose small-model call fails. Each route can be pinned to a tier:
+
+    MODEL_ROUTES="/ask=auto,/ask/stream=auto,/ws=large"
+"""
+import logging
+import os
+import re
+import time
+from typing import AsyncIterator, Dict, NamedTuple
+
+import resilience
+from admission import Overloaded
+from answer_cache import normalize_question
+from metrics import MODEL_TIER, ROUTED, ROUTED_SECONDS, ROUTER_FALLBACKS
+from resilience import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+ROUTER_SMALL_MODEL = os.getenv("ROUTER_SMALL_MODEL", "llama-3.1-8b-instant")
+ROUTER_LARGE_MODEL = os.getenv("ROUTER_LARGE_MODEL", "llama-3.3-70b-versatile")
+# route=mode pairs; mode is auto (classify), small or large. Unlisted routes use auto.
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "/ask=auto,/ask/stream=auto,/ws=auto")
+# Below this confidence a question goes to the large model
+ROUTER_MIN_CONFIDENCE = float(os.getenv("ROUTER_MIN_CONFIDENCE", "0.6"))
+# Longer questions are never considered simple
+ROUTER_SMALL_MAX_WORDS = int(os.getenv("ROUTER_SMALL_MAX_WORDS", "25"))
+
+SMALL = "small"
+LARGE = "large"
+
+_SMALL_TALK = frozenset({
+    "hi", "hello", "hey", "thanks", "thank", "you", "ok", "okay", "great", "cool", "bye",
+    "goodbye", "good", "morning", "afternoon", "evening", "yes", "no", "sure", "please", "help",
+})
+# Word stems that mean something is going wrong and needs careful troubleshooting
+_TROUBLE = (
+    "fail", "error", "stuck", "pending", "missing", "lost", "wrong", "refund", "declin", "reject",
+    "hack", "stole", "scam", "compromis", "locked", "frozen", "chargeback", "dispute",
+    "not received", "never arrived", "didn't arrive", "did not arrive", "doesn't work", "not working",
+)
+_IDENTIFIER = re.compile(r"\b(?:0x[0-9a-fA-F]{8,}|[0-9a-fA-F]{32,}|[13][1-9A-HJ-NP-Za-km-z]{25,34}|bc1\w{11,})\b")
+
+
+class Decision(NamedTuple):
+    route: str
+    tier: str
+    reason: str
+
+
+def parse_routes(spec: str) -> Dict[str, str]:
+    routes = {}
+    for item in spec.split(","):
+        route, _, mode = item.strip().partition("=")
+        if route:
+            mode = mode.strip() or "auto"
+            if mode not in ("auto", SMALL, LARGE):
+                raise ValueError(f"Unknown routing mode {mode!r} for {route}")
+            routes[route.strip()] = mode
+    return routes
+
+
+def classify(question: str):
+    """(tier, confidence, reason) for a question, from cheap local signals"""
+    lowered = question.lower()
+    words = normalize_question(question).split()
+    if not words or all(word in _SMALL_TALK for word in words):
+        return SMALL, 0.95, "small_talk"
+    if _IDENTIFIER.search(question):
+        return LARGE, 0.9, "identifier"
+    trouble = sum(1 for stem in _TROUBLE if stem in lowered)
+    if trouble:
+        return LARGE, min(0.6 + 0.15 * trouble, 0.95), "troubleshooting"
+    if question.count("?") > 1:
+        return LARGE, 0.7, "several_questions"
+    if len(words) > ROUTER_SMALL_MAX_WORDS:
+        return LARGE, 0.7, "long"
+    # Short, plain questions; the longer they get, the less sure we are
+    return SMALL, 0.95 - 0.4 * len(words) / ROUTER_SMALL_MAX_WORDS, "simple"
+
+
+class ModelRouter:
+    """Picks the small or large support agent for each call and falls back to the large one"""
+
+    def __init__(self, agents: Dict[str, object], routes: Dict[str, str] = None,
+                 min_confidence: float = ROUTER_MIN_CONFIDENCE):
+        self.agents = agents
+        self.routes = parse_routes(MODEL_ROUTES) if routes is None else routes
+        self.min_confidence = min_confidence
+        for tier, agent in agents.items():
+            MODEL_TIER.labels(tier, getattr(agent.model, "id", "unknown")).set(1)
+
+    def choose(self, route: str, question: str) -> Decision:
+        mode = self.routes.get(route, "auto")
+        if mode != "auto":
+            decision = Decision(route, mode, "pinned")
+        else:
+            tier, confidence, reason = classify(question)
+            if tier == SMALL and confidence < self.min_confidence:
+                tier, reason = LARGE, "low_confidence"
+            decision = Decision(route, tier, reason)
+        ROUTED.labels(route, decision.tier, decision.reason).inc()
+        return decision
+
+    def agent(self, decision: Decision):
+        return self.agents[decision.tier]
+
+    async def run(self, decision: Decision, message=None, **kwargs):
+        """resilience.run on the chosen tier, retrying on the large model if the small one fails"""
+        started = time.perf_counter()
+        tier = decision.tier
+        try:
+            return await resilience.run(self.agents[tier], message, **kwargs)
+        except (Overloaded, DeadlineExceeded):
+            # Shed, or out of time; the large model would fare no better
+            raise
+        except Exception as e:
+            if tier == LARGE:
+                raise
+            logger.warning("small model failed, falling back to the large model: %s", e)
+            ROUTER_FALLBACKS.labels(decision.route).inc()
+            tier = LARGE
+            return await resilience.run(self.agents[LARGE], message, **kwargs)
+        finally:
+            ROUTED_SECONDS.labels(decision.route, tier).observe(time.perf_counter() - started)
+
+    async def stream(self, decision: Decision, message=None, **kwargs) -> AsyncIterator[str]:
+        """resilience.stream on the chosen tier; falls back to the large model if the small one
+        fails before its first delta (after that the client has a partial answer)"""
+        started = time.perf_counter()
+        tier = decision.tier
+        sent = False
+        try:
+            try:
+                async for delta in resilience.stream(self.agents[tier], message, **kwargs):
+                    sent = True
+                    yield delta
+            except (Overloaded, DeadlineExceeded):
+                raise
+            except Exception as e:
+                if tier == LARGE or sent:
+                    raise
+                logger.warning("small model failed, falling back to the large model: %s", e)
+                ROUTER_FALLBACKS.labels(decision.route).inc()
+                tier = LARGE
+                async for delta in resilience.stream(self.agents[LARGE], message, **kwargs):
+                    yield delta
+        finally:
+            ROUTED_SECONDS.labels(decision.route, tier).observe(time.perf_counter() - started)
@@ -0,0 +1,331 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from history import ConversationHistory
+from shared_state import SharedStore, get_shared_store
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")  # memory | sqlite
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+# Resident history above this size gets idle sessions written out and dropped from RAM
+SESSION_MEMORY_MB = float(os.getenv("SESSION_MEMORY_MB", "256"))
+# Sessions without a live connection for this long are moved out of RAM
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "600"))
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "1.0"))
+# Stored sessions untouched for this long are deleted
+SESSION_RETENTION_SECONDS = float(os.getenv("SESSION_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+_TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+
+def new_session_token() -> str:
+    return secrets.token_urlsafe(18)
+
+
+def resolve_session_token(requested: Optional[str]) -> str:
+    """Use the client's resumable token if it is well formed, otherwise issue a new one"""
+    if requested and _TOKEN_PATTERN.match(requested):
+        return requested
+    return new_session_token()
+
+
+class SessionBackend:
+    """Where serialized sessions live when they are not in RAM.
+
+    Methods are blocking; SessionStore calls them from a worker thread.
+    `shared` backends can be written by other processes too.
+    """
+
+    shared = False
+
+    def read(self, token: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def write_many(self, items: Iterable[Tuple[str, str]]):
+        raise NotImplementedError
+
+    def delete(self, token: str):
+        raise NotImplementedError
+
+    def purge_older_than(self, cutoff: float) -> int:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class InMemoryBackend(SessionBackend):
+    """Keeps serialized sessions in a dict; they do not survive a restart"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def read(self, token: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(token)
+        return item[0] if item else None
+
+    def write_many(self, items: Iterable[Tuple[str, str]]):
+        now = time.time()
+        with self._lock:
+            for token, data in items:
+                self._data[token] = (data, now)
+
+    def delete(self, token: str):
+        with self._lock:
+            self._data.pop(token, None)
+
+    def purge_older_than(self, cutoff: float) -> int:
+        with self._lock:
+            stale = [token for token, (_, updated) in self._data.items() if updated < cutoff]
+            for token in stale:
+                del self._data[token]
+        return len(stale)
+
+
+class SQLiteBackend(SessionBackend):
+    """Stores sessions in a SQLite file so they survive restarts; processes on one host can share it"""
+
+    shared = True
+
+    def __init__(self, path: str = SESSION_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "token TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def read(self, token: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM sessions WHERE token = ?", (token,)).fetchone()
+        return row[0] if row else None
+
+    def write_many(self, items: Iterable[Tuple[str, str]]):
+        now = time.time()
+        rows = [(token, data, now) for token, data in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO sessions (token, data, updated_at) VALUES (?, ?, ?)", rows
+                )
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def delete(self, token: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+    def purge_older_than(self, cutoff: float) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SharedSessionBackend(SessionBackend):
+    """Sessions in the shared store (see shared_state.py), visible to every worker and machine"""
+
+    shared = True
+
+    def __init__(self, store: SharedStore, retention_seconds: float = SESSION_RETENTION_SECONDS):
+        self.store = store
+        self.retention_seconds = retention_seconds
+
+    def read(self, token: str) -> Optional[str]:
+        return self.store.get(f"session:{token}")
+
+    def write_many(self, items: Iterable[Tuple[str, str]]):
+        self.store.set_many([(f"session:{token}", data) for token, data in items], ttl=self.retention_seconds)
+
+    def delete(self, token: str):
+        self.store.delete(f"session:{token}")
+
+    def purge_older_than(self, cutoff: float) -> int:
+        # Entries expire through their TTL
+        return 0
+
+
+class SessionStore:
+    """Conversation histories keyed by resumable session token.
+
+    Histories live in RAM while in use. Changes are picked up by a background
+    flusher and written to the backend in batches, so the request path never
+    waits on disk. Sessions without a live connection are dropped from RAM
+    once they have been idle for SESSION_IDLE_SECONDS, or earlier when
+    resident history goes over SESSION_MEMORY_MB, and are loaded again
+    lazily when their token reconnects.
+    """
+
+    def __init__(self, backend: SessionBackend, memory_limit_mb: float = SESSION_MEMORY_MB,
+                 idle_seconds: float = SESSION_IDLE_SECONDS, flush_interval: float = SESSION_FLUSH_INTERVAL):
+        self.backend = backend
+        self.memory_limit = int(memory_limit_mb * 1024 * 1024)
+        self.idle_seconds = idle_seconds
+        self.flush_interval = flush_interval
+        self.resident: Dict[str, ConversationHistory] = {}
+        self._saved_versions: Dict[str, int] = {}
+        self._attached: Dict[str, int] = {}  # token -> live connections
+        self._last_used: Dict[str, float] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.counters = {"loads": 0, "creates": 0, "writes": 0, "evictions": 0, "flush_errors": 0}
+
+    async def attach(self, token: str, system_prompt: Optional[str] = None) -> ConversationHistory:
+        """Get a session for a new connection, loading it from the backend if needed"""
+        history = self.resident.get(token)
+        if (
+            history is not None
+            and self.backend.shared
+            and token not in self._attached
+            and not history.summarizing
+            and history.version == self._saved_versions.get(token)
+        ):
+            # Another instance may have served this session since; reload it
+            self.resident.pop(token)
+            history = None
+        if history is None:
+            data = await asyncio.to_thread(self.backend.read, token)
+            # Another connection may have loaded it while we were reading
+            history = self.resident.get(token)
+            if history is None:
+                if data is not None:
+                    history = ConversationHistory.from_dict(json.loads(data))
+                    self.counters["loads"] += 1
+                else:
+                    history = ConversationHistory(system_prompt=system_prompt)
+                    self.counters["creates"] += 1
+                self.resident[token] = history
+                self._saved_versions[token] = history.version if data is not None else -1
+        self._attached[token] = self._attached.get(token, 0) + 1
+        self._last_used[token] = time.monotonic()
+        return history
+
+    def release(self, token: str):
+        """The connection using this session went away; it stays resident until evicted"""
+        count = self._attached.get(token, 0) - 1
+        if count > 0:
+            self._attached[token] = count
+        else:
+            self._attached.pop(token, None)
+        self._last_used[token] = time.monotonic()
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+        await asyncio.to_thread(self.backend.close)
+
+    async def flush(self):
+        """Write every session that changed since it was last saved"""
+        async with self._flush_lock:
+            dirty = [
+                (token, history.version, json.dumps(history.to_dict(), separators=(",", ":")))
+                for token, history in self.resident.items()
+                if history.version != self._saved_versions.get(token)
+            ]
+            if not dirty:
+                return
+            await asyncio.to_thread(self.backend.write_many, [(token, data) for token, _, data in dirty])
+            for token, version, _ in dirty:
+                self._saved_versions[token] = version
+            self.counters["writes"] += len(dirty)
+
+    async def save(self, token: str):
+        """Write one session now if it changed since it was last saved, e.g. before another instance takes it"""
+        async with self._flush_lock:
+            history = self.resident.get(token)
+            if history is None or history.version == self._saved_versions.get(token):
+                return
+            version = history.version
+            data = json.dumps(history.to_dict(), separators=(",", ":"))
+            await asyncio.to_thread(self.backend.write_many, [(token, data)])
+            self._saved_versions[token] = version
+            self.counters["writes"] += 1
+
+    def stats(self) -> dict:
+        return {
+            "resident": len(self.resident),
+            "attached": len(self._attached),
+            **self.counters,
+        }
+
+    async def _flush_loop(self):
+        last_purge = 0.0
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                self._evict_idle()
+                if time.monotonic() - last_purge > 3600:
+                    last_purge = time.monotonic()
+                    await asyncio.to_thread(self.backend.purge_older_than, time.time() - SESSION_RETENTION_SECONDS)
+            except Exception as e:
+                self.counters["flush_errors"] += 1
+                logger.warning("session flush failed: %s", e)
+
+    def _evict_idle(self):
+        """Drop saved, unattached sessions from RAM: idle ones first, then LRU while over the memory cap"""
+        now = time.monotonic()
+        candidates = sorted(
+            (self._last_used.get(token, 0.0), token)
+            for token, history in self.resident.items()
+            if token not in self._attached
+            and not history.summarizing
+            and history.version == self._saved_versions.get(token)
+        )
+        if not candidates:
+            return
+
+        resident_bytes = None
+        for last_used, token in candidates:
+            if now - last_used < self.idle_seconds:
+                if resident_bytes is None:
+                    resident_bytes = sum(h.memory_bytes() for h in self.resident.values())
+                if resident_bytes <= self.memory_limit:
+                    break
+                resident_bytes -= self.resident[token].memory_bytes()
+            self._drop(token)
+
+    def _drop(self, token: str):
+        self.resident.pop(token, None)
+        self._saved_versions.pop(token, None)
+        self._last_used.pop(token, None)
+        self.counters["evictions"] += 1
+
+
+def create_session_store() -> SessionStore:
+    store = get_shared_store()
+    if store is not None:
+        return SessionStore(SharedSessionBackend(store))
+    if SESSION_STORE == "sqlite":
+        return SessionStore(SQLiteBackend(SESSION_DB_PATH))
+    return SessionStore(InMemoryBackend())
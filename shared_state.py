@@ -0,0 +1,220 @@
+"""State shared between worker processes and machines.
+
+By default every uvicorn worker keeps its sessions, rate limits and answer
+cache to itself. STATE_BACKEND switches all three onto one store:
+
+    pip install redis   # optional, only for the redis backend
+    STATE_BACKEND=redis REDIS_URL=redis://cache:6379/0 uvicorn app:app --workers 4
+    STATE_BACKEND=local   # in-process stand-in with the same semantics, for tests
+
+With a shared store:
+- Rate limits hold across every worker and pod. Each check is one atomic
+  GCRA update.
+- Conversation history is written behind to the store. A reconnecting
+  client (/ws?session=<token>) can land on any instance and continue from
+  where it was, less at most SESSION_FLUSH_INTERVAL of writes.
+- Answers cached by one instance are served by all of them. The near-
+  duplicate matching stays local to each process.
+
+WebSocket routing: a socket stays on the process that accepted it. Only
+reconnects need routing. Correctness does not depend on stickiness.
+Routing by session token still helps, because the session is usually
+still resident on the instance that served it, for example with nginx:
+
+    upstream support { hash $arg_session consistent; server a:8000; server b:8000; }
+
+IP stickiness also works but spreads badly behind NATs. Without
+stickiness, a session that is open on two instances at once is
+last-writer-wins.
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "")  # "" (per process) | local | redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "support:")
+
+
+def gcra(tat: Optional[float], now: float, interval: float, burst: int) -> Tuple[bool, float, float]:
+    """Generic cell rate algorithm (a token bucket stored as one timestamp).
+
+    `tat` is the theoretical arrival time of the next request. Returns
+    (allowed, new tat, seconds until the next request would be allowed).
+    """
+    tat = now if tat is None or tat < now else tat
+    new_tat = tat + interval
+    allow_at = new_tat - burst * interval
+    if now < allow_at:
+        return False, tat, allow_at - now
+    return True, new_tat, 0.0
+
+
+class SharedStore:
+    """String key/value store with TTLs and an atomic rate-limit update.
+
+    `blocking` stores do network I/O and are called off the event loop.
+    """
+
+    blocking = False
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set_many(self, items: Iterable[Tuple[str, str]], ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self.set_many([(key, value)], ttl)
+
+    def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix: str) -> int:
+        raise NotImplementedError
+
+    def gcra(self, key: str, interval: float, burst: int) -> Tuple[bool, float]:
+        """Take one request from the bucket at `key`; returns (allowed, retry_after)"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LocalStore(SharedStore):
+    """In-process SharedStore; shares state between components of one process only"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set_many(self, items: Iterable[Tuple[str, str]], ttl: Optional[float] = None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            for key, value in items:
+                self._data[key] = (value, expires_at)
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def delete_prefix(self, prefix: str) -> int:
+        with self._lock:
+            keys = [key for key in self._data if key.startswith(prefix)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def gcra(self, key: str, interval: float, burst: int) -> Tuple[bool, float]:
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            allowed, tat, retry_after = gcra(float(item[0]) if item else None, now, interval, burst)
+            if allowed:
+                self._data[key] = (repr(tat), time.monotonic() + (tat - now))
+        return allowed, retry_after
+
+
+# Uses the Redis server clock so nodes with skewed clocks still agree
+_GCRA_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then tat = now end
+local new_tat = tat + interval
+local allow_at = new_tat - burst * interval
+if now < allow_at then return {0, tostring(allow_at - now)} end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return {1, '0'}
+"""
+
+
+class RedisStore(SharedStore):
+    """SharedStore on Redis, for several workers or machines. Needs the `redis` package."""
+
+    blocking = True
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = STATE_KEY_PREFIX):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("STATE_BACKEND=redis needs the redis package: pip install redis") from e
+        self._prefix = prefix
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._gcra = self._client.register_script(_GCRA_SCRIPT)
+
+    def get(self, key: str) -> Optional[str]:
+        return self._client.get(self._prefix + key)
+
+    def set_many(self, items: Iterable[Tuple[str, str]], ttl: Optional[float] = None):
+        pipe = self._client.pipeline(transaction=False)
+        for key, value in items:
+            pipe.set(self._prefix + key, value, px=int(ttl * 1000) if ttl else None)
+        pipe.execute()
+
+    def delete(self, key: str) -> bool:
+        return bool(self._client.delete(self._prefix + key))
+
+    def delete_prefix(self, prefix: str) -> int:
+        removed = 0
+        batch = []
+        for key in self._client.scan_iter(match=self._prefix + prefix + "*", count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                removed += self._client.unlink(*batch)
+                batch = []
+        if batch:
+            removed += self._client.unlink(*batch)
+        return removed
+
+    def gcra(self, key: str, interval: float, burst: int) -> Tuple[bool, float]:
+        allowed, retry_after = self._gcra(keys=[self._prefix + key], args=[interval, burst])
+        return bool(int(allowed)), float(retry_after)
+
+    def close(self):
+        self._client.close()
+
+
+async def store_call(store: SharedStore, method: Callable, *args) -> Any:
+    """Call a store method, off the event loop if the store blocks"""
+    if store.blocking:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+
+_shared_store: Optional[SharedStore] = None
+
+
+def get_shared_store() -> Optional[SharedStore]:
+    """The process-wide store selected by STATE_BACKEND, or None for per-process state"""
+    global _shared_store
+    if _shared_store is None and STATE_BACKEND:
+        if STATE_BACKEND == "redis":
+            _shared_store = RedisStore()
+        elif STATE_BACKEND == "local":
+            _shared_store = LocalStore()
+        else:
+            raise ValueError(f"Unknown STATE_BACKEND: {STATE_BACKEND}")
+    return _shared_store
+
+
+def close_shared_store():
+    global _shared_store
+    if _shared_store is not None:
+        _shared_store.close()
+        _shared_store = None
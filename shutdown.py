@@ -0,0 +1,76 @@
+"""Drain on SIGTERM, before the server starts shutting down.
+
+uvicorn answers SIGTERM by closing every WebSocket with 1012 at once and
+only then running the lifespan shutdown, so answers in progress are cut
+off and every client reconnects in the same instant. DrainOnSignal puts a
+handler in front of uvicorn's: the first SIGTERM runs the drain (fail
+/ready, refuse new sockets, let answers finish and hand sessions off, see
+connections.py) and passes the signal on to uvicorn once it is done. A
+second SIGTERM passes it on at once; SIGINT is left to uvicorn.
+
+Give the process more than WS_DRAIN_TIMEOUT + 10 seconds between SIGTERM
+and SIGKILL (terminationGracePeriodSeconds, docker stop -t).
+"""
+import asyncio
+import logging
+import os
+import signal
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DRAIN_ON_SIGTERM = os.getenv("DRAIN_ON_SIGTERM", "1").lower() not in ("0", "false", "no")
+
+
+class DrainOnSignal:
+    def __init__(self, drain: Callable[[], Awaitable[None]], sig: int = signal.SIGTERM):
+        self.drain = drain
+        self.sig = sig
+        self.received = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._previous = None
+        self._task: Optional[asyncio.Task] = None
+
+    def install(self):
+        """Take over the signal from the server; call from the running event loop (lifespan startup)"""
+        if not DRAIN_ON_SIGTERM:
+            return
+        self._loop = asyncio.get_running_loop()
+        try:
+            self._previous = signal.signal(self.sig, self._handle)
+        except ValueError:
+            # Not the main thread (e.g. a test client): nothing to take over
+            self._loop = None
+
+    def uninstall(self):
+        if self._loop is not None and signal.getsignal(self.sig) == self._handle:
+            signal.signal(self.sig, self._previous)
+        self._loop = None
+
+    def _handle(self, sig, frame):
+        if self.received:
+            logger.warning("second termination signal, stopping without waiting for the drain")
+            self._pass_on(sig, frame)
+            return
+        self.received = True
+        self._loop.call_soon_threadsafe(self._start, sig)
+
+    def _start(self, sig: int):
+        logger.info("termination signal received, draining before shutdown")
+        self._task = self._loop.create_task(self._drain_then_stop(sig))
+
+    async def _drain_then_stop(self, sig: int):
+        try:
+            await self.drain()
+        except Exception as e:
+            logger.exception("drain failed: %s", e)
+        finally:
+            self._pass_on(sig, None)
+
+    def _pass_on(self, sig: int, frame):
+        previous = self._previous
+        if callable(previous):
+            previous(sig, frame)
+            return
+        signal.signal(sig, previous if previous is not None else signal.SIG_DFL)
+        signal.raise_signal(sig)
@@ -0,0 +1,70 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from answer_cache import normalize_question
+
+
+def flight_key(question: str, agent) -> Tuple:
+    """Key identical questions asked of identically configured models together"""
+    model = agent.model
+    return (
+        normalize_question(question),
+        getattr(model, "id", None),
+        getattr(model, "temperature", None),
+        getattr(model, "top_p", None),
+        getattr(model, "max_tokens", None),
+    )
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one upstream call.
+
+    The first caller starts the call as its own task; everyone who arrives
+    while it is running awaits the same task and gets its result or its
+    exception. A caller that goes away (e.g. the client disconnects or
+    cancels the ask) does not cancel the call for the others, but when the
+    last one goes away the call is cancelled, freeing its upstream slot.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.counters = {
+            "calls": 0,      # upstream calls actually made
+            "coalesced": 0,  # callers that shared an in-flight call instead
+            "errors": 0,
+            "abandoned": 0,  # calls cancelled because every caller went away
+        }
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+            self.counters["calls"] += 1
+        else:
+            self.counters["coalesced"] += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            waiters = self._waiters.pop(task) - 1
+            if waiters:
+                self._waiters[task] = waiters
+            elif not task.done():
+                # Nobody is left to read the answer; later callers start a fresh call
+                if self._inflight.get(key) is task:
+                    del self._inflight[key]
+                task.cancel()
+                self.counters["abandoned"] += 1
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._inflight), **self.counters}
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved even if every waiter went away
+        if not task.cancelled() and task.exception() is not None:
+            self.counters["errors"] += 1
@@ -0,0 +1,59 @@
+import json
+import logging
+from typing import AsyncIterator, Optional
+
+from fastapi import WebSocket
+
+from admission import Overloaded
+from metrics import ERRORS
+from resilience import CircuitOpen, DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+# Headers that stop proxies (nginx, Vercel) from buffering an event stream
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def sse_stream(deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Turn text deltas into start, delta, end (or error) Server-Sent Events"""
+    yield sse_event("start", {})
+    try:
+        async for delta in deltas:
+            yield sse_event("delta", {"content": delta})
+    except (Overloaded, CircuitOpen) as e:
+        logger.warning("streaming answer shed: %s", e)
+        yield sse_event("error", {"detail": "The service is busy. Please try again later.",
+                                  "retry_after": e.retry_after})
+        return
+    except DeadlineExceeded as e:
+        logger.warning("streaming answer timed out: %s", e)
+        yield sse_event("error", {"detail": "The answer took too long. Please try again."})
+        return
+    except Exception as e:
+        logger.exception("streaming answer failed: %s", e)
+        ERRORS.labels("sse", type(e).__name__).inc()
+        yield sse_event("error", {"detail": "An error occurred. Please try again later."})
+        return
+    yield sse_event("end", {})
+
+
+async def websocket_stream(websocket: WebSocket, deltas: AsyncIterator[str], message_id: Optional[str] = None) -> str:
+    """Send text deltas as start/delta/end JSON frames and return the full text.
+
+    With a message id (protocol v2, ws_protocol.py) every frame carries it.
+    """
+    tag = {} if message_id is None else {"id": message_id}
+    parts = []
+    await websocket.send_json({"type": "start", **tag})
+    async for delta in deltas:
+        parts.append(delta)
+        await websocket.send_json({"type": "delta", **tag, "content": delta})
+    await websocket.send_json({"type": "end", **tag})
+    return "".join(parts)
@@ -0,0 +1,174 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import secrets
+import sys
+import zlib
+from typing import Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Share of requests whose INFO/DEBUG records are kept; warnings and errors are always kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+# Message text and content fields are cut to this many characters
+LOG_MAX_CHARS = int(os.getenv("LOG_MAX_CHARS", "200"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# A stand-in for the session (capture.session_ref), never the resumable token itself
+session_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("session_id", default=None)
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# Things that must never reach the logs: wallet addresses, keys, API tokens, emails
+_REDACTIONS = [
+    (re.compile(r"\b(?:0x)?[0-9a-fA-F]{64}\b"), "[KEY]"),
+    (re.compile(r"\b0x[0-9a-fA-F]{40}\b"), "[ADDRESS]"),
+    (re.compile(r"\b(?:bc1[02-9ac-hj-np-z]{11,71}|[13][1-9A-HJ-NP-Za-km-z]{25,34})\b"), "[ADDRESS]"),
+    (re.compile(r"\b(?:gsk|sk|pk|xprv|xpub)[_-][A-Za-z0-9_-]{16,}\b"), "[SECRET]"),
+    (re.compile(r"\b[\w.+-]+@[\w-]+\.[\w.-]+\b"), "[EMAIL]"),
+]
+_PLACEHOLDERS = frozenset(replacement for _, replacement in _REDACTIONS)
+
+# Record attributes that are part of every LogRecord and not user-supplied fields
+_RESERVED = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def redact(text: str) -> str:
+    for pattern, replacement in _REDACTIONS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def has_redactions(text: str) -> bool:
+    """Whether `text` contains what redact() puts in place of what it removes"""
+    return any(placeholder in text for placeholder in _PLACEHOLDERS)
+
+
+def truncate(text: str, limit: int = LOG_MAX_CHARS) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}…(+{len(text) - limit} chars)"
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with long strings truncated and secrets redacted"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": redact(truncate(record.getMessage())),
+        }
+        for key, value in record.__dict__.items():
+            if key in _RESERVED or key.startswith("_"):
+                continue
+            if isinstance(value, str):
+                value = redact(truncate(value))
+            entry[key] = value
+        if record.exc_text:
+            entry["exc"] = redact(record.exc_text)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _ContextFilter(logging.Filter):
+    """Tags records with the current session/request IDs and applies per-request sampling"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = request_id_var.get()
+        record.session_id = session_id_var.get()
+        record.request_id = request_id
+        if LOG_SAMPLE_RATE >= 1.0 or record.levelno >= logging.WARNING:
+            return True
+        # Hash the request ID so a request's records are all kept or all dropped
+        key = request_id or record.getMessage()
+        return (zlib.crc32(key.encode()) % 10000) < LOG_SAMPLE_RATE * 10000
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread; drops them rather than wait when the queue is full"""
+
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _NonBlockingQueueHandler.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens on the writer thread; only tracebacks must be rendered here
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging():
+    """Route the root logger through a bounded queue to a JSON writer thread (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JSONFormatter())
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = _NonBlockingQueueHandler(log_queue)
+    handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+    # One line per upstream HTTP call is noise at production volume
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def new_request_id() -> str:
+    return secrets.token_hex(8)
+
+
+class RequestContextMiddleware:
+    """ASGI middleware that gives each HTTP request an ID (from X-Request-ID or a new one) and echoes it back"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or new_request_id()
+        header = (b"x-request-id", request_id.encode("latin-1"))
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), header]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
@@ -0,0 +1,253 @@
+"""Type-ahead suggestions of known questions, answered from the FAQ or the answer cache.
+
+Every stateless question asked is counted under its normalized form, along
+with who asked it (a hash of the client address). Every
+SUGGEST_REBUILD_INTERVAL seconds, if counts or FAQ entries changed, the
+SUGGEST_INDEX_SIZE most asked questions that have an answer ready (canonical
+FAQ entries, or questions asked by at least SUGGEST_MIN_COUNT different
+clients whose answer is in the answer cache) are indexed by the start of the
+question and of each word in it, and the new index replaces the old one.
+Questions with an email address, wallet address, key or long number in them
+are never counted: they are about one user, and so is their answer.
+
+The index is a sorted list of those suffixes, searched with bisect, plus a
+table of the best matches for each prefix shared by more than SCAN_LIMIT
+suffixes, whose ranges are too large to scan. A lookup reads the table or
+ranks at most SCAN_LIMIT entries: a few microseconds (bench/suggest.py).
+Matches at the start of the question rank before matches inside it, then
+by how often the question was asked. A suggestion carries its answer, so
+picking one needs no model call, and asking it on /ask is a cache hit.
+"""
+import asyncio
+import bisect
+import heapq
+import logging
+import os
+import re
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from answer_cache import normalize_question
+from structured_log import redact
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_INDEX_SIZE = int(os.getenv("SUGGEST_INDEX_SIZE", "2000"))
+# Questions from traffic are suggested once this many different clients asked them,
+# so one client cannot put its question in front of everyone by repeating it
+SUGGEST_MIN_COUNT = int(os.getenv("SUGGEST_MIN_COUNT", "3"))
+SUGGEST_REBUILD_INTERVAL = float(os.getenv("SUGGEST_REBUILD_INTERVAL", "30"))
+# Distinct questions counted; when full, the less asked half is forgotten at the next rebuild
+SUGGEST_MAX_TRACKED = int(os.getenv("SUGGEST_MAX_TRACKED", "20000"))
+SUGGEST_MIN_CHARS = 2
+SUGGEST_MAX_RESULTS = 10
+# Longer questions are not suggestion material
+MAX_QUESTION_CHARS = 200
+# Prefixes matching more index entries than this are answered from a precomputed table
+SCAN_LIMIT = 32
+# Phone, card, account and order numbers, which structured_log leaves alone
+_LONG_NUMBER = re.compile(r"\d[\d -]{5,}\d")
+
+
+class _Question(NamedTuple):
+    key: str
+    text: str
+    count: int
+    faq_answer: Optional[str]
+
+
+class _Index(NamedTuple):
+    questions: Tuple[_Question, ...]
+    suffixes: List[str]                 # sorted word-start suffixes of the questions
+    entries: List[Tuple[int, int]]      # (question, rank) for each suffix
+    common: Dict[str, Tuple[int, ...]]  # prefix of more than SCAN_LIMIT suffixes -> best questions
+
+
+_EMPTY = _Index((), [], [], {})
+
+
+def _rank(question: _Question, at_start: bool) -> int:
+    return (1 << 40 if at_start else 0) + question.count
+
+
+def build_index(questions: Iterable[_Question]) -> _Index:
+    """Index questions by the start of each word (runs in a worker thread)"""
+    questions = tuple(questions)
+    pairs: List[Tuple[str, int, int]] = []
+    for question_id, question in enumerate(questions):
+        key = question.key
+        start = 0
+        while start >= 0:
+            pairs.append((key[start:], question_id, _rank(question, start == 0)))
+            start = key.find(" ", start)
+            start = start + 1 if start >= 0 else -1
+    pairs.sort()
+    suffixes = [pair[0] for pair in pairs]
+    entries = [pair[1:] for pair in pairs]
+
+    # Prefixes one character longer than a common one can only be common inside its range
+    common: Dict[str, Tuple[int, ...]] = {}
+    ranges = [(0, len(suffixes))]
+    length = SUGGEST_MIN_CHARS
+    while ranges:
+        longer = []
+        for start, end in ranges:
+            i = start
+            while i < end:
+                if len(suffixes[i]) < length:
+                    i += 1
+                    continue
+                prefix = suffixes[i][:length]
+                j = bisect.bisect_left(suffixes, prefix + "\uffff", i, end)
+                if j - i > SCAN_LIMIT:
+                    # Twice what a lookup returns, for the ones whose cached answer expired since
+                    common[prefix] = tuple(_best(entries[i:j], 2 * SUGGEST_MAX_RESULTS))
+                    longer.append((i, j))
+                i = j
+        ranges = longer
+        length += 1
+    return _Index(questions, suffixes, entries, common)
+
+
+def _best(entries: Iterable[Tuple[int, int]], count: int) -> List[int]:
+    """The `count` best questions among (question, rank) entries"""
+    ranks: Dict[int, int] = {}
+    for question_id, rank in entries:
+        if ranks.get(question_id, -1) < rank:
+            ranks[question_id] = rank
+    return heapq.nlargest(count, ranks, key=ranks.__getitem__)
+
+
+class SuggestIndex:
+    """Prefix index of frequently asked questions with ready answers"""
+
+    def __init__(self, answer_lookup: Callable[[str], Optional[str]],
+                 faq_questions: Callable[[], List[Tuple[str, str]]],
+                 size: int = SUGGEST_INDEX_SIZE, min_count: int = SUGGEST_MIN_COUNT):
+        self.answer_lookup = answer_lookup
+        self.faq_questions = faq_questions
+        self.size = size
+        self.min_count = min_count
+        self._counts: Dict[str, int] = {}   # normalized question -> times asked
+        self._texts: Dict[str, str] = {}    # normalized question -> as first asked
+        self._askers: Dict[str, Set[int]] = {}  # normalized question -> up to min_count asker hashes
+        self._changed = True
+        self._faq: List[Tuple[str, str]] = []
+        self._index = _EMPTY
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self.counters = {"observed": 0, "untracked": 0, "identifying": 0, "lookups": 0, "served": 0,
+                         "rebuilds": 0}
+
+    def __len__(self) -> int:
+        return len(self._index.questions)
+
+    def observe(self, question: str, asker: str):
+        """Count a question that `asker` (a client address) is having answered"""
+        question = question.strip()
+        if len(question) > MAX_QUESTION_CHARS:
+            return
+        key = normalize_question(question)
+        if not key:
+            return
+        if redact(question) != question or _LONG_NUMBER.search(question):
+            self.counters["identifying"] += 1
+            return
+        count = self._counts.get(key)
+        if count is None:
+            if len(self._counts) >= SUGGEST_MAX_TRACKED:
+                self.counters["untracked"] += 1
+                return
+            self._texts[key] = question
+            count = 0
+        self._counts[key] = count + 1
+        askers = self._askers.setdefault(key, set())
+        if len(askers) < self.min_count:
+            # str hashes are salted per process, so the addresses themselves are not kept
+            askers.add(hash(asker))
+        self.counters["observed"] += 1
+        self._changed = True
+
+    def suggest(self, prefix: str, limit: int = 5) -> List[dict]:
+        """Best known questions starting with `prefix`, or with a word starting with it, and their answers"""
+        self.counters["lookups"] += 1
+        prefix = normalize_question(prefix)
+        if len(prefix) < SUGGEST_MIN_CHARS:
+            return []
+        index = self._index
+        candidates = index.common.get(prefix)
+        if candidates is None:
+            start = bisect.bisect_left(index.suffixes, prefix)
+            end = bisect.bisect_left(index.suffixes, prefix + "\uffff", start, min(len(index.suffixes), start + SCAN_LIMIT + 1))
+            candidates = _best(index.entries[start:end], SCAN_LIMIT)
+
+        suggestions = []
+        for question_id in candidates:
+            question = index.questions[question_id]
+            answer = question.faq_answer or self.answer_lookup(question.key)
+            if answer is None:
+                continue
+            suggestions.append({"question": question.text, "answer": answer,
+                                "source": "faq" if question.faq_answer else "cache"})
+            if len(suggestions) >= limit:
+                break
+        if suggestions:
+            self.counters["served"] += 1
+        return suggestions
+
+    def rebuild(self):
+        """Rebuild the index synchronously (startup)"""
+        self._faq = self.faq_questions()
+        self._index = build_index(self._candidates())
+        self.counters["rebuilds"] += 1
+
+    async def refresh(self):
+        """Rebuild the index in a worker thread if counts or FAQ entries changed"""
+        faq = self.faq_questions()
+        if not self._changed and faq == self._faq:
+            return
+        self._faq = faq
+        candidates = self._candidates()
+        self._index = await asyncio.to_thread(build_index, candidates)
+        self.counters["rebuilds"] += 1
+
+    def start(self):
+        if self._rebuild_task is None and SUGGEST_REBUILD_INTERVAL > 0:
+            self._rebuild_task = asyncio.create_task(self._rebuild_loop())
+
+    async def close(self):
+        if self._rebuild_task is not None:
+            self._rebuild_task.cancel()
+            self._rebuild_task = None
+
+    def stats(self) -> dict:
+        return {"questions": len(self), "tracked": len(self._counts), **self.counters}
+
+    def _candidates(self) -> List[_Question]:
+        """The questions to index, most asked first (on the event loop: reads the answer cache)"""
+        self._changed = False
+        self._forget_rare()
+        questions: Dict[str, _Question] = {}
+        for heading, answer in self._faq:
+            key = normalize_question(heading)
+            questions[key] = _Question(key, heading, self._counts.get(key, 0), answer)
+        asked = heapq.nlargest(self.size, ((count, key) for key, count in self._counts.items()
+                                           if len(self._askers[key]) >= self.min_count and key not in questions))
+        for count, key in asked:
+            if self.answer_lookup(key) is not None:
+                questions[key] = _Question(key, self._texts[key], count, None)
+        return heapq.nlargest(self.size, questions.values(), key=lambda question: question.count)
+
+    def _forget_rare(self):
+        if len(self._counts) < SUGGEST_MAX_TRACKED:
+            return
+        keep = dict(heapq.nlargest(SUGGEST_MAX_TRACKED // 2, self._counts.items(), key=lambda item: item[1]))
+        self._texts = {key: self._texts[key] for key in keep}
+        self._askers = {key: self._askers[key] for key in keep}
+        self._counts = keep
+
+    async def _rebuild_loop(self):
+        while True:
+            await asyncio.sleep(SUGGEST_REBUILD_INTERVAL)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning("suggestion index rebuild failed: %s", e)
@@ -0,0 +1,51 @@
+"""Shared test setup: offline settings, applied before any app module is imported.
+
+    pip install -r requirements-dev.txt
+    python -m pytest -q
+"""
+import os
+
+# Settings are read at import time
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("STATE_BACKEND", "local")
+os.environ.setdefault("SEARCH_TOOL", "stub")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+import httpx
+import pytest
+
+import upstream
+from agent_pool import AgentSpec
+from bench.mock_groq import MockProfile, create_mock_app
+from tool_calls import search_tools
+
+
+@pytest.fixture
+def mock_groq():
+    """Route upstream calls to the mock Groq server; returns its profile, which tests may change"""
+    from groq import AsyncGroq
+
+    profile = MockProfile(latency_ms=1, latency_sigma=0, tokens_per_second=100000, output_tokens=5)
+    previous = upstream._async_client
+    upstream._async_client = AsyncGroq(
+        api_key="test", base_url="http://mock", max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=create_mock_app(profile))))
+    yield profile
+    upstream._async_client = previous
+
+
+@pytest.fixture
+def agent(mock_groq):
+    return AgentSpec(name="Test Agent", model_id="mock-model", tools=(search_tools(),),
+                     instructions=("Answer briefly.",)).build()
+
+
+@pytest.fixture
+def app_client(mock_groq):
+    """TestClient for the app, started and stopped with its lifespan, answering from the mock server"""
+    from fastapi.testclient import TestClient
+
+    import app
+
+    with TestClient(app.app) as client:
+        yield client
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from admission import BACKGROUND, CONTINUING, NEW, AdmissionController, Overloaded
+
+
+async def queue(controller: AdmissionController, priority: int, order: list):
+    await controller.acquire(priority)
+    order.append(priority)
+
+
+def test_free_slot_is_taken_without_queueing():
+    async def scenario():
+        controller = AdmissionController(concurrency=2)
+        await controller.acquire(NEW)
+        await controller.acquire(NEW)
+        assert controller.stats()["running"] == 2
+        assert controller.counters["queued"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_waiters_get_slots_by_priority_then_arrival():
+    async def scenario():
+        controller = AdmissionController(concurrency=1)
+        await controller.acquire(NEW)
+        order = []
+        tasks = []
+        for priority in (BACKGROUND, NEW, CONTINUING, NEW):
+            tasks.append(asyncio.create_task(queue(controller, priority, order)))
+            await asyncio.sleep(0)
+        for _ in tasks:
+            controller.release(0.01)
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert order == [CONTINUING, NEW, NEW, BACKGROUND]
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_displaces_newest_lowest_priority_waiter():
+    async def scenario():
+        controller = AdmissionController(concurrency=1, queue_size=3)
+        await controller.acquire(NEW)
+        order = []
+        background_first = asyncio.create_task(queue(controller, BACKGROUND, order))
+        await asyncio.sleep(0)
+        new = asyncio.create_task(queue(controller, NEW, order))
+        await asyncio.sleep(0)
+        background_last = asyncio.create_task(queue(controller, BACKGROUND, order))
+        await asyncio.sleep(0)
+
+        continuing = asyncio.create_task(queue(controller, CONTINUING, order))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as info:
+            await background_last
+        assert info.value.reason == "displaced"
+        assert not background_first.done()
+
+        for _ in range(3):
+            controller.release(0.01)
+            await asyncio.sleep(0)
+        await asyncio.gather(continuing, new, background_first)
+        assert order == [CONTINUING, NEW, BACKGROUND]
+        assert controller.counters["displaced"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_sheds_a_call_that_cannot_displace_anyone():
+    async def scenario():
+        controller = AdmissionController(concurrency=1, queue_size=1)
+        await controller.acquire(NEW)
+        waiting = asyncio.create_task(controller.acquire(CONTINUING))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as info:
+            await controller.acquire(NEW)
+        assert info.value.reason == "queue_full"
+        assert info.value.retry_after >= 1
+        controller.release(0.01)
+        await waiting
+
+    asyncio.run(scenario())
+
+
+def test_expected_wait_over_max_wait_is_shed_up_front():
+    async def scenario():
+        controller = AdmissionController(concurrency=1, max_wait=1.0)
+        await controller.acquire(NEW)
+        controller.service_time = 2.0
+        with pytest.raises(Overloaded) as info:
+            await controller.acquire(NEW)
+        assert info.value.reason == "wait"
+        assert controller.counters["shed_wait"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_waiter_is_shed_once_it_has_waited_max_wait():
+    async def scenario():
+        controller = AdmissionController(concurrency=1, max_wait=0.05)
+        await controller.acquire(NEW)
+        with pytest.raises(Overloaded) as info:
+            await controller.acquire(NEW)
+        assert info.value.reason == "timeout"
+        assert controller.stats()["waiting"] == 0
+        # The shed waiter did not take the slot
+        controller.release(0.01)
+        assert controller.running == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_gives_its_slot_to_the_next_one():
+    async def scenario():
+        controller = AdmissionController(concurrency=1)
+        await controller.acquire(NEW)
+        cancelled = asyncio.create_task(controller.acquire(CONTINUING))
+        next_in_line = asyncio.create_task(controller.acquire(NEW))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        controller.release(0.01)
+        await next_in_line
+        assert controller.running == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,67 @@
+import time
+
+from answer_cache import AnswerCache, normalize_question, question_tokens
+
+
+def test_normalize_question():
+    assert normalize_question("  How do I   RESET my password?! ") == "how do i reset my password"
+    assert normalize_question("") == ""
+
+
+def test_question_tokens_drop_stopwords_and_stem():
+    assert question_tokens("how do i reset my passwords") == {"how", "reset", "password"}
+
+
+def test_exact_and_normalized_hits():
+    cache = AnswerCache(max_entries=10, ttl=60)
+    cache.set("How do I reset my password?", "Use the reset link.")
+    assert cache.get("How do I reset my password?") == "Use the reset link."
+    assert cache.get("how do i reset my password") == "Use the reset link."
+    assert cache.counters["hits_exact"] == 1
+    assert cache.counters["hits_normalized"] == 1
+
+
+def test_near_duplicates_match_by_jaccard_similarity():
+    cache = AnswerCache(max_entries=10, ttl=60, similarity=0.8)
+    cache.set("how long does a bank withdrawal take", "One to three days.")
+    # Same content words once stemmed and stopwords are dropped
+    assert cache.get("How long do bank withdrawals take?") == "One to three days."
+    assert cache.counters["hits_similar"] == 1
+    # Shares 3 of 6 content words: below the threshold, but close enough for the fallback
+    assert cache.get("how long does a card deposit take") is None
+    assert cache.closest("how long does a card withdrawal take", similarity=0.5) == "One to three days."
+
+
+def test_short_questions_are_only_matched_exactly():
+    cache = AnswerCache(max_entries=10, ttl=60, similarity=0.5)
+    cache.set("reset password now", "Use the reset link.")
+    assert cache.get("reset passwords") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnswerCache(max_entries=2, ttl=60)
+    cache.set("first question about fees", "1")
+    cache.set("second question about limits", "2")
+    cache.get("first question about fees")
+    cache.set("third question about wallets", "3")
+    assert len(cache) == 2
+    assert cache.peek("second question about limits") is None
+    assert cache.peek("first question about fees") == "1"
+    assert cache.counters["evictions"] == 1
+
+
+def test_entries_expire_after_ttl():
+    cache = AnswerCache(max_entries=10, ttl=0.05)
+    cache.set("how do fees work here", "Like this.")
+    time.sleep(0.06)
+    assert cache.get("how do fees work here") is None
+    assert cache.counters["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_purge_removes_aliases_and_similarity_index():
+    cache = AnswerCache(max_entries=10, ttl=60)
+    cache.set("How do refunds for card payments work?", "Five days.")
+    assert cache.purge("how do refunds for card payments work") == 1
+    assert cache.get("How do refunds for card payments work?") is None
+    assert cache.stats()["size"] == 0
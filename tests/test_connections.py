@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+from connections import ConnectionManager
+from session_store import InMemoryBackend, SessionStore
+
+TOKEN = "a" * 24
+
+
+class FakeWebSocket:
+    def __init__(self, session: str = TOKEN):
+        self.query_params = {"session": session}
+        self.sent = []
+        self.closed = None
+
+    async def accept(self, subprotocol=None, headers=None):
+        pass
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed = (code, reason)
+
+
+async def connect(stream: bool = True):
+    backend = InMemoryBackend()
+    manager = ConnectionManager(SessionStore(backend))
+    websocket = FakeWebSocket()
+    connection = await manager.connect(websocket, "127.0.0.1", stream)
+    connection.history.append("user", "hello")
+    return manager, backend, connection
+
+
+def test_hand_off_saves_the_session_and_tells_the_client_to_reconnect():
+    async def scenario():
+        manager, backend, connection = await connect()
+        await manager.hand_off(connection)
+
+        assert json.loads(backend.read(TOKEN))["recent"] == [["user", "hello"]]
+        hint = connection.websocket.sent[-1]
+        assert (hint["type"], hint["session"]) == ("reconnect", TOKEN)
+        assert connection.websocket.closed == (1012, f"Server restarting; reconnect with ?session={TOKEN}")
+        assert manager.admit_message(connection, "one more thing") == "restarting"
+
+        await manager.hand_off(connection)
+        assert manager.counters["drained"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_plain_text_client_gets_the_token_in_the_close_reason_only():
+    async def scenario():
+        manager, _, connection = await connect(stream=False)
+        await manager.hand_off(connection)
+        assert connection.websocket.sent == []
+        assert TOKEN in connection.websocket.closed[1]
+
+    asyncio.run(scenario())
+
+
+def test_drain_waits_for_the_answer_in_progress():
+    async def scenario():
+        manager, _, connection = await connect()
+        connection.busy = True
+        drain = asyncio.create_task(manager.drain(timeout=5, spread=0))
+        await asyncio.sleep(0.1)
+        assert manager.refusal("127.0.0.2") == "Server restarting"
+        assert connection.websocket.closed is None
+
+        connection.busy = False
+        await asyncio.wait_for(drain, 1)
+        assert connection.websocket.closed[0] == 1012
+
+        manager.start()
+        assert manager.refusal("127.0.0.2") is None
+        await manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_drain_hands_off_when_the_timeout_runs_out():
+    async def scenario():
+        manager, _, connection = await connect()
+        connection.queued_bytes = 100
+        await asyncio.wait_for(manager.drain(timeout=0.1, spread=0), 1)
+        assert connection.websocket.closed[0] == 1012
+
+    asyncio.run(scenario())
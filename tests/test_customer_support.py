@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+from customer_support import answered_ids, ends_mid_line, read_questions, run_batch
+
+
+def test_read_questions_from_jsonl_records_bad_lines(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    path.write_text('{"id": "q1", "question": " What are the fees? "}\n'
+                    '"How do I buy ETH?"\n'
+                    "\n"
+                    "42\n"
+                    "{not json\n"
+                    '{"question": ["a", "list"]}\n'
+                    '{"id": "q2"}\n')
+    items = list(read_questions(str(path)))
+    assert items[:3] == [
+        {"id": "q1", "question": "What are the fees?"},
+        {"id": "How do I buy ETH?", "question": "How do I buy ETH?"},
+        {"id": "line 4", "error": "Expected an object or a string, not int"},
+    ]
+    assert items[3]["id"] == "line 5" and items[3]["error"].startswith("Not JSON: ")
+    assert items[4:] == [{"id": "line 6", "error": "The question must be a string"}]
+
+
+def test_read_questions_from_csv(tmp_path):
+    path = tmp_path / "questions.csv"
+    path.write_text("id,question\nq1,What are the fees?\n,How do I buy ETH?\nq3,\n")
+    assert [item["id"] for item in read_questions(str(path))] == ["q1", "How do I buy ETH?"]
+
+
+def test_answered_ids_keeps_ok_results_only(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    assert answered_ids(str(path)) == set()
+    path.write_text('{"id": "q1", "status": "ok"}\n{"id": "q2", "status": "error"}\n{"id": "q3", "sta')
+    assert answered_ids(str(path)) == {"q1"}
+
+
+def test_ends_mid_line(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    path.write_text("")
+    assert not ends_mid_line(str(path))
+    path.write_text('{"id": "q1"}\n')
+    assert not ends_mid_line(str(path))
+    path.write_text('{"id": "q1"}\n{"id": "q2", "sta')
+    assert ends_mid_line(str(path))
+
+
+def test_run_batch_resumes_and_records_bad_lines(tmp_path, mock_groq):
+    questions = tmp_path / "questions.jsonl"
+    questions.write_text('{"id": "q1", "question": "What are the fees?"}\n'
+                         '{"id": "q2", "question": "How do I buy ETH?"}\n'
+                         "42\n")
+    output = tmp_path / "answers.jsonl"
+    output.write_text('{"id": "q1", "status": "ok", "answer": "Low."}\n{"id": "q2", "sta')
+
+    totals = asyncio.run(run_batch(str(questions), str(output), concurrency=2))
+    assert (totals["skipped"], totals["answered"], totals["failed"]) == (1, 1, 1)
+
+    lines = output.read_text().splitlines()
+    assert lines[1] == '{"id": "q2", "sta'
+    records = [json.loads(line) for line in lines[2:]]
+    assert records[0] == {"id": "line 3", "status": "error", "error": "Expected an object or a string, not int"}
+    assert (records[1]["id"], records[1]["status"]) == ("q2", "ok")
+    assert answered_ids(str(output)) == {"q1", "q2"}
@@ -0,0 +1,93 @@
+import asyncio
+
+import faq
+from faq import FAQIndex
+
+WALLETS = """# Wallets
+
+## How do I set up a new wallet?
+Install the app and choose "Create new wallet".
+
+## How do I keep my seed phrase safe?
+Write it down and never share it.
+
+## Hardware wallets
+A hardware wallet keeps private keys offline.
+"""
+
+TRANSACTIONS = """# Transactions
+
+## Why did my transaction fail?
+The network fee was too low or the transaction ran out of gas.
+
+## Why is my transaction pending?
+The network is busy; it confirms once a block includes it.
+"""
+
+
+def make_index(tmp_path, **kwargs) -> FAQIndex:
+    (tmp_path / "wallets.md").write_text(WALLETS)
+    (tmp_path / "transactions.md").write_text(TRANSACTIONS)
+    index = FAQIndex(str(tmp_path), **kwargs)
+    index.load()
+    return index
+
+
+def test_close_question_is_answered_from_the_heading(tmp_path):
+    index = make_index(tmp_path)
+    assert index.answer("how do I set up a wallet") == 'Install the app and choose "Create new wallet".'
+    assert index.answer("Why did my transaction fail?").startswith("The network fee")
+
+
+def test_answer_threshold(tmp_path):
+    assert make_index(tmp_path, answer_threshold=0.99).answer("how do I set up a wallet") is None
+    # Half the heading is not a match, even though the question is fully covered
+    assert make_index(tmp_path).answer("how do I set up") is None
+
+
+def test_negation_does_not_match_a_heading_without_it(tmp_path):
+    index = make_index(tmp_path)
+    assert index.answer("why did my transaction not fail") is None
+    assert index.answer("why didn't my transaction fail") is None
+
+
+def test_context_min_score(tmp_path, monkeypatch):
+    index = make_index(tmp_path)
+    context = index.context("are hardware wallets safe for private keys")
+    assert context is not None and context.startswith("Hardware wallets\n")
+    assert index.context("what is the weather like today") is None
+
+    monkeypatch.setattr(faq, "FAQ_CONTEXT_MIN_SCORE", 100.0)
+    assert index.context("are hardware wallets safe for private keys") is None
+
+
+def test_missing_directory_is_an_empty_index(tmp_path):
+    index = FAQIndex(str(tmp_path / "missing"))
+    index.load()
+    assert len(index) == 0
+    assert index.answer("how do I set up a new wallet") is None
+    assert FAQIndex("").stats()["files"] == 0
+
+
+def test_refresh_reindexes_only_changed_files(tmp_path):
+    index = make_index(tmp_path)
+    assert index.stats()["passages"] == 5
+
+    asyncio.run(index.refresh())
+    assert index.counters["reloads"] == 0
+
+    (tmp_path / "fees.txt").write_text("## What are network fees?\nFees pay the validators.\n")
+    asyncio.run(index.refresh())
+    assert index.stats()["files"] == 3
+    assert index.answer("what are the network fees") == "Fees pay the validators."
+
+    (tmp_path / "fees.txt").write_text("## What are network fees?\nFees pay the validators who include your transaction.\n")
+    asyncio.run(index.refresh())
+    assert index.answer("what are the network fees") == "Fees pay the validators who include your transaction."
+    assert len(index) == 6
+
+    (tmp_path / "fees.txt").unlink()
+    asyncio.run(index.refresh())
+    assert index.answer("what are the network fees") is None
+    assert index.stats()["files"] == 2 and len(index) == 5
+    assert index.counters["reloads"] == 3
@@ -0,0 +1,71 @@
+import asyncio
+
+from history import SUMMARY_BATCH_MESSAGES, ConversationHistory, estimate_tokens
+
+
+def message_tokens(messages) -> int:
+    return sum(estimate_tokens(message["content"]) for message in messages if message["role"] != "system")
+
+
+def prompt_tokens(history: ConversationHistory) -> int:
+    return message_tokens(history.prompt_messages())
+
+
+def test_recent_window_keeps_to_the_token_budget():
+    history = ConversationHistory(token_budget=100, max_messages=50)
+    for i in range(20):
+        history.append("user", "x" * 120)
+    assert prompt_tokens(history) <= 100
+    assert len(history.pending) <= 2 * SUMMARY_BATCH_MESSAGES
+
+
+def test_pending_turns_stay_bounded_while_a_summary_runs():
+    async def scenario():
+        history = ConversationHistory(token_budget=50)
+        release = asyncio.Event()
+
+        async def slow_summary(summary, turns):
+            await release.wait()
+            return "summary"
+
+        for i in range(20):
+            history.append("user" if i % 2 == 0 else "assistant", "y" * 120)
+            history.schedule_summary(slow_summary)
+        assert history.summarizing
+        assert len(history.pending) <= 2 * SUMMARY_BATCH_MESSAGES
+        assert prompt_tokens(history) <= 50 + estimate_tokens("y" * 120)
+
+        release.set()
+        await asyncio.sleep(0.01)
+        assert history.summary == "summary"
+        assert not history.summarizing
+
+    asyncio.run(scenario())
+
+
+def test_round_trip_through_dict():
+    history = ConversationHistory(system_prompt="Be helpful.")
+    history.append("user", "hello")
+    history.append("assistant", "hi")
+    restored = ConversationHistory.from_dict(history.to_dict())
+    assert restored.prompt_messages() == history.prompt_messages()
+    assert restored.user_turns == 1
+
+
+def test_question_is_sent_without_being_recorded():
+    history = ConversationHistory(system_prompt="Be helpful.")
+    history.append("user", "hello")
+    history.append("assistant", "hi")
+    messages = history.prompt_messages("how do refunds work")
+    assert messages[-1] == {"role": "user", "content": "how do refunds work"}
+    assert history.user_turns == 1
+    assert [content for _, content, _ in history.recent] == ["hello", "hi"]
+
+
+def test_question_counts_against_the_budget():
+    history = ConversationHistory(token_budget=100, max_messages=4)
+    for i in range(4):
+        history.append("user" if i % 2 == 0 else "assistant", "z" * 120)
+    messages = history.prompt_messages("q" * 120)
+    assert len(messages) <= 4
+    assert message_tokens(messages) <= 100
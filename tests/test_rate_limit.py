@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from rate_limit import MemoryRateLimitBackend, RateLimiter, parse_rate
+from shared_state import gcra
+
+
+def test_parse_rate():
+    limit = parse_rate("10/minute")
+    assert limit.interval == 6.0
+    assert limit.burst == 10
+    assert parse_rate("2/seconds").interval == 0.5
+
+
+def test_gcra_allows_a_burst_then_refills_at_the_rate():
+    tat = None
+    for _ in range(3):
+        allowed, tat, _ = gcra(tat, 100.0, 1.0, 3)
+        assert allowed
+    allowed, tat, retry_after = gcra(tat, 100.0, 1.0, 3)
+    assert not allowed
+    assert retry_after == pytest.approx(1.0)
+
+    allowed, tat, _ = gcra(tat, 100.5, 1.0, 3)
+    assert not allowed
+    allowed, tat, _ = gcra(tat, 101.0, 1.0, 3)
+    assert allowed
+    allowed, tat, _ = gcra(tat, 101.0, 1.0, 3)
+    assert not allowed
+
+
+def test_gcra_bucket_refills_fully_after_idle_time():
+    tat = None
+    for _ in range(3):
+        _, tat, _ = gcra(tat, 0.0, 1.0, 3)
+    allowed = 0
+    for _ in range(5):
+        ok, tat, _ = gcra(tat, 60.0, 1.0, 3)
+        allowed += ok
+    assert allowed == 3
+
+
+def test_rate_limiter_limits_each_client_separately():
+    async def scenario():
+        limiter = RateLimiter(MemoryRateLimitBackend(), {"messages": parse_rate("2/minute")})
+        first = [(await limiter.hit("messages", "1.1.1.1")).allowed for _ in range(3)]
+        second = (await limiter.hit("messages", "2.2.2.2")).allowed
+        return first, second, limiter.rejections["messages"]
+
+    first, second, rejections = asyncio.run(scenario())
+    assert first == [True, True, False]
+    assert second
+    assert rejections == 1
+
+
+def test_memory_backend_sweep_forgets_refilled_buckets():
+    backend = MemoryRateLimitBackend()
+    limit = parse_rate("60/minute")
+    backend.hit("a", limit, 0.0)
+    backend.hit("b", limit, 10.0)
+    assert backend.sweep(5.0) == 1
+    assert len(backend) == 1
+
+
+def rate_limit_messages(monkeypatch, spec: str):
+    import app
+
+    # A fresh backend, so buckets used by earlier tests do not count
+    monkeypatch.setattr(app.rate_limiter, "backend", MemoryRateLimitBackend())
+    monkeypatch.setitem(app.rate_limiter.limits, "messages", parse_rate(spec))
+
+
+def test_rate_limited_stream_client_gets_an_error_frame(app_client, monkeypatch):
+    rate_limit_messages(monkeypatch, "1/minute")
+    with app_client.websocket_connect("/ws?stream=1") as ws:
+        assert ws.receive_json()["type"] == "session"
+        ws.send_text("how do network fees work")
+        while ws.receive_json()["type"] != "end":
+            pass
+        ws.send_text("and how do refunds work")
+        frame = ws.receive_json()
+        assert frame["type"] == "error"
+        assert frame["code"] == "rate_limited"
+        assert frame["retry_after"] >= 1
+
+
+def test_rate_limited_v2_ask_gets_a_typed_error_and_the_socket_stays_open(app_client, monkeypatch):
+    from ws_protocol import SUBPROTOCOL
+
+    rate_limit_messages(monkeypatch, "1/minute")
+    with app_client.websocket_connect("/ws", subprotocols=[SUBPROTOCOL]) as ws:
+        assert ws.receive_json()["type"] == "hello"
+        ws.send_json({"type": "ask", "id": "1", "content": "how do network fees work", "stream": False})
+        assert ws.receive_json()["type"] == "answer"
+        ws.send_json({"type": "ask", "id": "2", "content": "and how do refunds work", "stream": False})
+        frame = ws.receive_json()
+        assert (frame["type"], frame["id"], frame["code"]) == ("error", "2", "rate_limited")
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json()["type"] == "pong"
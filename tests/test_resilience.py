@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import pytest
+
+import resilience
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, DeadlineExceeded
+from upstream import extract_response_text
+
+
+def open_breaker(**kwargs) -> CircuitBreaker:
+    circuit = CircuitBreaker("test", window=4, min_calls=4, failure_ratio=0.5, **kwargs)
+    for ok in (True, False, True, False):
+        circuit.before_call()
+        circuit.record(ok)
+    return circuit
+
+
+def test_breaker_stays_closed_until_min_calls():
+    circuit = CircuitBreaker("test", window=4, min_calls=4, failure_ratio=0.5)
+    for _ in range(3):
+        circuit.before_call()
+        circuit.record(False)
+    assert circuit.state == CLOSED
+
+
+def test_breaker_opens_at_failure_ratio_and_fails_fast():
+    circuit = open_breaker(cooldown=10)
+    assert circuit.state == OPEN
+    with pytest.raises(CircuitOpen) as info:
+        circuit.before_call()
+    assert 1 <= info.value.retry_after <= 10
+
+
+def test_breaker_ignores_outcomes_that_say_nothing_about_upstream():
+    circuit = CircuitBreaker("test", window=4, min_calls=4, failure_ratio=0.5)
+    for _ in range(4):
+        circuit.before_call()
+        circuit.record(None)
+    assert circuit.state == CLOSED
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success():
+    circuit = open_breaker(cooldown=0.05)
+    time.sleep(0.06)
+    circuit.before_call()
+    assert circuit.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        circuit.before_call()
+    circuit.record(True)
+    assert circuit.state == CLOSED
+    circuit.before_call()
+
+
+def test_half_open_reopens_on_failed_probe():
+    circuit = open_breaker(cooldown=0.05)
+    time.sleep(0.06)
+    circuit.before_call()
+    circuit.record(False)
+    assert circuit.state == OPEN
+    with pytest.raises(CircuitOpen):
+        circuit.before_call()
+
+
+def test_half_open_probe_without_verdict_frees_the_probe():
+    circuit = open_breaker(cooldown=0.05)
+    time.sleep(0.06)
+    circuit.before_call()
+    circuit.record(None)
+    assert circuit.state == HALF_OPEN
+    circuit.before_call()
+
+
+def test_run_retries_then_opens_circuit_against_failing_upstream(mock_groq, agent, monkeypatch):
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 0.0)
+    circuit = CircuitBreaker("mock-model", window=4, min_calls=4, failure_ratio=0.5, cooldown=0.2)
+    monkeypatch.setitem(resilience._breakers, "mock-model", circuit)
+    mock_groq.error_rate = 1.0
+
+    async def scenario():
+        resilience.start_deadline(10)
+        with pytest.raises(Exception) as info:
+            await resilience.run(agent, "first")
+        assert resilience.is_retryable(info.value)
+        # Three attempts were recorded as failures; the fourth trips the breaker, so its retry fails fast
+        with pytest.raises(CircuitOpen):
+            await resilience.run(agent, "second")
+        assert circuit.state == OPEN
+        with pytest.raises(CircuitOpen):
+            await resilience.run(agent, "third")
+
+        mock_groq.error_rate = 0.0
+        await asyncio.sleep(0.25)
+        response = await resilience.run(agent, "fourth")
+        assert extract_response_text(response)
+        assert circuit.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_run_raises_deadline_exceeded_when_upstream_is_too_slow(mock_groq, agent, monkeypatch):
+    monkeypatch.setitem(resilience._breakers, "mock-model", CircuitBreaker("mock-model"))
+    mock_groq.latency_ms = 500
+
+    async def scenario():
+        resilience.start_deadline(0.1)
+        with pytest.raises(DeadlineExceeded):
+            await resilience.run(agent, "slow")
+
+    asyncio.run(scenario())
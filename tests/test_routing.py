@@ -0,0 +1,97 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import resilience
+from admission import Overloaded
+from routing import LARGE, SMALL, ModelRouter, classify, parse_routes
+
+
+class Agent:
+    def __init__(self, tier: str, fails: bool = False):
+        self.tier = tier
+        self.fails = fails
+        self.model = SimpleNamespace(id=f"{tier}-model")
+
+
+def make_router(monkeypatch, small_fails=False, error=RuntimeError, **kwargs):
+    calls = []
+
+    async def run(agent, message=None, **_):
+        calls.append(agent.tier)
+        if agent.fails:
+            raise error("upstream failed")
+        return f"{agent.tier}: {message}"
+
+    async def stream(agent, message=None, **_):
+        calls.append(agent.tier)
+        if agent.fails:
+            raise error("upstream failed")
+        for delta in (agent.tier, ": ", message):
+            yield delta
+
+    monkeypatch.setattr(resilience, "run", run)
+    monkeypatch.setattr(resilience, "stream", stream)
+    agents = {SMALL: Agent(SMALL, fails=small_fails), LARGE: Agent(LARGE)}
+    return ModelRouter(agents, **kwargs), calls
+
+
+@pytest.mark.parametrize("question, tier, reason", [
+    ("hi, thanks!", SMALL, "small_talk"),
+    ("", SMALL, "small_talk"),
+    ("where is 0x52908400098527886E0F7030069857D2E4169EE7?", LARGE, "identifier"),
+    ("my withdrawal is stuck and the deposit failed", LARGE, "troubleshooting"),
+    ("what are the fees? and the limits?", LARGE, "several_questions"),
+    (" ".join(["word"] * 30), LARGE, "long"),
+    ("what are the trading fees", SMALL, "simple"),
+])
+def test_classify(question, tier, reason):
+    assert classify(question)[::2] == (tier, reason)
+
+
+def test_classify_is_less_sure_of_longer_questions():
+    assert classify("what are the fees")[1] > classify("what are the fees for trading on the spot market today")[1]
+    assert classify("my deposit is stuck and failed")[1] > classify("my deposit is stuck")[1]
+
+
+def test_low_confidence_goes_to_the_large_model(monkeypatch):
+    router, _ = make_router(monkeypatch, routes={}, min_confidence=0.9)
+    assert router.choose("/ask", "what are the fees for trading on the spot market today").reason == "low_confidence"
+    assert router.choose("/ask", "hello").tier == SMALL
+
+
+def test_pinned_routes_skip_classification(monkeypatch):
+    router, _ = make_router(monkeypatch, routes=parse_routes("/ask=small, /ws=large"))
+    assert router.choose("/ask", "my transfer failed").tier == SMALL
+    assert router.choose("/ws", "hi") == ("/ws", LARGE, "pinned")
+
+
+def test_parse_routes_rejects_unknown_modes():
+    assert parse_routes("/ask, /ws=large") == {"/ask": "auto", "/ws": LARGE}
+    with pytest.raises(ValueError):
+        parse_routes("/ask=medium")
+
+
+def test_run_falls_back_to_the_large_model(monkeypatch):
+    router, calls = make_router(monkeypatch, small_fails=True, routes={})
+    decision = router.choose("/ask", "hello")
+    assert asyncio.run(router.run(decision, "hello")) == "large: hello"
+    assert calls == [SMALL, LARGE]
+
+
+def test_run_does_not_fall_back_when_shed(monkeypatch):
+    router, calls = make_router(monkeypatch, small_fails=True, error=lambda _: Overloaded("queue_full", 1.0), routes={})
+    with pytest.raises(Overloaded):
+        asyncio.run(router.run(router.choose("/ask", "hello"), "hello"))
+    assert calls == [SMALL]
+
+
+def test_stream_falls_back_before_the_first_delta(monkeypatch):
+    router, calls = make_router(monkeypatch, small_fails=True, routes={})
+
+    async def collect():
+        return "".join([delta async for delta in router.stream(router.choose("/ask", "hello"), "hello")])
+
+    assert asyncio.run(collect()) == "large: hello"
+    assert calls == [SMALL, LARGE]
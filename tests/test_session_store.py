@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+from session_store import InMemoryBackend, SessionStore
+
+TOKEN = "a" * 24
+
+
+def test_changes_are_written_behind_on_flush():
+    async def scenario():
+        backend = InMemoryBackend()
+        store = SessionStore(backend)
+        history = await store.attach(TOKEN, system_prompt="Be helpful.")
+        history.append("user", "hello")
+        assert backend.read(TOKEN) is None
+        await store.flush()
+        assert json.loads(backend.read(TOKEN))["recent"] == [["user", "hello"]]
+        await store.flush()
+        assert store.counters["writes"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_idle_session_is_evicted_and_loaded_again_on_reconnect():
+    async def scenario():
+        store = SessionStore(InMemoryBackend(), idle_seconds=0)
+        history = await store.attach(TOKEN)
+        history.append("user", "hello")
+        store.release(TOKEN)
+        # Not written yet, so it must stay resident
+        store._evict_idle()
+        assert TOKEN in store.resident
+        await store.flush()
+        store._evict_idle()
+        assert TOKEN not in store.resident
+
+        history = await store.attach(TOKEN)
+        assert history.user_turns == 1
+        assert store.counters["loads"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_attached_sessions_are_never_evicted():
+    async def scenario():
+        store = SessionStore(InMemoryBackend(), memory_limit_mb=0, idle_seconds=0)
+        history = await store.attach(TOKEN)
+        history.append("user", "hello")
+        await store.flush()
+        store._evict_idle()
+        assert TOKEN in store.resident
+
+    asyncio.run(scenario())
+
+
+def test_least_recently_used_sessions_go_first_when_over_the_memory_cap():
+    async def scenario():
+        store = SessionStore(InMemoryBackend(), memory_limit_mb=1 / 1024, idle_seconds=3600)
+        tokens = [letter * 24 for letter in "abc"]
+        for token in tokens:
+            history = await store.attach(token)
+            history.append("user", "x" * 400)
+            store.release(token)
+        await store.flush()
+        store._evict_idle()
+        # 3 x 400 bytes is over the 1 KB cap; dropping the oldest is enough
+        assert list(store.resident) == tokens[1:]
+
+    asyncio.run(scenario())
@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+from session_store import SessionStore, SharedSessionBackend
+from shared_state import LocalStore
+
+TOKEN = "a" * 24
+
+
+def test_local_store_gcra_burst_and_refill():
+    store = LocalStore()
+    results = [store.gcra("key", 0.05, 2)[0] for _ in range(3)]
+    assert results == [True, True, False]
+    _, retry_after = store.gcra("key", 0.05, 2)
+    assert 0 < retry_after <= 0.05
+    time.sleep(0.06)
+    assert store.gcra("key", 0.05, 2)[0]
+    # Other keys have their own bucket
+    assert store.gcra("other", 0.05, 2)[0]
+
+
+def test_shared_backend_sessions_continue_on_another_instance():
+    async def scenario():
+        shared = LocalStore()
+        first, second = SessionStore(SharedSessionBackend(shared)), SessionStore(SharedSessionBackend(shared))
+        history = await first.attach(TOKEN)
+        history.append("user", "hello")
+        history.append("assistant", "hi")
+        first.release(TOKEN)
+        await first.save(TOKEN)
+
+        resumed = await second.attach(TOKEN)
+        assert [message["content"] for message in resumed.prompt_messages()] == ["hello", "hi"]
+
+    asyncio.run(scenario())
+
+
+def test_local_store_values_expire_with_their_ttl():
+    store = LocalStore()
+    store.set_many([("a", "1"), ("b", "2")], ttl=0.05)
+    store.set("c", "3")
+    assert store.get("a") == "1"
+    time.sleep(0.06)
+    assert store.get("a") is None
+    assert store.get("c") == "3"
+    assert store.delete_prefix("c") == 1
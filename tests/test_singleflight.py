@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+class UpstreamError(Exception):
+    pass
+
+
+def test_concurrent_callers_share_one_call():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def call():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        results = await asyncio.gather(*(flight.do("key", call) for _ in range(5)))
+        assert results == ["answer"] * 5
+        assert calls == 1
+        assert flight.stats()["in_flight"] == 0
+        assert (flight.counters["calls"], flight.counters["coalesced"]) == (1, 4)
+
+    asyncio.run(scenario())
+
+
+def test_error_reaches_every_waiter_and_is_not_cached():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise UpstreamError("upstream failed")
+
+        results = await asyncio.gather(*(flight.do("key", failing) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, UpstreamError) for result in results)
+        assert flight.counters["errors"] == 1
+
+        async def working():
+            return "recovered"
+
+        assert await flight.do("key", working) == "recovered"
+        assert flight.counters["calls"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_one_waiter_leaving_does_not_cancel_the_call_for_the_others():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def call():
+            await asyncio.sleep(0.02)
+            return "answer"
+
+        leaving = asyncio.create_task(flight.do("key", call))
+        staying = asyncio.create_task(flight.do("key", call))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        assert await staying == "answer"
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+        assert flight.counters["abandoned"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_call_is_cancelled_when_the_last_waiter_leaves():
+    async def scenario():
+        flight = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def call():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.create_task(flight.do("key", call)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flight.stats()["in_flight"] == 0
+        assert flight.counters["abandoned"] == 1
+
+    asyncio.run(scenario())
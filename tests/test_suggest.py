@@ -0,0 +1,56 @@
+from suggest import SCAN_LIMIT, SuggestIndex
+
+ANSWERS = {"how do refunds work": "Refunds take 5 days."}
+
+
+def make_index(**kwargs) -> SuggestIndex:
+    return SuggestIndex(ANSWERS.get, lambda: [("What is a seed phrase?", "Twelve words.")], **kwargs)
+
+
+def test_faq_entries_are_suggested_from_a_word_prefix():
+    index = make_index()
+    index.rebuild()
+    assert index.suggest("seed") == [{"question": "What is a seed phrase?", "answer": "Twelve words.",
+                                      "source": "faq"}]
+    assert index.suggest("s") == []
+
+
+def test_asked_question_needs_several_different_clients():
+    index = make_index(min_count=3)
+    for _ in range(5):
+        index.observe("How do refunds work?", "10.0.0.1")
+    index.rebuild()
+    assert index.suggest("how do ref") == []
+
+    for client in ("10.0.0.2", "10.0.0.3"):
+        index.observe("how do refunds work", client)
+    index.rebuild()
+    assert index.suggest("refunds") == [{"question": "How do refunds work?", "answer": "Refunds take 5 days.",
+                                         "source": "cache"}]
+
+
+def test_questions_with_identifiers_are_never_counted():
+    index = make_index(min_count=1)
+    index.observe("Is support@example.com your address?", "10.0.0.1")
+    index.observe("My order 1234 5678 failed", "10.0.0.1")
+    assert index.stats()["tracked"] == 0
+    assert index.counters["identifying"] == 2
+
+
+def test_question_without_a_cached_answer_is_not_suggested():
+    index = make_index(min_count=1)
+    index.observe("why is my transfer slow", "10.0.0.1")
+    index.rebuild()
+    assert index.suggest("why") == []
+
+
+def test_common_prefix_ranks_start_matches_then_most_asked():
+    answers = {f"how do i step {i}": f"answer {i}" for i in range(3 * SCAN_LIMIT)}
+    index = SuggestIndex(answers.get, lambda: [], min_count=1)
+    for i in range(3 * SCAN_LIMIT):
+        for client in range(i % 7 + 1):
+            index.observe(f"how do i step {i}", f"10.0.0.{client}")
+    index.rebuild()
+    assert "ho" in index._index.common
+    counts = [int(suggestion["answer"].split()[1]) % 7 for suggestion in index.suggest("ho", limit=5)]
+    assert counts == [6] * 5
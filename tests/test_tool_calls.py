@@ -0,0 +1,94 @@
+import asyncio
+import inspect
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import tool_calls
+from tool_calls import ToolCache, ToolRunner, search_tools, stub_search
+
+
+@pytest.fixture(autouse=True)
+def fast_stub(monkeypatch):
+    monkeypatch.setattr(tool_calls, "STUB_SEARCH_SECONDS", 0.1)
+
+
+def test_wrapped_toolkit_keeps_names_and_parameters():
+    toolkit = ToolRunner().wrap(search_tools())
+    assert list(toolkit.functions) == ["stub_search"]
+    function = toolkit.functions["stub_search"].entrypoint
+    assert asyncio.iscoroutinefunction(function)
+    assert list(inspect.signature(function).parameters) == ["query", "max_results", "agent"]
+
+
+def test_repeated_call_is_answered_from_the_cache():
+    runner = ToolRunner()
+    search = runner.wrap_function("stub_search", stub_search)
+
+    async def scenario():
+        first = await search(query="gas fees", max_results=2)
+        started = time.perf_counter()
+        second = await search(query="gas fees", max_results=2)
+        assert time.perf_counter() - started < 0.05
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == second and len(json.loads(first)) == 2
+    assert runner.counters["cached"] == 1
+
+
+def test_cached_result_expires():
+    runner = ToolRunner(cache=ToolCache(ttl=0.05))
+    search = runner.wrap_function("stub_search", stub_search)
+
+    async def scenario():
+        await search(query="gas fees")
+        await asyncio.sleep(0.06)
+        await search(query="gas fees")
+
+    asyncio.run(scenario())
+    assert (runner.counters["calls"], runner.counters["cached"]) == (2, 0)
+
+
+def test_spent_budget_returns_a_note_and_the_late_result_is_still_cached():
+    runner = ToolRunner(turn_budget=0.05)
+    search = runner.wrap_function("stub_search", stub_search)
+    agent = SimpleNamespace(run_id="run-1")
+
+    async def scenario():
+        late = await search(query="gas fees", agent=agent)
+        assert late.startswith("stub_search did not finish in time")
+        skipped = await search(query="staking", agent=agent)
+        assert skipped == "stub_search was not run: the time for tools on this question is used up."
+        # Another run has a budget of its own, and the abandoned call finished into the cache
+        await asyncio.sleep(0.1)
+        cached = await search(query="gas fees", agent=SimpleNamespace(run_id="run-2"))
+        assert json.loads(cached)[0]["title"] == "Result 1 for gas fees"
+
+    asyncio.run(scenario())
+    assert (runner.counters["timeouts"], runner.counters["skipped"], runner.counters["cached"]) == (1, 1, 1)
+
+
+def test_calls_of_one_step_run_concurrently():
+    search = ToolRunner().wrap_function("stub_search", stub_search)
+
+    async def scenario():
+        started = time.perf_counter()
+        results = await asyncio.gather(*(search(query=f"query {i}") for i in range(4)))
+        return time.perf_counter() - started, results
+
+    elapsed, results = asyncio.run(scenario())
+    assert len(set(results)) == 4
+    assert elapsed < 0.3
+
+
+def test_tool_error_is_returned_as_text():
+    def broken(query: str) -> str:
+        raise ValueError("no network")
+
+    runner = ToolRunner()
+    result = asyncio.run(runner.wrap_function("broken", broken)(query="fees"))
+    assert result == "broken failed: no network"
+    assert runner.counters["errors"] == 1
@@ -0,0 +1,31 @@
+import json
+
+from warmup import load_warm_answers
+
+
+def write_records(path, records):
+    path.write_text("\n".join(json.dumps(record) for record in records) + "\n", encoding="utf-8")
+
+
+def test_most_asked_stateless_questions_with_their_latest_answer(tmp_path):
+    path = tmp_path / "capture.jsonl"
+    write_records(path, [
+        {"question": "how do fees work", "response": "old answer", "status": "ok"},
+        {"question": "how do fees work", "response": "new answer", "status": "ok"},
+        {"question": "what is staking", "answer": "Locking coins.", "status": "ok"},
+        {"question": "why so slow", "status": "shed"},
+        {"question": "and then?", "response": "with history", "status": "ok", "turn": 2},
+    ])
+    assert load_warm_answers(str(path), 10) == [("how do fees work", "new answer"),
+                                                ("what is staking", "Locking coins.")]
+    assert load_warm_answers(str(path), 1) == [("how do fees work", "new answer")]
+
+
+def test_redacted_records_are_skipped(tmp_path):
+    path = tmp_path / "capture.jsonl"
+    write_records(path, [
+        {"question": "where do i send coins", "response": "Send them to [ADDRESS].", "status": "ok"},
+        {"question": "is [EMAIL] your support address", "response": "No.", "status": "ok"},
+        {"question": "what is staking", "response": "Locking coins.", "status": "ok"},
+    ])
+    assert load_warm_answers(str(path), 10) == [("what is staking", "Locking coins.")]
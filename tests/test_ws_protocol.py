@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+import pytest
+
+from connections import Connection
+from history import ConversationHistory
+from ws_protocol import ANY, ORDERED, SUBPROTOCOL, Pipeline, ProtocolError, parse_frame
+
+
+def test_parse_frame_accepts_asks_cancels_and_pings():
+    assert parse_frame('{"type": "ping"}') == {"type": "ping"}
+    assert parse_frame('{"type": "cancel", "id": "q1"}')["id"] == "q1"
+    assert parse_frame('{"type": "ask", "id": "q1", "content": "hi"}')["stream"] is True
+    assert parse_frame('{"type": "ask", "id": "q1", "content": "hi", "stream": false}')["stream"] is False
+
+
+@pytest.mark.parametrize("text, message_id", [
+    ("not json", None),
+    ("[1, 2]", None),
+    ('{"type": "ask", "content": "hi"}', None),
+    ('{"type": "ask", "id": "' + "x" * 65 + '", "content": "hi"}', None),
+    ('{"type": "shout", "id": "q1"}', "q1"),
+    ('{"type": "ask", "id": "q1", "content": "  "}', "q1"),
+])
+def test_parse_frame_rejects_bad_frames(text, message_id):
+    with pytest.raises(ProtocolError) as info:
+        parse_frame(text)
+    assert info.value.message_id == message_id
+
+
+def make_pipeline(order: str, delays: dict):
+    """A pipeline whose answers take delays[message_id] seconds and log their start and end"""
+    connection = Connection(None, "session", "127.0.0.1", False, ConversationHistory())
+    events = []
+
+    async def answer(message_id: str, content: str, stream: bool):
+        events.append(("start", message_id))
+        await asyncio.sleep(delays.get(message_id, 0))
+        events.append(("end", message_id))
+
+    pipeline = Pipeline(connection, answer, order)
+
+    def submit(message_id: str, content: str = "question"):
+        # The connection is charged for an ask's bytes when it is admitted
+        connection.queued_bytes += len(content)
+        pipeline.submit(message_id, content, False)
+
+    return pipeline, connection, events, submit
+
+
+def test_ordered_pipeline_answers_one_at_a_time_in_order():
+    async def scenario():
+        pipeline, connection, events, submit = make_pipeline(ORDERED, {"q1": 0.02, "q2": 0})
+        submit("q1")
+        submit("q2")
+        assert "q2" in pipeline and len(pipeline) == 2
+        await asyncio.sleep(0.05)
+        assert events == [("start", "q1"), ("end", "q1"), ("start", "q2"), ("end", "q2")]
+        assert len(pipeline) == 0 and not connection.busy and connection.queued_bytes == 0
+
+    asyncio.run(scenario())
+
+
+def test_any_order_pipeline_answers_concurrently():
+    async def scenario():
+        pipeline, connection, events, submit = make_pipeline(ANY, {"q1": 0.02, "q2": 0})
+        submit("q1")
+        submit("q2")
+        assert connection.busy
+        await asyncio.sleep(0.05)
+        assert events == [("start", "q1"), ("start", "q2"), ("end", "q2"), ("end", "q1")]
+        assert not connection.busy and connection.queued_bytes == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancel_queued_and_running_asks():
+    async def scenario():
+        pipeline, connection, events, submit = make_pipeline(ORDERED, {"q1": 10, "q2": 0})
+        submit("q1")
+        submit("q2", "a longer question")
+        await asyncio.sleep(0.01)
+
+        assert await pipeline.cancel("q2")
+        assert "q2" not in pipeline and connection.queued_bytes == 0
+        assert await pipeline.cancel("q1")
+        assert events == [("start", "q1")]
+        assert len(pipeline) == 0 and not connection.busy
+        assert not await pipeline.cancel("q1")
+
+    asyncio.run(scenario())
+
+
+def test_close_cancels_everything():
+    async def scenario():
+        pipeline, connection, events, submit = make_pipeline(ORDERED, {"q1": 10})
+        submit("q1")
+        submit("q2")
+        await asyncio.sleep(0.01)
+        await pipeline.close()
+        assert events == [("start", "q1")]
+        assert len(pipeline) == 0 and connection.queued_bytes == 0
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_id_is_refused_while_in_flight(app_client, mock_groq):
+    mock_groq.latency_ms = 300
+    with app_client.websocket_connect("/ws", subprotocols=[SUBPROTOCOL]) as ws:
+        assert ws.receive_json()["type"] == "hello"
+        ask = {"type": "ask", "id": "q1", "content": "What are the trading fees?", "stream": False}
+        ws.send_text(json.dumps(ask))
+        ws.send_text(json.dumps(ask))
+        assert ws.receive_json() == {"type": "error", "id": "q1", "code": "duplicate_id",
+                                     "detail": "An ask with this id is in flight"}
+        assert ws.receive_json()["type"] == "answer"
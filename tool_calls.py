@@ -0,0 +1,198 @@
+"""Tool execution for agents that call tools (customer_support.py).
+
+ToolRunner.wrap(toolkit) returns a toolkit whose functions are coroutines
+with the same names, parameters and docstrings, so the model sees the same
+tools. agno runs the coroutine tools of one model step concurrently
+(asyncio.gather); each wrapped call:
+
+- is answered from a TTL cache keyed on tool name and arguments when the
+  same call was made within TOOL_CACHE_TTL;
+- runs the underlying, usually blocking, function in a worker thread;
+- shares a time budget of TOOL_TURN_BUDGET seconds with the other tool
+  calls of its run (one user turn). A call still running when the budget
+  is spent, or made after it, returns a short note instead, so the model
+  answers from the results it has. The thread of a call given up on is
+  left to finish and its result is still cached;
+- is timed into support_tool_seconds by tool and outcome.
+
+Tool errors are returned to the model as text rather than failing the run.
+SEARCH_TOOL=stub swaps the web search for an offline stub.
+"""
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from metrics import TOOL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+TOOL_CACHE_TTL = float(os.getenv("TOOL_CACHE_TTL", "600"))
+TOOL_CACHE_SIZE = int(os.getenv("TOOL_CACHE_SIZE", "1024"))
+# Seconds all tool calls of one agent run may take together
+TOOL_TURN_BUDGET = float(os.getenv("TOOL_TURN_BUDGET", "8"))
+# web (live search) or stub (offline, for tests and benchmarks)
+SEARCH_TOOL = os.getenv("SEARCH_TOOL", "web")
+# Simulated latency of the stub search
+STUB_SEARCH_SECONDS = float(os.getenv("STUB_SEARCH_SECONDS", "0.5"))
+# Runs whose budgets are remembered; older ones are forgotten first
+MAX_TRACKED_RUNS = 1024
+
+
+class ToolCache:
+    """LRU + TTL cache of tool results"""
+
+    def __init__(self, max_entries: int = TOOL_CACHE_SIZE, ttl: float = TOOL_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    @staticmethod
+    def key(tool: str, arguments: Dict[str, Any]) -> Tuple[str, str]:
+        return tool, json.dumps(arguments, sort_keys=True, default=str)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ToolRunner:
+    """Caching, concurrent, time-budgeted execution of toolkit functions"""
+
+    def __init__(self, cache: Optional[ToolCache] = None, turn_budget: float = TOOL_TURN_BUDGET):
+        self.cache = cache if cache is not None else ToolCache()
+        self.turn_budget = turn_budget
+        self._deadlines: "OrderedDict[str, float]" = OrderedDict()  # agent run id -> deadline
+        self.counters = {"calls": 0, "cached": 0, "timeouts": 0, "skipped": 0, "errors": 0}
+
+    def wrap(self, toolkit):
+        """A copy of `toolkit` whose functions run through this runner"""
+        from agno.tools import Toolkit
+
+        return Toolkit(
+            name=toolkit.name,
+            tools=[self.wrap_function(name, function.entrypoint) for name, function in toolkit.functions.items()],
+            instructions=toolkit.instructions,
+            add_instructions=toolkit.add_instructions,
+        )
+
+    def wrap_function(self, name: str, function: Callable) -> Callable:
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        async def call(*, agent=None, **arguments):
+            return await self.call(name, function, arguments, getattr(agent, "run_id", None))
+
+        # agno passes the calling agent to tools that take an `agent` parameter and hides it from the model
+        call.__signature__ = signature.replace(parameters=[
+            *signature.parameters.values(), inspect.Parameter("agent", inspect.Parameter.KEYWORD_ONLY, default=None)])
+        call.__annotations__ = {**getattr(function, "__annotations__", {}), "agent": Any}
+        call.__name__ = name
+        return call
+
+    async def call(self, name: str, function: Callable, arguments: Dict[str, Any], run_id: Optional[str] = None):
+        started = time.perf_counter()
+        self.counters["calls"] += 1
+        key = ToolCache.key(name, arguments)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.counters["cached"] += 1
+            TOOL_SECONDS.labels(name, "cached").observe(time.perf_counter() - started)
+            return cached
+
+        remaining = self._remaining(run_id)
+        if remaining <= 0:
+            self.counters["skipped"] += 1
+            TOOL_SECONDS.labels(name, "skipped").observe(0)
+            return f"{name} was not run: the time for tools on this question is used up."
+
+        if inspect.iscoroutinefunction(function):
+            task = asyncio.ensure_future(function(**arguments))
+        else:
+            task = asyncio.ensure_future(asyncio.to_thread(function, **arguments))
+        task.add_done_callback(functools.partial(self._store, key))
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), remaining)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            TOOL_SECONDS.labels(name, "timeout").observe(time.perf_counter() - started)
+            logger.warning("tool call timed out", extra={"tool": name, "seconds": round(remaining, 3)})
+            return f"{name} did not finish in time ({remaining:.1f}s); answer from the other results."
+        except Exception as e:
+            self.counters["errors"] += 1
+            TOOL_SECONDS.labels(name, "error").observe(time.perf_counter() - started)
+            logger.warning("tool call failed: %s", e, extra={"tool": name})
+            return f"{name} failed: {e}"
+        TOOL_SECONDS.labels(name, "ok").observe(time.perf_counter() - started)
+        return result
+
+    def stats(self) -> dict:
+        return {"cache_size": len(self.cache), **self.counters}
+
+    def _remaining(self, run_id: Optional[str]) -> float:
+        """Seconds left in the run's budget, which starts with its first tool call"""
+        if run_id is None:
+            return self.turn_budget
+        now = time.monotonic()
+        deadline = self._deadlines.get(run_id)
+        if deadline is None:
+            deadline = self._deadlines[run_id] = now + self.turn_budget
+            while len(self._deadlines) > MAX_TRACKED_RUNS:
+                self._deadlines.popitem(last=False)
+        return deadline - now
+
+    def _store(self, key: Hashable, task: asyncio.Future):
+        if not task.cancelled() and task.exception() is None and task.result() is not None:
+            self.cache.set(key, task.result())
+
+
+def stub_search(query: str, max_results: int = 5) -> str:
+    """Search the web for a query and return the top results as JSON.
+
+    Args:
+        query (str): The query to search for.
+        max_results (int): Maximum number of results to return.
+
+    Returns:
+        str: JSON list of results with title, href and body.
+    """
+    time.sleep(STUB_SEARCH_SECONDS)
+    return json.dumps([
+        {"title": f"Result {i + 1} for {query}", "href": f"https://example.com/{i + 1}",
+         "body": f"Offline stub result {i + 1} about {query}."}
+        for i in range(max_results)
+    ])
+
+
+def search_tools():
+    """The web search toolkit selected by SEARCH_TOOL"""
+    from agno.tools import Toolkit
+
+    if SEARCH_TOOL == "stub":
+        return Toolkit(name="stub_search", tools=[stub_search])
+    try:
+        from agno.tools import WebSearchTools
+    except ImportError:
+        # Older agno releases ship the same search as DuckDuckGoTools
+        from agno.tools.duckduckgo import DuckDuckGoTools as WebSearchTools
+    return WebSearchTools()
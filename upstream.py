@@ -0,0 +1,193 @@
+import asyncio
+import io
+import logging
+import os
+import time
+from contextlib import redirect_stdout
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+
+from admission import AdmissionController
+from profiling import record_span, span
+from metrics import (
+    MODEL_COST_USD, QUEUE_WAIT_SECONDS, TIME_TO_FIRST_TOKEN_SECONDS, TOKENS, TOKENS_PER_SECOND, UPSTREAM_SECONDS,
+)
+
+# Connection pool and concurrency settings for calls to Groq
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "100"))
+GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "20"))
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "60"))
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "32"))
+# Retries are done by resilience.py, which knows the request deadline
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "0"))
+# USD per million input/output tokens, as model=input/output pairs, for the cost metric
+MODEL_PRICES = os.getenv(
+    "MODEL_PRICES", "llama-3.1-8b-instant=0.05/0.08,llama-3.3-70b-versatile=0.59/0.79")
+
+# groq and agno take most of the import time, so they are imported on first use
+if TYPE_CHECKING:
+    from agno.models.groq import Groq
+    from groq import AsyncGroq
+
+logger = logging.getLogger(__name__)
+
+def parse_prices(spec: str) -> Dict[str, Tuple[float, float]]:
+    prices = {}
+    for item in spec.split(","):
+        model, _, price = item.strip().partition("=")
+        if model and price:
+            input_price, _, output_price = price.partition("/")
+            prices[model.strip()] = (float(input_price), float(output_price or input_price))
+    return prices
+
+
+_prices = parse_prices(MODEL_PRICES)
+_async_client: Optional["AsyncGroq"] = None
+# Limits concurrent calls and queues or sheds the rest (admission.py)
+admission = AdmissionController(UPSTREAM_CONCURRENCY)
+
+
+def get_async_client() -> "AsyncGroq":
+    """Return the process-wide AsyncGroq client, creating it on first use.
+
+    agno's Groq.get_async_client builds a new httpx.AsyncClient on every call,
+    so models are handed this client instead and share one connection pool.
+    """
+    from groq import AsyncGroq
+
+    global _async_client
+    if _async_client is None or _async_client.is_closed():
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=GROQ_MAX_CONNECTIONS,
+                max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+            ),
+            timeout=GROQ_TIMEOUT,
+        )
+        _async_client = AsyncGroq(http_client=http_client, max_retries=GROQ_MAX_RETRIES)
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
+
+async def warm_connections(count: int):
+    """Open `count` pooled connections to Groq so the first requests skip DNS and TLS setup"""
+    client = get_async_client()
+    results = await asyncio.gather(*(client.models.list() for _ in range(count)), return_exceptions=True)
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if failures:
+        logger.warning("connection warm-up failed for %d of %d connections: %s", len(failures), count, failures[0])
+
+
+def groq_model(model_id: str) -> "Groq":
+    """Groq model bound to the shared async client"""
+    from agno.models.groq import Groq
+
+    return Groq(id=model_id, async_client=get_async_client())
+
+
+def _model_id(agent) -> str:
+    return getattr(agent.model, "id", None) or "unknown"
+
+
+async def _acquire_slot() -> float:
+    """Wait for an upstream slot (raises admission.Overloaded when shed); returns when it was granted"""
+    started = time.perf_counter()
+    await admission.acquire()
+    granted = time.perf_counter()
+    QUEUE_WAIT_SECONDS.labels().observe(granted - started)
+    record_span("queue", granted - started)
+    return granted
+
+
+def _record_usage(model: str, mode: str, elapsed: float, input_tokens: int, output_tokens: int):
+    UPSTREAM_SECONDS.labels(model, mode).observe(elapsed)
+    TOKENS.labels(model, "input").inc(input_tokens)
+    TOKENS.labels(model, "output").inc(output_tokens)
+    if output_tokens and elapsed > 0:
+        TOKENS_PER_SECOND.labels(model).observe(output_tokens / elapsed)
+    price = _prices.get(model)
+    if price is not None:
+        MODEL_COST_USD.labels(model).inc((input_tokens * price[0] + output_tokens * price[1]) / 1_000_000)
+
+
+def response_tokens(response) -> Tuple[int, int]:
+    """(input, output) tokens of a RunResponse, summed over its model calls"""
+    usage = getattr(response, "metrics", None) or {}
+    return sum(usage.get("input_tokens", ())), sum(usage.get("output_tokens", ()))
+
+
+async def run_agent(agent, message: Any = None, **kwargs) -> Any:
+    """Run an agent without blocking the event loop.
+
+    At most UPSTREAM_CONCURRENCY runs are in flight at once; the rest wait
+    here for a free slot or are shed by admission control.
+    """
+    started = await _acquire_slot()
+    try:
+        with span("agent_run"):
+            response = await agent.arun(message, stream=False, **kwargs)
+        _record_usage(_model_id(agent), "run", time.perf_counter() - started, *response_tokens(response))
+        return response
+    finally:
+        admission.release(time.perf_counter() - started)
+
+
+async def stream_agent(agent, message: Any = None, **kwargs) -> AsyncIterator[str]:
+    """Run an agent in streaming mode and yield the text deltas as they arrive.
+
+    The upstream slot is held until the stream is exhausted or closed.
+    """
+    from agno.run.response import RunEvent
+
+    started = await _acquire_slot()
+    events = None
+    try:
+        model = _model_id(agent)
+        chars = 0
+        events = await agent.arun(message, stream=True, **kwargs)
+        async for event in events:
+            kind = getattr(event, "event", None)
+            if kind == RunEvent.run_response_content.value and event.content:
+                delta = str(event.content)
+                if not chars:
+                    TIME_TO_FIRST_TOKEN_SECONDS.labels(model).observe(time.perf_counter() - started)
+                    record_span("first_token", time.perf_counter() - started)
+                chars += len(delta)
+                yield delta
+            elif kind == RunEvent.run_error.value:
+                raise RuntimeError(event.content or "Model run failed")
+        # Stream events carry no usage; estimate output like history.estimate_tokens does
+        _record_usage(model, "stream", time.perf_counter() - started, 0, chars // 4 + 1 if chars else 0)
+    finally:
+        try:
+            # Ends the model's HTTP stream (and returns a pooled agent) when the client stops early
+            if hasattr(events, "aclose"):
+                await events.aclose()
+        finally:
+            admission.release(time.perf_counter() - started)
+
+
+def extract_response_text(response) -> str:
+    """Get the text content out of a RunResponse"""
+    # Try multiple possible response attributes
+    response_text = getattr(response, 'content',
+                  getattr(response, 'text',
+                  getattr(response, 'response', str(response))))
+
+    # If the above doesn't work, try the pretty print function's output
+    if not response_text:
+        from agno.utils.pprint import pprint_run_response
+
+        f = io.StringIO()
+        with redirect_stdout(f):
+            pprint_run_response(response, markdown=True)
+        response_text = f.getvalue()
+
+    return str(response_text)
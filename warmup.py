@@ -0,0 +1,91 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+from structured_log import has_redactions
+from upstream import warm_connections
+
+logger = logging.getLogger(__name__)
+
+# Groq connections opened before the first request
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "2"))
+# JSONL of {"question", "answer"} records, or a capture file (capture.py), to preload the answer cache.
+# Records with redaction placeholders are skipped, so captures meant for this need CAPTURE_REDACT=0
+WARM_CACHE_PATH = os.getenv("WARM_CACHE_PATH", "")
+WARM_CACHE_ENTRIES = int(os.getenv("WARM_CACHE_ENTRIES", "200"))
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "10"))
+
+
+def load_warm_answers(path: str, limit: int) -> List[Tuple[str, str]]:
+    """The `limit` most frequently asked stateless questions in `path`, with their latest answer.
+
+    Records redacted by the capture (CAPTURE_REDACT) are skipped: their
+    placeholders must not be served as answers.
+    """
+    counts: Counter = Counter()
+    answers: Dict[str, str] = {}
+    redacted = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            question = record.get("question")
+            answer = record.get("answer") or record.get("response")
+            # Later WebSocket turns were answered with history and are not reusable
+            if not question or not answer or record.get("status", "ok") != "ok" or record.get("turn", 1) != 1:
+                continue
+            if has_redactions(question) or has_redactions(answer):
+                redacted += 1
+                continue
+            counts[question] += 1
+            answers[question] = answer
+    if redacted:
+        logger.warning("skipped redacted records in the warm cache file", extra={"records": redacted, "path": path})
+    return [(question, answers[question]) for question, _ in counts.most_common(limit)]
+
+
+class Startup:
+    """Times the startup phases; the process is ready once warm-up has finished"""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.ready = False
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        phase_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round(time.perf_counter() - phase_started, 3)
+
+    async def warm_up(self, answer_cache):
+        """Open upstream connections and preload cached answers, then mark the process ready.
+
+        Failures are logged and do not hold readiness back; requests then pay
+        the setup cost themselves.
+        """
+        try:
+            if WARMUP_CONNECTIONS > 0:
+                with self.phase("warm_connections"):
+                    await asyncio.wait_for(warm_connections(WARMUP_CONNECTIONS), WARMUP_TIMEOUT)
+            if WARM_CACHE_PATH:
+                with self.phase("warm_cache"):
+                    pairs = await asyncio.to_thread(load_warm_answers, WARM_CACHE_PATH, WARM_CACHE_ENTRIES)
+                    for question, answer in pairs:
+                        answer_cache.set(question, answer)
+                self.timings["warm_cache_entries"] = len(pairs)
+        except Exception as e:
+            logger.warning("startup warm-up failed: %s", e)
+        finally:
+            self.ready = True
+            self.timings["ready"] = round(time.perf_counter() - self.started, 3)
+            logger.info("ready", extra={"startup": self.timings})
@@ -0,0 +1,185 @@
+"""Version 2 of the /ws protocol: JSON frames with message ids, pipelining and cancellation.
+
+Clients opt in with the "support.v2" WebSocket subprotocol (or /ws?protocol=2).
+Plain-text clients and the /ws?stream=1 frames are unchanged.
+
+Client frames:
+
+    {"type": "ask", "id": "q1", "content": "...", "stream": true}
+    {"type": "cancel", "id": "q1"}
+    {"type": "ping"}
+
+Server frames carry the id of the ask they answer:
+
+    {"type": "hello", "v": 2, "session": "...", "order": "ordered", "max_in_flight": 5}
+    {"type": "start", "id": "q1"} {"type": "delta", "id": "q1", "content": "..."} {"type": "end", "id": "q1"}
+    {"type": "answer", "id": "q1", "content": "..."}      (asks with "stream": false)
+    {"type": "error", "id": "q1", "code": "overloaded", "detail": "...", "retry_after": 3}
+    {"type": "cancelled", "id": "q1"}
+    {"type": "pong"}
+    {"type": "reconnect", "session": "...", "retry_after": 1.7}   (before a 1012 close on restart)
+
+The server also sends {"type": "ping"} heartbeats (connections.py), which
+need no reply.
+
+Asks may be sent without waiting for replies. With /ws?order=ordered (the
+default) they are answered one at a time in the order sent; with
+/ws?order=any up to WS_MAX_PENDING + 1 are answered concurrently and replies
+arrive as they finish. Each ask is answered with the conversation as it stood
+when the ask started, and joins it once answered, so concurrent asks never
+see each other's unanswered questions. Cancelling an ask that is being answered cancels its
+task, which closes the model stream and frees its upstream slot. A
+non-streamed ask may share its model call with identical questions from
+other clients (singleflight.py); that call is only cancelled once every
+ask waiting on it is gone.
+
+Compression is per-message-deflate, negotiated by uvicorn itself when the
+client offers it (--ws-per-message-deflate, on by default); ASGI apps have
+no say in it.
+"""
+import asyncio
+import json
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from fastapi import WebSocket
+
+from admission import WS_MAX_PENDING
+from connections import Connection
+
+PROTOCOL_VERSION = 2
+SUBPROTOCOL = "support.v2"
+# Longest message id accepted from a client
+MAX_ID_CHARS = 64
+
+ORDERED = "ordered"
+ANY = "any"
+
+
+class ProtocolError(Exception):
+    """A client frame that does not follow the protocol"""
+
+    def __init__(self, detail: str, message_id: Optional[str] = None):
+        super().__init__(detail)
+        self.message_id = message_id
+
+
+def negotiate(websocket: WebSocket) -> Optional[str]:
+    """The subprotocol to accept if the client asked for version 2, "" for ?protocol=2, else None"""
+    if SUBPROTOCOL in websocket.scope.get("subprotocols", ()):
+        return SUBPROTOCOL
+    if websocket.query_params.get("protocol") == str(PROTOCOL_VERSION):
+        return ""
+    return None
+
+
+def reply_order(websocket: WebSocket) -> str:
+    order = websocket.query_params.get("order", ORDERED)
+    return order if order in (ORDERED, ANY) else ORDERED
+
+
+def parse_frame(text: str) -> dict:
+    """Decode and validate a client frame"""
+    try:
+        frame = json.loads(text)
+    except ValueError:
+        raise ProtocolError("Frames must be JSON objects") from None
+    if not isinstance(frame, dict):
+        raise ProtocolError("Frames must be JSON objects")
+    kind = frame.get("type")
+    if kind == "ping":
+        return frame
+    message_id = frame.get("id")
+    if not isinstance(message_id, str) or not message_id or len(message_id) > MAX_ID_CHARS:
+        raise ProtocolError(f"{kind or 'Frame'} needs an id of 1 to {MAX_ID_CHARS} characters")
+    if kind == "cancel":
+        return frame
+    if kind != "ask":
+        raise ProtocolError(f"Unknown frame type {kind!r}", message_id)
+    if not isinstance(frame.get("content"), str) or not frame["content"].strip():
+        raise ProtocolError("ask needs a non-empty content string", message_id)
+    frame["stream"] = frame.get("stream", True) is not False
+    return frame
+
+
+class Pipeline:
+    """Answers the asks of one connection, in order or concurrently, and cancels them on request.
+
+    `answer(message_id, content, stream)` does the work and sends the reply
+    frames; the pipeline keeps the connection's busy flag and queued bytes
+    up to date for idle reaping and drain.
+    """
+
+    def __init__(self, connection: Connection, answer: Callable[[str, str, bool], Awaitable[None]],
+                 order: str = ORDERED, max_in_flight: int = WS_MAX_PENDING + 1):
+        self.connection = connection
+        self.answer = answer
+        self.order = order
+        self.max_in_flight = max_in_flight
+        self._queue: Deque[Tuple[str, str, bool]] = deque()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._worker: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._tasks) + len(self._queue)
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self._tasks or any(item[0] == message_id for item in self._queue)
+
+    def submit(self, message_id: str, content: str, stream: bool):
+        """Queue or start an ask whose bytes the connection has already been charged for"""
+        if self.order == ANY:
+            self._start(message_id, content, stream)
+            return
+        self._queue.append((message_id, content, stream))
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run_in_order())
+
+    async def cancel(self, message_id: str) -> bool:
+        """Stop an ask, queued or running; False if it is unknown or already answered"""
+        for item in self._queue:
+            if item[0] == message_id:
+                self._queue.remove(item)
+                self.connection.queued_bytes -= len(item[1])
+                return True
+        task = self._tasks.get(message_id)
+        if task is None:
+            return False
+        task.cancel()
+        # Wait for it, so no frame of the cancelled answer follows the "cancelled" frame
+        await asyncio.wait({task})
+        return True
+
+    async def close(self):
+        """Cancel everything; the client has gone"""
+        for _, content, _ in self._queue:
+            self.connection.queued_bytes -= len(content)
+        self._queue.clear()
+        tasks = list(self._tasks.values())
+        if self._worker is not None:
+            tasks.append(self._worker)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+
+    def _start(self, message_id: str, content: str, stream: bool) -> asyncio.Task:
+        self.connection.queued_bytes -= len(content)
+        task = asyncio.create_task(self.answer(message_id, content, stream))
+        self._tasks[message_id] = task
+        self.connection.busy = True
+        task.add_done_callback(lambda _: self._finished(message_id))
+        return task
+
+    def _finished(self, message_id: str):
+        self._tasks.pop(message_id, None)
+        self.connection.busy = bool(self._tasks)
+
+    async def _run_in_order(self):
+        try:
+            while self._queue:
+                task = self._start(*self._queue.popleft())
+                # A cancelled ask must not stop the ones behind it
+                await asyncio.wait({task})
+        finally:
+            self._worker = None